@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+"""
+Keystroke latency of /api/autocomplete.
+
+Types each word one character at a time, the way a search box would call
+the endpoint, and times every request. Each word is typed twice: the first
+pass mostly misses the per-worker prefix cache and shows what the indexes
+cost, the second shows the cached path. Latencies are grouped by prefix
+length, where the short prefixes are the ones with the most matches.
+
+    python benchmarks/autocomplete.py --url http://localhost:5051
+    python benchmarks/autocomplete.py --words alice '#coffee' '$abcd' --type tags
+"""
+
+import argparse
+import time
+import urllib.parse
+import urllib.request
+
+from load_compare import percentile
+
+DEFAULT_WORDS = ['john', 'maria', 'smith', 'alex', '#love', '#coffee', '#travel', 'data', 'the', 'xyz']
+
+
+def timed_get(url):
+    start_time = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+    return (time.perf_counter() - start_time) * 1000
+
+
+def type_words(base_url, words, kind):
+    """Latencies in ms keyed by prefix length"""
+    latencies = {}
+    for word in words:
+        for length in range(1, len(word) + 1):
+            query = urllib.parse.urlencode({'q': word[:length], 'type': kind})
+            latencies.setdefault(length, []).append(timed_get(f"{base_url}/api/autocomplete?{query}"))
+    return latencies
+
+
+def report(title, latencies, budget):
+    print(f"\n{title}")
+    print(f"{'prefix length':<15}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    over = 0
+    for length in sorted(latencies):
+        values = sorted(latencies[length])
+        over += sum(1 for value in values if value > budget)
+        print(f"{length:<15}{len(values):>10}{percentile(values, 0.50):>10.1f}"
+              f"{percentile(values, 0.95):>10.1f}{values[-1]:>10.1f}")
+    total = sum(len(values) for values in latencies.values())
+    print(f"{over} of {total} requests over {budget} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time /api/autocomplete one keystroke at a time')
+    parser.add_argument('--url', default='http://localhost:5051', help='Base URL of the site')
+    parser.add_argument('--words', nargs='+', default=DEFAULT_WORDS, help='Words to type')
+    parser.add_argument('--type', default='all', choices=['users', 'tags', 'all'], help='What to suggest')
+    parser.add_argument('--budget', type=float, default=20, help='Latency target per keystroke in ms')
+    args = parser.parse_args()
+
+    report('First pass (cold cache)', type_words(args.url, args.words, args.type), args.budget)
+    report('Second pass (warm cache)', type_words(args.url, args.words, args.type), args.budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""
+Compares the sync (Flask) and async (project/async_app.py) serving paths
+under the same concurrent load.
+
+Each target gets `--concurrency` client threads that loop over the read-only
+route mix for `--duration` seconds. The script prints throughput and latency
+percentiles for each, so the two can be compared side by side.
+
+Inside the prod stack both apps are reachable from the web container:
+
+    docker compose -f docker-compose.prod.yml exec web \
+        python benchmarks/load_compare.py --sync http://web:5000 --async http://web_async:5001
+"""
+
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROUTES = [
+    '/',
+    '/tweets',
+    '/tweets?page=50',
+    '/all_messages',
+    '/all_messages?page=20',
+    '/search?query=hello',
+    '/api/data',
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def client_loop(base_url, routes, headers, deadline, offset, latencies, errors, lock):
+    """Request the route mix in order, starting at `offset`, until the deadline"""
+    i = offset
+    while time.monotonic() < deadline:
+        url = base_url + routes[i % len(routes)]
+        i += 1
+        start_time = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30) as response:
+                response.read()
+            elapsed = (time.perf_counter() - start_time) * 1000
+            with lock:
+                latencies.append(elapsed)
+        except (urllib.error.URLError, OSError):
+            with lock:
+                errors.append(url)
+
+
+def run_load(base_url, concurrency, duration, routes=ROUTES, headers=None):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset in range(concurrency):
+            pool.submit(client_loop, base_url, routes, headers or {}, deadline, offset, latencies, errors, lock)
+    elapsed = time.monotonic() - start_time
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync and async serving under load')
+    parser.add_argument('--sync', dest='sync_url', default='http://web:5000', help='Base URL of the Flask app')
+    parser.add_argument('--async', dest='async_url', default='http://web_async:5001', help='Base URL of the async app')
+    parser.add_argument('--concurrency', type=int, default=100, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=int, default=30, help='Seconds to run each target for')
+    args = parser.parse_args()
+
+    results = {}
+    for label, url in [('sync', args.sync_url), ('async', args.async_url)]:
+        print(f"Running {args.concurrency} clients against {label} ({url}) for {args.duration}s...")
+        results[label] = run_load(url, args.concurrency, args.duration)
+
+    print(f"\n{'':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>10}")
+    for label, result in results.items():
+        print(f"{label:<8}{result['rps']:>10.1f}{result['p50']:>10.1f}"
+              f"{result['p95']:>10.1f}{result['p99']:>10.1f}{result['errors']:>10}")
+
+
+if __name__ == "__main__":
+    main()
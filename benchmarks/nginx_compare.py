@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+"""
+Measures what nginx adds in front of gunicorn: upstream keepalive,
+micro-caching of anonymous GETs, gzip and long-lived static caching.
+
+The same anonymous route mix is run against gunicorn directly ("before") and
+through nginx ("after"), with the same client settings as load_compare.py,
+and throughput and latency percentiles are printed for both. Clients send
+Accept-Encoding: gzip, so the nginx numbers include compression.
+
+Inside the prod stack both are reachable from the web container:
+
+    docker compose -f docker-compose.prod.yml exec web \
+        python benchmarks/nginx_compare.py --before http://web:5000 --after http://nginx
+"""
+
+import argparse
+
+from load_compare import run_load
+
+ROUTES = [
+    '/',
+    '/tweets',
+    '/tweets?page=50',
+    '/all_messages',
+    '/api/data',
+    '/static/hello.txt',
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gunicorn with and without nginx in front')
+    parser.add_argument('--before', default='http://web:5000', help='Base URL of gunicorn itself')
+    parser.add_argument('--after', default='http://nginx', help='Base URL of nginx')
+    parser.add_argument('--concurrency', type=int, default=100, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=int, default=30, help='Seconds to run each target for')
+    args = parser.parse_args()
+
+    headers = {'Accept-Encoding': 'gzip'}
+    results = {}
+    for label, url in [('before', args.before), ('after', args.after)]:
+        print(f"Running {args.concurrency} clients against {label} ({url}) for {args.duration}s...")
+        results[label] = run_load(url, args.concurrency, args.duration, routes=ROUTES, headers=headers)
+
+    print(f"\n{'':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>10}")
+    for label, result in results.items():
+        print(f"{label:<8}{result['rps']:>10.1f}{result['p50']:>10.1f}"
+              f"{result['p95']:>10.1f}{result['p99']:>10.1f}{result['errors']:>10}")
+    print(f"\nnginx served {results['after']['rps'] / max(results['before']['rps'], 0.001):.1f}x the requests per second")
+
+
+if __name__ == "__main__":
+    main()
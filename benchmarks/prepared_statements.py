@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+"""
+Planning time saved by the prepared statement registry.
+
+Takes the statements registered in project.prepared_statements, the ones
+behind /, /all_messages, /tweets, /search and the tweet batch lookups, and
+runs each one both ways on the same connection: as plain SQL, the way the
+app ran it before, and by name after a PREPARE. For each it prints the
+planning time EXPLAIN ANALYZE reports and the mean round trip over
+--repeat runs. Postgres switches a prepared statement to a generic plan
+after five executions, so both are measured after a warm-up.
+
+Run from the repo root, with the web app's requirements installed:
+
+    python benchmarks/prepared_statements.py --repeat 500
+"""
+
+import sqlalchemy
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import argparse
+import json
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+# Check if running on host or in container
+if os.path.exists('/.dockerenv'):
+    env_file = '.env.dev.container'
+else:
+    env_file = '.env.dev.host'
+
+load_dotenv(env_file)
+
+db_url = os.environ['DATABASE_URL']
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'services', 'web'))
+
+from project import prepared_statements  # noqa: E402
+from project.prepared import PreparedStatements  # noqa: E402
+
+# Runs before Postgres settles on a generic plan for a prepared statement
+WARMUP = 6
+
+
+def sample_params(session):
+    """Parameters that find rows in the dev database, for every statement that needs them"""
+    account = session.execute(text("SELECT username, password FROM accounts LIMIT 1")).first()
+    ids = session.execute(text("SELECT id_tweets FROM tweets ORDER BY created_at DESC LIMIT 20")).scalars().all()
+    page = {'limit': 20, 'offset': 0}
+    return {
+        'check_credentials': {'username': account.username, 'password': account.password} if account else None,
+        'messages_count': {},
+        'messages_page': page,
+        'tweets_count': {},
+        'tweets_by_id': {'ids': ids},
+        'tweet_tags_by_id': {'ids': ids},
+        'tweet_media_by_id': {'ids': ids},
+        'search_count': {'tsquery': "'coffe'"},
+        'search_page': dict(page, tsquery="'coffe'"),
+        'tweet_search_count': {'tsquery': "'coffe'"},
+        'tweet_search_page_rank': dict(page, tsquery="'coffe'"),
+        'tweet_search_page_newest': dict(page, tsquery="'coffe'"),
+    }
+
+
+def planning_ms(session, sql, params):
+    result = session.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params).scalar()
+    return (json.loads(result) if isinstance(result, str) else result)[0]['Planning Time']
+
+
+def mean_ms(session, statement, params, repeat):
+    for _ in range(WARMUP):
+        session.execute(statement, params).all()
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        session.execute(statement, params).all()
+    return (time.perf_counter() - start_time) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare plain and prepared runs of the hot statements')
+    parser.add_argument('--repeat', type=int, default=200, help='Timed runs per statement and mode')
+    args = parser.parse_args()
+
+    # Prepared on this engine's connections whatever PREPARED_STATEMENTS says
+    registry = PreparedStatements(enabled=True)
+    registry.statements = dict(prepared_statements.statements)
+    engine = sqlalchemy.create_engine(db_url, pool_size=1, max_overflow=0)
+    registry.install([engine])
+
+    with Session(engine) as session:
+        params_by_name = sample_params(session)
+
+        print(f"{'statement':<28}{'plan ms':>10}{'prepared':>10}{'run ms':>10}{'prepared':>10}{'change':>9}")
+        for name, params in params_by_name.items():
+            statement = registry.statements[name]
+            if params is None:
+                print(f"{name:<28} skipped, no sample data")
+                continue
+            try:
+                plain_plan = planning_ms(session, statement.plain_sql.text, params)
+                plain_run = mean_ms(session, statement.plain_sql, params, args.repeat)
+                prepared_run = mean_ms(session, statement.execute_sql, params, args.repeat)
+                # After the warm-up the plan is the generic one
+                prepared_plan = planning_ms(session, statement.execute_sql.text, params)
+            except Exception as e:
+                session.rollback()
+                print(f"{name:<28} error: {e}")
+                continue
+            change = (prepared_run - plain_run) / plain_run * 100 if plain_run else 0
+            print(f"{name:<28}{plain_plan:>10.3f}{prepared_plan:>10.3f}"
+                  f"{plain_run:>10.3f}{prepared_run:>10.3f}{change:>+8.0f}%")
+            session.rollback()
+
+
+if __name__ == "__main__":
+    main()
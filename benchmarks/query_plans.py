@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+
+"""
+Plan regression checks for the hot SQL.
+
+Runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on the queries behind /,
+/all_messages, /tweets, the tweet batch lookup, /search (messages and
+tweets), the per-user timelines and the deletes in
+cleanup_duplicate_accounts.py, and checks each plan against what it is
+supposed to look like: which index it uses, that it never falls back to a
+Seq Scan on a big table, and how many shared buffers it may touch. Every
+statement runs inside a transaction that is rolled back, so the deletes
+don't delete anything. The app's queries are imported from the web app
+rather than copied, so the checks always test what it runs.
+
+The script exits with status 1 if any check fails, so it can gate a build.
+Plans depend on table sizes, so seed a realistic amount of data first,
+either yourself or with --seed-users/--seed-tweets (passed on to
+load_test_data.py). Search expects the RUM indexes that `manage.py sync_indexes` builds.
+
+Run from the repo root:
+
+    python benchmarks/query_plans.py --seed-users 100000 --seed-tweets 100000
+    python benchmarks/query_plans.py --verbose
+"""
+
+import sqlalchemy
+from sqlalchemy import text
+import argparse
+import json
+import os
+import subprocess
+import sys
+from dotenv import load_dotenv
+
+# Check if running on host or in container
+if os.path.exists('/.dockerenv'):
+    env_file = '.env.dev.container'
+else:
+    env_file = '.env.dev.host'
+
+load_dotenv(env_file)
+
+db_url = os.environ['DATABASE_URL']
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'services', 'web'))
+
+# The checks run the app's own statements, so they follow any change to them
+from project import SEARCH_SQL, TWEETS_BY_ID_SQL  # noqa: E402
+from project import read_model, timelines, tweet_search  # noqa: E402
+
+# Each check is one statement as the app or a script runs it, and what its plan
+# must look like:
+#   indexes     - at least one of these indexes appears in the plan
+#   no_seq_scan - tables that must not be read with a Seq Scan
+#   max_buffers - shared blocks hit + read, for the whole statement
+CHECKS = [
+    {
+        'name': 'root: 20 newest messages',
+        'sql': read_model.MESSAGES_PAGE_SQL,
+        'params': {'limit': 20, 'offset': 0},
+        'indexes': ['idx_messages_created_at'],
+        'no_seq_scan': ['messages', 'accounts'],
+        'max_buffers': 1000,
+    },
+    {
+        'name': 'all_messages: page 20',
+        'sql': read_model.MESSAGES_PAGE_SQL,
+        'params': {'limit': 50, 'offset': 950},
+        'indexes': ['idx_messages_created_at'],
+        'no_seq_scan': ['messages', 'accounts'],
+        'max_buffers': 10000,
+    },
+    {
+        'name': 'tweets: page 1',
+        'sql': read_model.TWEETS_PAGE_SQL,
+        'params': {'limit': 20, 'offset': 0},
+        'indexes': ['idx_tweets_created_at'],
+        'no_seq_scan': ['tweets', 'users'],
+        'max_buffers': 1000,
+    },
+    {
+        'name': 'tweet batch: 20 tweets by id',
+        'sql': TWEETS_BY_ID_SQL,
+        'indexes': ['tweet_ids_pkey'],
+        'no_seq_scan': ['tweets', 'tweet_ids'],
+        'max_buffers': 1000,
+    },
+    {
+        'name': 'search: ranked full-text match',
+        'sql': SEARCH_SQL,
+        'params': {'tsquery': "'coffe'", 'limit': 20, 'offset': 0},
+        'indexes': ['idx_messages_rum_text_timestamp', 'idx_messages_rum_advanced'],
+        'no_seq_scan': ['messages'],
+        'max_buffers': 20000,
+    },
+    {
+        'name': 'search: ranked tweet match in one language',
+        'sql': tweet_search.search_sql(('lang',), 'rank')[1],
+        'params': {'tsquery': "'coffe'", 'lang': 'en', 'limit': 30, 'offset': 0},
+        'indexes': ['idx_tweets_rum_text_rank'],
+        'no_seq_scan': ['tweets'],
+        'max_buffers': 20000,
+    },
+    {
+        'name': 'search: newest tweet matches',
+        'sql': tweet_search.search_sql((), 'newest')[1],
+        'params': {'tsquery': "'coffe'", 'limit': 30, 'offset': 0},
+        'indexes': ['idx_tweets_rum_text_created_at'],
+        'no_seq_scan': ['tweets'],
+        'max_buffers': 20000,
+    },
+    {
+        'name': 'user timeline: tweets by one user',
+        'sql': """
+            SELECT id_tweets, created_at
+            FROM tweets
+            WHERE id_users = :id_users
+            ORDER BY created_at DESC, id_tweets DESC
+            LIMIT 20
+        """,
+        'indexes': ['idx_tweets_id_users_created_at'],
+        'no_seq_scan': ['tweets'],
+        'max_buffers': 200,
+    },
+    {
+        'name': 'message timeline: messages by one user',
+        'sql': timelines.message_timeline_sql(False, False),
+        'params': {'limit': 21},
+        'indexes': ['idx_messages_id_users_created_at', 'messages_pkey'],
+        'no_seq_scan': ['messages'],
+        'max_buffers': 200,
+    },
+    {
+        'name': 'cleanup: find a user\'s tweets',
+        'sql': "SELECT id_tweets FROM tweets WHERE id_users = :id_users",
+        'indexes': ['idx_tweets_id_users_created_at'],
+        'no_seq_scan': ['tweets'],
+        'max_buffers': 500,
+    },
+    {
+        'name': 'cleanup: delete a user\'s messages',
+        'sql': "DELETE FROM messages WHERE id_users = :id_users RETURNING id_message",
+        'indexes': ['messages_pkey', 'idx_messages_id_users_created_at'],
+        'no_seq_scan': ['messages'],
+        'max_buffers': 500,
+    },
+    {
+        'name': 'cleanup: delete a user\'s mentions',
+        'sql': "DELETE FROM tweet_mentions WHERE id_users = :id_users",
+        'indexes': ['idx_tweet_mentions_id_users'],
+        'no_seq_scan': ['tweet_mentions'],
+        'max_buffers': 500,
+    },
+    {
+        'name': 'cleanup: delete the account',
+        'sql': "DELETE FROM accounts WHERE id_users = :id_users",
+        'indexes': ['accounts_pkey'],
+        'no_seq_scan': ['accounts'],
+        'max_buffers': 100,
+    },
+]
+
+
+def seed(engine, num_users, num_tweets):
+    """Add data with load_test_data.py, after whatever ids are already taken"""
+    with engine.connect() as connection:
+        user_id_start = connection.execute(text("SELECT COALESCE(MAX(id_users), 0) + 1 FROM users")).scalar()
+        tweet_id_start = connection.execute(text("SELECT COALESCE(MAX(id_tweets), 0) + 1 FROM tweets")).scalar()
+
+    print(f"Seeding {num_users} users and {num_tweets} tweets...")
+    subprocess.run([
+        sys.executable, os.path.join(REPO_ROOT, 'load_test_data.py'),
+        '--users', str(num_users), '--tweets', str(num_tweets),
+        '--user_id_start', str(user_id_start), '--tweet_id_start', str(tweet_id_start),
+    ], cwd=REPO_ROOT, check=True)
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(connection, sql, params):
+    # The app's statements are TextClauses; the scripts' are plain strings
+    sql = getattr(sql, 'text', sql)
+    result = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params).scalar()
+    return (json.loads(result) if isinstance(result, str) else result)[0]
+
+
+def partition_parents(connection):
+    """
+    Map each partition, and each partition's piece of an index, to the
+    partitioned table or index it belongs to, so plans over partitioned
+    tables are checked against the names in CHECKS
+    """
+    rows = connection.execute(text("""
+        SELECT child.relname, parent.relname
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+    """)).all()
+    return dict(rows)
+
+
+def check_plan(check, plan, parents=None):
+    """Return a list of the ways `plan` breaks `check`"""
+    parents = parents or {}
+    nodes = list(plan_nodes(plan['Plan']))
+    problems = []
+
+    used_indexes = {parents.get(node['Index Name'], node['Index Name']) for node in nodes if 'Index Name' in node}
+    if check.get('indexes') and not used_indexes & set(check['indexes']):
+        problems.append(f"uses none of {check['indexes']} (uses {sorted(used_indexes) or 'no index'})")
+
+    for node in nodes:
+        table = parents.get(node.get('Relation Name'), node.get('Relation Name'))
+        if node['Node Type'] == 'Seq Scan' and table in check.get('no_seq_scan', []):
+            problems.append(f"Seq Scan on {node['Relation Name']}")
+
+    buffers = plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0)
+    if 'max_buffers' in check and buffers > check['max_buffers']:
+        problems.append(f"touched {buffers} shared buffers (budget {check['max_buffers']})")
+
+    return problems
+
+
+def sample_params(connection):
+    """
+    Ids of a user that has both messages and tweets, so the per-user queries
+    find rows, and of the 20 newest tweets for the batch lookup
+    """
+    id_users = connection.execute(text("""
+        SELECT m.id_users
+        FROM messages m
+        WHERE EXISTS (SELECT 1 FROM tweets t WHERE t.id_users = m.id_users)
+        LIMIT 1
+    """)).scalar()
+    if id_users is None:
+        id_users = connection.execute(text("SELECT id_users FROM messages LIMIT 1")).scalar()
+    ids = connection.execute(text("SELECT id_tweets FROM tweets ORDER BY created_at DESC LIMIT 20")).scalars().all()
+    return {'id_users': id_users, 'ids': list(ids)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the plans of the hot queries')
+    parser.add_argument('--seed-users', type=int, default=0, help='Users to add with load_test_data.py first')
+    parser.add_argument('--seed-tweets', type=int, default=0, help='Tweets to add with load_test_data.py first')
+    parser.add_argument('--verbose', action='store_true', help='Print every plan')
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(db_url)
+
+    if args.seed_users or args.seed_tweets:
+        seed(engine, args.seed_users, args.seed_tweets)
+
+    with engine.connect() as connection:
+        connection.execute(text("ANALYZE"))
+        connection.commit()
+        params = sample_params(connection)
+        parents = partition_parents(connection)
+
+        failures = 0
+        for check in CHECKS:
+            transaction = connection.begin()
+            try:
+                plan = explain(connection, check['sql'], dict(params, **check.get('params', {})))
+                problems = check_plan(check, plan, parents)
+            except Exception as e:
+                problems = [f"error: {e}"]
+                plan = None
+            finally:
+                transaction.rollback()
+
+            status = 'FAIL' if problems else 'ok'
+            timing = f"{plan['Execution Time']:.1f} ms" if plan else ''
+            print(f"[{status:>4}] {check['name']:<45} {timing}")
+            for problem in problems:
+                print(f"         {problem}")
+            if args.verbose and plan:
+                print(json.dumps(plan['Plan'], indent=2))
+            failures += bool(problems)
+
+    print(f"\n{len(CHECKS) - failures} of {len(CHECKS)} plans ok")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+"""
+CPU time and memory per list page: ORM entities against project.read_model.
+
+Builds the data behind /, /all_messages and /tweets both ways: the way the
+views used to, loading Message/Tweet entities through the ORM and copying
+them into dicts, and through load_message_page/load_tweet_page, which
+select only the shown columns into named tuples. Each page is built
+--repeat times with a fresh session and an empty tweet_cache, and the
+script prints the mean process CPU time and wall time per page, then,
+from a second pass of builds with tracemalloc on, the mean peak memory of
+one page. The timed pass runs without tracemalloc, whose bookkeeping would
+inflate the times. Process CPU leaves out the time Postgres spends, so the
+difference is what the Python side costs. Prepared statements are turned
+off, so both paths send plain SQL and only the read model differs.
+
+Run from the repo root, with the web app's requirements installed:
+
+    python benchmarks/read_model.py --repeat 50 --page 10
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from dotenv import load_dotenv
+
+# Check if running on host or in container
+if os.path.exists('/.dockerenv'):
+    env_file = '.env.dev.container'
+else:
+    env_file = '.env.dev.host'
+
+load_dotenv(env_file)
+
+# The ORM path can't run by name, so the read model mustn't either
+os.environ['PREPARED_STATEMENTS'] = 'false'
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'services', 'web'))
+
+from project import (  # noqa: E402
+    app, db, Account, Message, Tweet, User, tweet_cache, load_message_page, load_tweet_page
+)
+
+
+def orm_message_page(user_id, limit, offset):
+    """The message list as / and /all_messages built it from ORM entities"""
+    messages = []
+    rows = db.session.query(
+        Message, Account.username
+    ).join(
+        Account, Message.id_users == Account.id_users
+    ).order_by(
+        Message.created_at.desc()
+    ).limit(limit).offset(offset).all()
+    for message, username in rows:
+        messages.append({
+            'id': message.id_message,
+            'text': message.message_text,
+            'created_at': message.created_at,
+            'username': username,
+            'is_own': str(message.id_users) == user_id if user_id else False
+        })
+    return messages
+
+
+def orm_tweet_page(limit, offset):
+    """The tweet list as /tweets built it from ORM entities and their lazy relations"""
+    tweets = []
+    rows = db.session.query(Tweet).join(
+        User, Tweet.id_users == User.id_users
+    ).order_by(
+        Tweet.created_at.desc()
+    ).limit(limit).offset(offset).all()
+    for tweet in rows:
+        mentions = []
+        for mention in tweet.mentions:
+            mentioned_user = db.session.get(User, mention.id_users)
+            if mentioned_user:
+                mentions.append({
+                    'id': mention.id_users,
+                    'screen_name': mentioned_user.screen_name,
+                    'name': mentioned_user.name
+                })
+        tweets.append({
+            'id': tweet.id_tweets,
+            'text': tweet.text,
+            'created_at': tweet.created_at,
+            'retweet_count': tweet.retweet_count,
+            'favorite_count': tweet.favorite_count,
+            'quote_count': tweet.quote_count,
+            'source': tweet.source,
+            'lang': tweet.lang,
+            'user': {
+                'id': tweet.user.id_users,
+                'screen_name': tweet.user.screen_name,
+                'name': tweet.user.name,
+                'description': tweet.user.description,
+                'location': tweet.user.location,
+                'verified': tweet.user.verified,
+                'url': tweet.user.url
+            },
+            'hashtags': [tag.tag for tag in tweet.tags],
+            'mentions': mentions,
+            'media': [{'url': m.url, 'type': m.type} for m in tweet.media],
+            'urls': [{'url': u.url} for u in tweet.urls],
+            'is_retweet': tweet.text.startswith('RT @'),
+            'is_quote': tweet.quoted_status_id is not None,
+            'location': {
+                'place_name': tweet.place_name,
+                'country_code': tweet.country_code,
+                'state_code': tweet.state_code
+            }
+        })
+    return tweets
+
+
+def measure(build, repeat):
+    """
+    Mean CPU ms, mean wall ms and mean peak KiB of `build()` over `repeat`
+    fresh runs. Times and memory come from separate passes, so tracemalloc
+    doesn't slow the timed one.
+    """
+    cpu = wall = peak = 0
+    rows = 0
+    for _ in range(repeat):
+        db.session.remove()
+        tweet_cache.clear()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        rows = len(build())
+        cpu += time.process_time() - cpu_start
+        wall += time.perf_counter() - wall_start
+    for _ in range(repeat):
+        db.session.remove()
+        tweet_cache.clear()
+        tracemalloc.start()
+        build()
+        peak += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return cpu * 1000 / repeat, wall * 1000 / repeat, peak / 1024 / repeat, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ORM and read model list pages')
+    parser.add_argument('--repeat', type=int, default=30, help='Builds per page and path')
+    parser.add_argument('--page', type=int, default=1, help='Page number to build')
+    args = parser.parse_args()
+
+    pages = {
+        '/': (20, 0),
+        '/all_messages': (50, (args.page - 1) * 50),
+        '/tweets': (20, (args.page - 1) * 20),
+    }
+    paths = {
+        '/': (lambda: orm_message_page(None, *pages['/']), lambda: load_message_page(None, *pages['/'])),
+        '/all_messages': (lambda: orm_message_page(None, *pages['/all_messages']),
+                          lambda: load_message_page(None, *pages['/all_messages'])),
+        '/tweets': (lambda: orm_tweet_page(*pages['/tweets']), lambda: load_tweet_page(*pages['/tweets'])),
+    }
+
+    with app.app_context():
+        print(f"{'page':<15}{'path':<12}{'rows':>6}{'cpu ms':>10}{'wall ms':>10}{'peak KiB':>10}")
+        for page, (orm_build, lean_build) in paths.items():
+            results = {}
+            for label, build in (('orm', orm_build), ('read model', lean_build)):
+                results[label] = measure(build, args.repeat)
+                cpu, wall, peak, rows = results[label]
+                print(f"{page:<15}{label:<12}{rows:>6}{cpu:>10.2f}{wall:>10.2f}{peak:>10.0f}")
+            before, after = results['orm'], results['read model']
+            if before[0] and before[2]:
+                print(f"{'':<15}{'change':<12}{'':>6}{(after[0] - before[0]) / before[0] * 100:>+9.0f}%"
+                      f"{(after[1] - before[1]) / before[1] * 100:>+9.0f}%"
+                      f"{(after[2] - before[2]) / before[2] * 100:>+9.0f}%")
+        db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+
+"""
+Load test for the whole site: replays a weighted request mix against a
+running stack and reports throughput and p50/p95/p99 latency per route.
+
+The default mix covers the home page, logging in, /tweets at increasing
+depth, searches from very common to very rare terms, and posting messages.
+Pass --mix to replay your own instead: a JSON lines file with one request
+per line, e.g.
+
+    {"name": "tweets p1", "method": "GET", "path": "/tweets", "weight": 10}
+    {"name": "post", "method": "POST", "path": "/create_message", "data": {"message_text": "hi"}, "auth": true, "weight": 1}
+
+Requests with "auth": true carry the cookies of an account the script
+creates (or reuses) before the run. Each client picks requests with its own
+seeded random generator, so the same --seed replays the same sequence.
+
+Every run is saved to benchmarks/results/ as JSON, tagged with the current
+commit, and compared with the previous run so a slower route stands out:
+
+    python benchmarks/site_load.py --url http://localhost:5051 --duration 60
+    python benchmarks/site_load.py --baseline benchmarks/results/<file>.json --fail-on-regression
+"""
+
+import os
+import json
+import glob
+import random
+import argparse
+import threading
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import http.cookiejar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from load_compare import percentile
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+BENCHMARK_USER = 'benchmark_user'
+BENCHMARK_PASSWORD = 'benchmark_password'
+
+DEFAULT_MIX = [
+    {'name': 'home', 'method': 'GET', 'path': '/', 'weight': 20},
+    {'name': 'home (logged in)', 'method': 'GET', 'path': '/', 'auth': True, 'weight': 10},
+    {'name': 'login', 'method': 'POST', 'path': '/login',
+     'data': {'username': BENCHMARK_USER, 'password': BENCHMARK_PASSWORD}, 'weight': 3},
+    {'name': 'tweets p1', 'method': 'GET', 'path': '/tweets', 'weight': 15},
+    {'name': 'tweets p10', 'method': 'GET', 'path': '/tweets?page=10', 'weight': 6},
+    {'name': 'tweets p100', 'method': 'GET', 'path': '/tweets?page=100', 'weight': 3},
+    {'name': 'tweets p1000', 'method': 'GET', 'path': '/tweets?page=1000', 'weight': 1},
+    {'name': 'all_messages', 'method': 'GET', 'path': '/all_messages', 'weight': 5},
+    {'name': 'search common', 'method': 'GET', 'path': '/search?query=the', 'weight': 4},
+    {'name': 'search medium', 'method': 'GET', 'path': '/search?query=coffee', 'weight': 4},
+    {'name': 'search rare', 'method': 'GET', 'path': '/search?query=xylophone', 'weight': 4},
+    {'name': 'search phrase', 'method': 'GET', 'path': '/search?query=good+morning', 'weight': 2},
+    {'name': 'create_message', 'method': 'POST', 'path': '/create_message',
+     'data': {'message_text': 'benchmark message'}, 'auth': True, 'weight': 2},
+]
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Time the request itself, not the page it redirects to"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def load_mix(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def benchmark_cookies(base_url):
+    """Create the benchmark account if needed, log in and return its Cookie header"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    credentials = {'username': BENCHMARK_USER, 'password': BENCHMARK_PASSWORD}
+
+    # Fails harmlessly with "Username already exists" after the first run
+    opener.open(base_url + '/create_account', urllib.parse.urlencode(
+        dict(credentials, confirm_password=BENCHMARK_PASSWORD)).encode(), timeout=30).read()
+    opener.open(base_url + '/login', urllib.parse.urlencode(credentials).encode(), timeout=30).read()
+
+    cookies = {cookie.name: cookie.value for cookie in jar}
+    if not cookies.get('id_users'):
+        raise SystemExit(f"Couldn't log in as {BENCHMARK_USER} on {base_url}")
+    return '; '.join(f"{name}={value}" for name, value in cookies.items() if name != 'primary_until')
+
+
+def client_loop(base_url, mix, cookie_header, seed, deadline, latencies, errors, lock):
+    opener = urllib.request.build_opener(NoRedirect)
+    rng = random.Random(seed)
+    weights = [entry.get('weight', 1) for entry in mix]
+
+    while time.monotonic() < deadline:
+        entry = rng.choices(mix, weights)[0]
+        data = urllib.parse.urlencode(entry['data']).encode() if entry.get('data') else None
+        headers = {'Cookie': cookie_header} if entry.get('auth') else {}
+        req = urllib.request.Request(base_url + entry['path'], data=data, headers=headers,
+                                     method=entry.get('method', 'GET'))
+
+        start_time = time.perf_counter()
+        try:
+            with opener.open(req, timeout=30) as response:
+                response.read()
+            ok = True
+        except urllib.error.HTTPError as e:
+            ok = e.code < 400
+        except (urllib.error.URLError, OSError):
+            ok = False
+        elapsed = (time.perf_counter() - start_time) * 1000
+
+        with lock:
+            if ok:
+                latencies.setdefault(entry['name'], []).append(elapsed)
+            else:
+                errors[entry['name']] = errors.get(entry['name'], 0) + 1
+
+
+def run(base_url, mix, concurrency, duration, seed):
+    cookie_header = benchmark_cookies(base_url) if any(entry.get('auth') for entry in mix) else ''
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        clients = [
+            pool.submit(client_loop, base_url, mix, cookie_header, seed + i, deadline, latencies, errors, lock)
+            for i in range(concurrency)
+        ]
+        # Re-raises anything that stopped a client early
+        for client in clients:
+            client.result()
+    elapsed = time.monotonic() - start_time
+
+    # A route without a single answered request has no latencies to compare,
+    # and a saved result like that would quietly drop it from later comparisons
+    unanswered = [entry['name'] for entry in mix if not latencies.get(entry['name'])]
+    if unanswered:
+        raise SystemExit(f"No successful requests for {', '.join(unanswered)}; "
+                         f"check the errors or run longer, nothing was saved")
+
+    routes = {}
+    for entry in mix:
+        values = sorted(latencies.get(entry['name'], []))
+        routes[entry['name']] = {
+            'requests': len(values),
+            'errors': errors.get(entry['name'], 0),
+            'rps': len(values) / elapsed,
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+        }
+    everything = sorted(value for values in latencies.values() for value in values)
+    routes['TOTAL'] = {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'rps': len(everything) / elapsed,
+        'p50': percentile(everything, 0.50),
+        'p95': percentile(everything, 0.95),
+        'p99': percentile(everything, 0.99),
+    }
+    return routes
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_result(result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"site_load-{result['started_at']}-{result['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def previous_result(exclude):
+    paths = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, 'site_load-*.json')) if p != exclude)
+    return paths[-1] if paths else None
+
+
+def compare(current, baseline, threshold):
+    """Print the change in req/s and p95 per route; return the routes whose p95 got worse than threshold"""
+    regressions = []
+    print(f"\nCompared with {baseline['commit']} ({baseline['started_at']}):")
+    print(f"{'route':<20}{'req/s':>12}{'p95 ms':>12}")
+    for name, route in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before or not before['requests'] or not route['requests']:
+            continue
+        rps_change = (route['rps'] - before['rps']) / before['rps'] * 100 if before['rps'] else 0
+        p95_change = (route['p95'] - before['p95']) / before['p95'] * 100 if before['p95'] else 0
+        marker = ''
+        if p95_change > threshold:
+            regressions.append(name)
+            marker = '  <-- slower'
+        print(f"{name:<20}{rps_change:>+11.1f}%{p95_change:>+11.1f}%{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a request mix against the site and report per-route latency')
+    parser.add_argument('--url', default='http://localhost:5051', help='Base URL of the site (nginx)')
+    parser.add_argument('--mix', help='JSON lines file with the request mix (default: built-in synthetic mix)')
+    parser.add_argument('--concurrency', type=int, default=50, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=int, default=30, help='Seconds to run for')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the per-client request sequences')
+    parser.add_argument('--baseline', help='Result file to compare with (default: the previous run)')
+    parser.add_argument('--threshold', type=float, default=10, help='p95 increase, in percent, that counts as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if any route regressed')
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix) if args.mix else DEFAULT_MIX
+    started_at = datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    print(f"Running {args.concurrency} clients against {args.url} for {args.duration}s...")
+    routes = run(args.url, mix, args.concurrency, args.duration, args.seed)
+
+    print(f"\n{'route':<20}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>10}")
+    for name, route in routes.items():
+        print(f"{name:<20}{route['requests']:>10}{route['rps']:>10.1f}{route['p50']:>10.1f}"
+              f"{route['p95']:>10.1f}{route['p99']:>10.1f}{route['errors']:>10}")
+
+    result = {
+        'started_at': started_at,
+        'commit': current_commit(),
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'seed': args.seed,
+        'mix': mix,
+        'routes': routes,
+    }
+    path = save_result(result)
+    print(f"\nSaved to {path}")
+
+    baseline_path = args.baseline or previous_result(exclude=path)
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
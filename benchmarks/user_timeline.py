@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+"""
+Benchmarks the per-user tweet timeline query behind /users/<screen_name>/tweets.
+
+It times the first page and a deep page for a user with a single tweet and
+for a synthetic user with --heavy-tweets tweets (created and removed by this
+script), and prints the plan so you can check idx_tweets_id_users_created_at
+is being used.
+
+Run from the repo root:
+
+    python benchmarks/user_timeline.py --heavy-tweets 100000
+"""
+
+import sqlalchemy
+from sqlalchemy import text
+import argparse
+import statistics
+import time
+import os
+from dotenv import load_dotenv
+
+# Check if running on host or in container
+if os.path.exists('/.dockerenv'):
+    env_file = '.env.dev.container'
+else:
+    env_file = '.env.dev.host'
+
+load_dotenv(env_file)
+
+db_url = os.environ['DATABASE_URL']
+
+PAGE_SQL = text("""
+SELECT id_tweets, created_at
+FROM tweets
+WHERE id_users = :id_users
+  AND (CAST(:created_at AS timestamptz) IS NULL OR (created_at, id_tweets) < (:created_at, :id_tweets))
+ORDER BY created_at DESC, id_tweets DESC
+LIMIT :limit
+""")
+
+# A user id far above anything load_test_data.py generates
+HEAVY_USER_ID = 9000000000000
+
+
+def create_heavy_user(connection, num_tweets):
+    """Insert a synthetic user with num_tweets tweets spread over the last five years"""
+    max_tweet_id = connection.execute(text("SELECT COALESCE(MAX(id_tweets), 0) FROM tweets")).scalar()
+
+    connection.execute(text("""
+        INSERT INTO users (id_users, created_at, screen_name, name)
+        VALUES (:id_users, now(), 'benchmark_heavy_user', 'Benchmark Heavy User')
+        ON CONFLICT (id_users) DO NOTHING
+    """), {'id_users': HEAVY_USER_ID})
+
+    connection.execute(text("""
+        INSERT INTO tweets (id_tweets, id_users, created_at, text, id_lang)
+        SELECT :first_id + n, :id_users, now() - n * interval '1 minute', 'benchmark tweet ' || n,
+               (SELECT id_lang FROM langs WHERE lang = 'en')
+        FROM generate_series(1, :num_tweets) AS n
+        ON CONFLICT (id_tweets, created_at) DO NOTHING
+    """), {'first_id': max_tweet_id, 'id_users': HEAVY_USER_ID, 'num_tweets': num_tweets})
+
+    connection.execute(text("ANALYZE tweets"))
+
+
+def drop_heavy_user(connection):
+    connection.execute(text("""
+        WITH deleted AS (
+            DELETE FROM tweets WHERE id_users = :id_users RETURNING id_tweets
+        )
+        DELETE FROM tweet_ids WHERE id_tweets IN (SELECT id_tweets FROM deleted)
+    """), {'id_users': HEAVY_USER_ID})
+    connection.execute(text("DELETE FROM users WHERE id_users = :id_users"), {'id_users': HEAVY_USER_ID})
+
+
+def find_single_tweet_user(connection):
+    return connection.execute(text("""
+        SELECT id_users FROM tweets
+        GROUP BY id_users
+        HAVING COUNT(*) = 1
+        LIMIT 1
+    """)).scalar()
+
+
+def time_page(connection, id_users, cursor, per_page, repeat):
+    """Run one page query `repeat` times and return the timings in ms"""
+    params = {
+        'id_users': id_users,
+        'created_at': cursor[0] if cursor else None,
+        'id_tweets': cursor[1] if cursor else None,
+        'limit': per_page + 1
+    }
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        connection.execute(PAGE_SQL, params).fetchall()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return timings
+
+
+def cursor_at_depth(connection, id_users, depth, per_page):
+    """Follow the cursor `depth` pages down, the way a user clicking Older would"""
+    cursor = None
+    for _ in range(depth):
+        rows = connection.execute(PAGE_SQL, {
+            'id_users': id_users,
+            'created_at': cursor[0] if cursor else None,
+            'id_tweets': cursor[1] if cursor else None,
+            'limit': per_page
+        }).fetchall()
+        if not rows:
+            break
+        cursor = (rows[-1].created_at, rows[-1].id_tweets)
+    return cursor
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+    print(f"{label:<40} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def run_benchmark(heavy_tweets, per_page, depth, repeat, keep):
+    engine = sqlalchemy.create_engine(db_url)
+
+    with engine.begin() as connection:
+        print(f"Creating synthetic user with {heavy_tweets} tweets...")
+        start_time = time.time()
+        create_heavy_user(connection, heavy_tweets)
+        print(f"Created in {time.time() - start_time:.2f} seconds")
+
+    try:
+        with engine.connect() as connection:
+            light_user = find_single_tweet_user(connection)
+            users = [('heavy user', HEAVY_USER_ID)]
+            if light_user is not None:
+                users.insert(0, ('1-tweet user', light_user))
+            else:
+                print("No user with exactly one tweet found, skipping that case")
+
+            for label, id_users in users:
+                report(f"{label}: first page", time_page(connection, id_users, None, per_page, repeat))
+
+                cursor = cursor_at_depth(connection, id_users, depth, per_page)
+                if cursor:
+                    report(f"{label}: page {depth + 1}", time_page(connection, id_users, cursor, per_page, repeat))
+
+            print("\nPlan for the heavy user's first page:")
+            plan = connection.execute(text("EXPLAIN " + PAGE_SQL.text), {
+                'id_users': HEAVY_USER_ID, 'created_at': None, 'id_tweets': None, 'limit': per_page + 1
+            })
+            for row in plan:
+                print(row[0])
+    finally:
+        if not keep:
+            with engine.begin() as connection:
+                drop_heavy_user(connection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the per-user tweet timeline query')
+    parser.add_argument('--heavy-tweets', type=int, default=100000, help='Number of tweets for the synthetic heavy user')
+    parser.add_argument('--per-page', type=int, default=20, help='Tweets per page, as in the app')
+    parser.add_argument('--depth', type=int, default=50, help='How many pages deep to time the cursor query')
+    parser.add_argument('--repeat', type=int, default=50, help='Number of timed runs per case')
+    parser.add_argument('--keep', action='store_true', help='Leave the synthetic user in the database')
+    args = parser.parse_args()
+
+    run_benchmark(args.heavy_tweets, args.per_page, args.depth, args.repeat, args.keep)
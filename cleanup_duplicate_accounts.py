@@ -134,6 +134,12 @@ def cleanup_duplicate_accounts():
                             DELETE FROM tweets
                             WHERE id_tweets IN (SELECT id_tweets FROM temp_tweet_ids)
                         """))
+
+                        # And their entries in the id map the relations point at
+                        connection.execute(text("""
+                            DELETE FROM tweet_ids
+                            WHERE id_tweets IN (SELECT id_tweets FROM temp_tweet_ids)
+                        """))
                         
                         # Drop temp table (will be dropped at end of transaction anyway)
                         connection.execute(text("DROP TABLE IF EXISTS temp_tweet_ids"))
@@ -175,6 +181,7 @@ def cleanup_duplicate_accounts():
                 print("Refreshing materialized views...")
                 connection.execute(text('REFRESH MATERIALIZED VIEW IF EXISTS tweet_tags_total'))
                 connection.execute(text('REFRESH MATERIALIZED VIEW IF EXISTS tweet_tags_cooccurrence'))
+                connection.execute(text('REFRESH MATERIALIZED VIEW IF EXISTS tweet_tags_prefix_top'))
                 print("Materialized views refreshed")
             except Exception as e:
                 print(f"Could not refresh materialized views: {e}")
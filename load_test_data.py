@@ -13,6 +13,7 @@ from postgis import Geometry, Point, MultiPolygon, Polygon
 import postgis.psycopg
 import time
 import os
+import re
 from dotenv import load_dotenv
 
 # Check if running on host or in container
@@ -33,6 +34,46 @@ load_dotenv(env_file)
 
 db_url = os.environ['DATABASE_URL']
 
+# Lookup tables that tweets and tweet_media store ids into: the column with
+# the value and the column with its id
+LOOKUP_TABLES = {
+    'tweet_sources': ('source', 'id_source'),
+    'langs': ('lang', 'id_lang'),
+    'media_url_prefixes': ('prefix', 'id_prefix'),
+    'tags': ('tag', 'id_tag'),
+}
+
+# Same rule as project/compaction.py: scheme, host and first path segment
+MEDIA_URL_PREFIX = re.compile(r'^https?://[^/]+/[^/]+/')
+
+def lookup_ids(connection, table, values):
+    """
+    Map each of `values` to its id in `table`, adding the ones it doesn't have
+    yet. New values are committed straight away in a transaction of their
+    own, so parallel loaders don't hold them locked against each other until
+    their whole batch is done.
+    """
+    column, id_column = LOOKUP_TABLES[table]
+    values = sorted({value for value in values if value is not None})
+    # Insert only what's missing; ON CONFLICT on its own would still use up
+    # an id from the sequence for every value already there
+    with connection.engine.begin() as lookup_connection:
+        lookup_connection.execute(text(f'''
+        INSERT INTO {table} ({column})
+        SELECT value FROM unnest(CAST(:values AS TEXT[])) AS value
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {column} = value)
+        ON CONFLICT DO NOTHING
+        '''), {'values': values})
+    rows = connection.execute(text(f"SELECT {column}, {id_column} FROM {table} WHERE {column} = ANY(:values)"),
+                              {'values': values})
+    return dict(rows.all())
+
+def split_media_url(url):
+    """Split a media URL into the prefix media_url_prefixes stores and the rest"""
+    match = MEDIA_URL_PREFIX.match(url)
+    prefix = match.group(0) if match else ''
+    return prefix, url[len(prefix):]
+
 def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_id_start=-1):
     """Generate random data for the database schema"""
     print(f"Process {os.getpid()} starting with user_id_start={user_id_start}, tweet_id_start={tweet_id_start}")
@@ -219,7 +260,7 @@ def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_i
                     sql = text('''
                     INSERT INTO messages (id_users, id_message, message_text, created_at)
                     VALUES (:id_users, :id_message, :message_text, :created_at)
-                    ON CONFLICT (id_users, id_message) DO NOTHING
+                    ON CONFLICT (id_users, id_message, created_at) DO NOTHING
                     ''')
                     
                     connection.execute(sql, messages_batch)
@@ -231,7 +272,7 @@ def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_i
             sql = text('''
             INSERT INTO messages (id_users, id_message, message_text, created_at)
             VALUES (:id_users, :id_message, :message_text, :created_at)
-            ON CONFLICT (id_users, id_message) DO NOTHING
+            ON CONFLICT (id_users, id_message, created_at) DO NOTHING
             ''')
             
             connection.execute(sql, messages_batch)
@@ -321,17 +362,33 @@ def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_i
         INSERT INTO tweets 
             (id_tweets, id_users, created_at, in_reply_to_status_id, in_reply_to_user_id, 
             quoted_status_id, retweet_count, favorite_count, quote_count, withheld_copyright, 
-            withheld_in_countries, source, text, country_code, state_code, lang, place_name, geo)
+            withheld_in_countries, id_source, text, country_code, state_code, id_lang, place_name, geo)
         VALUES 
             (:id_tweets, :id_users, :created_at, :in_reply_to_status_id, :in_reply_to_user_id, 
             :quoted_status_id, :retweet_count, :favorite_count, :quote_count, :withheld_copyright, 
-            :withheld_in_countries, :source, :text, :country_code, :state_code, :lang, :place_name, 
+            :withheld_in_countries, :id_source, :text, :country_code, :state_code, :id_lang, :place_name, 
             ST_GeomFromText(:geo))
-        ON CONFLICT (id_tweets) DO NOTHING
+        ON CONFLICT (id_tweets, created_at) DO NOTHING
         ''')
         
         total_tweets = 0
         for batch in tweet_batches:
+            # The key includes created_at, so loading an id again with a new
+            # random date would fail in the tweet_ids trigger; skip the ids
+            # already there
+            existing = set(connection.execute(text('SELECT id_tweets FROM tweet_ids WHERE id_tweets = ANY(:ids)'),
+                                              {'ids': [tweet['id_tweets'] for tweet in batch]}).scalars())
+            if existing:
+                print(f"Process {os.getpid()}: Skipping {len(existing)} tweets that are already loaded")
+                batch = [tweet for tweet in batch if tweet['id_tweets'] not in existing]
+                if not batch:
+                    continue
+            # Tweets store source and lang as ids into their lookup tables
+            source_ids = lookup_ids(connection, 'tweet_sources', [tweet['source'] for tweet in batch])
+            lang_ids = lookup_ids(connection, 'langs', [tweet['lang'] for tweet in batch])
+            for tweet in batch:
+                tweet['id_source'] = source_ids.get(tweet.pop('source'))
+                tweet['id_lang'] = lang_ids.get(tweet.pop('lang'))
             connection.execute(sql, batch)
             total_tweets += len(batch)
             print(f"Process {os.getpid()}: Inserted {total_tweets} tweets of {num_tweets}")
@@ -386,13 +443,17 @@ def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_i
     if tweet_tags:
         with engine.begin() as connection:
             sql = text('''
-            INSERT INTO tweet_tags (id_tweets, tag)
-            VALUES (:id_tweets, :tag)
-            ON CONFLICT (id_tweets, tag) DO NOTHING
+            INSERT INTO tweet_tags (id_tweets, id_tag)
+            VALUES (:id_tweets, :id_tag)
+            ON CONFLICT (id_tweets, id_tag) DO NOTHING
             ''')
             
             for i in range(0, len(tweet_tags), RELATION_BATCH_SIZE):
                 batch = tweet_tags[i:i+RELATION_BATCH_SIZE]
+                # Tags are stored once in the tags table and linked by id
+                tag_ids = lookup_ids(connection, 'tags', [tweet_tag['tag'] for tweet_tag in batch])
+                for tweet_tag in batch:
+                    tweet_tag['id_tag'] = tag_ids[tweet_tag.pop('tag')]
                 connection.execute(sql, batch)
                 print(f"Process {os.getpid()}: Inserted {min(i+RELATION_BATCH_SIZE, len(tweet_tags))} of {len(tweet_tags)} tweet tags")
     
@@ -428,13 +489,19 @@ def generate_random_data(num_users=50, num_tweets=100, user_id_start=-1, tweet_i
     if tweet_media:
         with engine.begin() as connection:
             sql = text('''
-            INSERT INTO tweet_media (id_tweets, url, type)
-            VALUES (:id_tweets, :url, :type)
-            ON CONFLICT (id_tweets, url) DO NOTHING
+            INSERT INTO tweet_media (id_tweets, id_prefix, url_key, type)
+            VALUES (:id_tweets, :id_prefix, :url_key, :type)
+            ON CONFLICT (id_tweets, id_prefix, url_key) DO NOTHING
             ''')
             
             for i in range(0, len(tweet_media), RELATION_BATCH_SIZE):
                 batch = tweet_media[i:i+RELATION_BATCH_SIZE]
+                # Media URLs are stored as a prefix id plus the rest of the URL
+                split_urls = [split_media_url(media.pop('url')) for media in batch]
+                prefix_ids = lookup_ids(connection, 'media_url_prefixes', [prefix for prefix, _ in split_urls])
+                for media, (prefix, url_key) in zip(batch, split_urls):
+                    media['id_prefix'] = prefix_ids[prefix]
+                    media['url_key'] = url_key
                 connection.execute(sql, batch)
                 print(f"Process {os.getpid()}: Inserted {min(i+RELATION_BATCH_SIZE, len(tweet_media))} of {len(tweet_media)} tweet media items")
     
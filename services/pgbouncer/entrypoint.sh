@@ -0,0 +1,7 @@
+#!/bin/sh
+
+# pgbouncer checks client logins against this file, and uses the same
+# credentials to log in to postgres
+echo "\"$POSTGRES_USER\" \"$POSTGRES_PASSWORD\"" > /etc/pgbouncer/userlist.txt
+
+exec pgbouncer /etc/pgbouncer/pgbouncer.ini
@@ -0,0 +1,4 @@
+#!/bin/sh
+
+# Let replicas stream WAL from this server with the regular credentials
+echo "host replication all all md5" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,28 @@
+#!/bin/bash
+set -e
+
+# Starts a hot standby that streams from $PRIMARY_HOST. On the first run the
+# data directory is empty, so it is cloned from the primary with pg_basebackup,
+# which also writes standby.signal and primary_conninfo.
+
+if [ "$(id -u)" = '0' ]; then
+    mkdir -p "$PGDATA"
+    chown -R postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    exec gosu postgres "$BASH_SOURCE" "$@"
+fi
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    echo "Waiting for primary at $PRIMARY_HOST..."
+    until pg_isready -h "$PRIMARY_HOST" -U "$POSTGRES_USER"; do
+        sleep 1
+    done
+
+    pg_basebackup \
+        --dbname="host=$PRIMARY_HOST user=$POSTGRES_USER password=$POSTGRES_PASSWORD" \
+        --pgdata="$PGDATA" --wal-method=stream --write-recovery-conf
+    chmod 700 "$PGDATA"
+    echo "Replica cloned from $PRIMARY_HOST"
+fi
+
+exec postgres -c hot_standby=on "$@"
@@ -2,19 +2,43 @@
 
 BEGIN;
 
+/*
+ * Secondary indexes here must match the registry in
+ * services/web/project/indexes.py, which builds them on existing databases
+ */
+
 CREATE TABLE IF NOT EXISTS accounts (
     id_users BIGINT PRIMARY KEY,
     username TEXT,  
     password TEXT
 );
+CREATE INDEX IF NOT EXISTS idx_accounts_username ON accounts (username);
 
+/*
+ * Partitioned by month on created_at; `manage.py create_partitions` adds
+ * the monthly partitions, and rows outside them land in messages_default.
+ * The primary key has to include the partition key, so Postgres can't stop
+ * an id from being stored again under another created_at: writers must
+ * never change a message's created_at by inserting it again.
+ */
 CREATE TABLE IF NOT EXISTS messages (
     id_users BIGINT,
     id_message BIGINT,
     message_text TEXT,
-    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (id_users, id_message)  -- Added composite primary key
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_users, id_message, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
+
+/*
+ * Serves per-user message timelines newest first
+ */
+CREATE INDEX IF NOT EXISTS idx_messages_id_users_created_at ON messages (id_users, created_at DESC);
+
+/*
+ * Serves the site-wide newest-first message lists on / and /all_messages
+ */
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at DESC);
 
 /*
  * Users may be partially hydrated with only a name/screen_name 
@@ -38,14 +62,52 @@ CREATE TABLE IF NOT EXISTS users (
     description TEXT,
     withheld_in_countries VARCHAR(2)[]
 );
+CREATE INDEX IF NOT EXISTS idx_users_screen_name ON users (screen_name);
+
+/*
+ * Autocomplete: the C-collated expression index serves LIKE 'abc%' prefix
+ * matches in order, and the trigram indexes find names containing a word
+ * that starts like the prefix
+ */
+CREATE INDEX IF NOT EXISTS idx_users_screen_name_prefix ON users ((lower(screen_name) COLLATE "C"));
+CREATE INDEX IF NOT EXISTS idx_users_screen_name_trgm ON users USING gin (lower(screen_name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_name_trgm ON users USING gin (lower(name) gin_trgm_ops);
+
+/*
+ * Lookup tables for values that repeat across many tweets. A tweet stores a
+ * 4 or 2 byte id instead of the full source HTML or language code, and media
+ * rows store their URL's common prefix as an id.
+ *
+ * tweet_sources uses INTEGER rather than SMALLINT: real tweet data has more
+ * distinct client apps than a SMALLINT can number.
+ */
+CREATE TABLE IF NOT EXISTS tweet_sources (
+    id_source INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS langs (
+    id_lang SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    lang TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS media_url_prefixes (
+    id_prefix INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    prefix TEXT NOT NULL UNIQUE
+);
 
 /*
  * Tweets may be entered in hydrated or unhydrated form.
+ *
+ * Partitioned by month on created_at like messages, with the same caveat
+ * about its primary key. Unhydrated tweets may not have a date; they are
+ * stored with created_at '-infinity', which no monthly partition covers,
+ * so they live in tweets_default and sort after every dated tweet.
  */
 CREATE TABLE IF NOT EXISTS tweets (
-    id_tweets BIGINT PRIMARY KEY,
+    id_tweets BIGINT,
     id_users BIGINT,
-    created_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
     in_reply_to_status_id BIGINT,
     in_reply_to_user_id BIGINT,
     quoted_status_id BIGINT,
@@ -54,72 +116,257 @@ CREATE TABLE IF NOT EXISTS tweets (
     quote_count SMALLINT,
     withheld_copyright BOOLEAN,
     withheld_in_countries VARCHAR(2)[],
-    source TEXT,
+    id_source INTEGER REFERENCES tweet_sources(id_source),
     text TEXT,
     country_code VARCHAR(2),
     state_code VARCHAR(2),
-    lang TEXT,
+    id_lang SMALLINT REFERENCES langs(id_lang),
     place_name TEXT,
     geo geometry,
+    text_tsv tsvector,
+    PRIMARY KEY (id_tweets, created_at),
     FOREIGN KEY(id_users) REFERENCES users(id_users)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS tweets_default PARTITION OF tweets DEFAULT;
+
+/*
+ * One row per tweet id with the created_at it is stored under, kept in
+ * step by the tweets_track_id trigger. Its primary key is what keeps a
+ * tweet id unique, the tweet_* tables reference it, and lookups by id read
+ * the date here first so they only open the partition holding the tweet.
+ * A deleted tweet's row stays until the id is stored again; writers that
+ * delete tweets delete it too. Must match TWEET_IDS_SETUP_SQL in
+ * services/web/project/partitions.py.
+ */
+CREATE TABLE IF NOT EXISTS tweet_ids (
+    id_tweets BIGINT PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL
 );
 
+CREATE OR REPLACE FUNCTION tweets_track_id() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE tweet_ids SET created_at = NEW.created_at WHERE id_tweets = NEW.id_tweets;
+        RETURN NULL;
+    END IF;
+    -- An id that is already mapped may only move if its old row is gone,
+    -- as when an UPDATE of created_at moves the row to another partition
+    INSERT INTO tweet_ids (id_tweets, created_at) VALUES (NEW.id_tweets, NEW.created_at)
+    ON CONFLICT (id_tweets) DO UPDATE SET created_at = EXCLUDED.created_at
+    WHERE NOT EXISTS (
+        SELECT 1 FROM tweets t
+        WHERE t.id_tweets = EXCLUDED.id_tweets AND t.created_at = tweet_ids.created_at
+    );
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'tweet % is already stored under another created_at', NEW.id_tweets
+            USING ERRCODE = 'unique_violation';
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS tweets_track_id ON tweets;
+CREATE TRIGGER tweets_track_id AFTER INSERT OR UPDATE OF created_at ON tweets
+FOR EACH ROW EXECUTE FUNCTION tweets_track_id();
+
+/*
+ * Serves per-user tweet timelines newest first, and lets deletes
+ * by id_users avoid scanning the whole table
+ */
+CREATE INDEX IF NOT EXISTS idx_tweets_id_users_created_at ON tweets (id_users, created_at DESC);
+
+/*
+ * Used to walk reply and quote threads; most tweets are neither, so partial
+ */
+CREATE INDEX IF NOT EXISTS idx_tweets_in_reply_to_status_id ON tweets (in_reply_to_status_id) WHERE in_reply_to_status_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_tweets_quoted_status_id ON tweets (quoted_status_id) WHERE quoted_status_id IS NOT NULL;
+
+/*
+ * Serves the newest-first tweet list on /tweets
+ */
+CREATE INDEX IF NOT EXISTS idx_tweets_created_at ON tweets (created_at DESC);
+
+/*
+ * Tweet search. text_tsv holds each tweet's text parsed with the text search
+ * configuration of its language (simple when Postgres has no stemmer for
+ * it), kept up to date by a trigger. ts_config_for must match
+ * TEXT_SEARCH_CONFIGS in services/web/project/tweet_search.py. The RUM
+ * indexes on text_tsv are built by `manage.py sync_indexes`.
+ */
+CREATE OR REPLACE FUNCTION ts_config_for(lang TEXT) RETURNS regconfig
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT (CASE lang
+    WHEN 'ar' THEN 'arabic'
+    WHEN 'da' THEN 'danish'
+    WHEN 'de' THEN 'german'
+    WHEN 'el' THEN 'greek'
+    WHEN 'en' THEN 'english'
+    WHEN 'es' THEN 'spanish'
+    WHEN 'fi' THEN 'finnish'
+    WHEN 'fr' THEN 'french'
+    WHEN 'ga' THEN 'irish'
+    WHEN 'hu' THEN 'hungarian'
+    WHEN 'id' THEN 'indonesian'
+    WHEN 'it' THEN 'italian'
+    WHEN 'lt' THEN 'lithuanian'
+    WHEN 'ne' THEN 'nepali'
+    WHEN 'nl' THEN 'dutch'
+    WHEN 'no' THEN 'norwegian'
+    WHEN 'pt' THEN 'portuguese'
+    WHEN 'ro' THEN 'romanian'
+    WHEN 'ru' THEN 'russian'
+    WHEN 'sv' THEN 'swedish'
+    WHEN 'ta' THEN 'tamil'
+    WHEN 'tr' THEN 'turkish'
+    ELSE 'simple' END)::regconfig
+$$;
+
+-- OR-combines the tsqueries of every language, for searches across all of them
+CREATE OR REPLACE AGGREGATE tsquery_or_agg(tsquery) (SFUNC = tsquery_or, STYPE = tsquery);
+
+CREATE OR REPLACE FUNCTION tweets_text_tsv() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.text_tsv := to_tsvector(
+        ts_config_for((SELECT lang FROM langs WHERE id_lang = NEW.id_lang)),
+        COALESCE(NEW.text, '')
+    );
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS tweets_text_tsv ON tweets;
+CREATE TRIGGER tweets_text_tsv BEFORE INSERT OR UPDATE OF text, id_lang ON tweets
+FOR EACH ROW EXECUTE FUNCTION tweets_text_tsv();
+
+/*
+ * The tweet_* tables reference tweet_ids rather than tweets: a key into a
+ * partitioned table would have to include created_at
+ */
 CREATE TABLE IF NOT EXISTS tweet_urls (
-    id_tweets BIGINT,
+    id_tweets BIGINT REFERENCES tweet_ids(id_tweets),
     url TEXT,
-    PRIMARY KEY (id_tweets, url),  -- Added composite primary key
-    FOREIGN KEY (id_tweets) REFERENCES tweets(id_tweets)
+    PRIMARY KEY (id_tweets, url)  -- Added composite primary key
 );
 
 CREATE TABLE IF NOT EXISTS tweet_mentions (
-    id_tweets BIGINT,
+    id_tweets BIGINT REFERENCES tweet_ids(id_tweets),
     id_users BIGINT,
     PRIMARY KEY (id_tweets, id_users),  -- Added composite primary key
-    FOREIGN KEY (id_tweets) REFERENCES tweets(id_tweets),
     FOREIGN KEY (id_users) REFERENCES users(id_users)
 );
 
+/*
+ * The primary key leads with id_tweets, so deleting a user's mentions
+ * needs its own index
+ */
+CREATE INDEX IF NOT EXISTS idx_tweet_mentions_id_users ON tweet_mentions (id_users);
+
+/*
+ * Each distinct hashtag or cashtag once; tweet_tags links tweets to these
+ * by id, so its rows and primary key are two integers wide and the tag
+ * views group and join on integers
+ */
+CREATE TABLE IF NOT EXISTS tags (
+    id_tag INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    tag TEXT NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS idx_tags_tag_prefix ON tags ((lower(tag) COLLATE "C"));
+CREATE INDEX IF NOT EXISTS idx_tags_tag_trgm ON tags USING gin (lower(tag) gin_trgm_ops);
+
 CREATE TABLE IF NOT EXISTS tweet_tags (
-    id_tweets BIGINT,
-    tag TEXT,
-    PRIMARY KEY (id_tweets, tag),  -- Added composite primary key
-    FOREIGN KEY (id_tweets) REFERENCES tweets(id_tweets)
+    id_tweets BIGINT REFERENCES tweet_ids(id_tweets),
+    id_tag INTEGER REFERENCES tags(id_tag),
+    PRIMARY KEY (id_tweets, id_tag)  -- Added composite primary key
 );
 COMMENT ON TABLE tweet_tags IS 'This table links both hashtags and cashtags';
 
+/*
+ * Finds the tweets with a given tag
+ */
+CREATE INDEX IF NOT EXISTS idx_tweet_tags_id_tag ON tweet_tags (id_tag);
+
+/*
+ * A media URL is stored as the id of its prefix (scheme, host and first
+ * path segment, e.g. https://pbs.twimg.com/media/) plus the rest of it
+ */
 CREATE TABLE IF NOT EXISTS tweet_media (
-    id_tweets BIGINT,
-    url TEXT,
+    id_tweets BIGINT REFERENCES tweet_ids(id_tweets),
+    id_prefix INTEGER REFERENCES media_url_prefixes(id_prefix),
+    url_key TEXT,
     type TEXT,
-    PRIMARY KEY (id_tweets, url),  -- Added composite primary key
-    FOREIGN KEY (id_tweets) REFERENCES tweets(id_tweets)
+    PRIMARY KEY (id_tweets, id_prefix, url_key)  -- Added composite primary key
 );
 
 /*
- * Precomputes the total number of occurrences for each hashtag
+ * Precomputes the total number of occurrences for each hashtag. Counts by
+ * id_tag and only looks up the text of each group.
  */
 CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_total AS (
     SELECT 
-        row_number() over (order by count(*) desc) AS row,
-        tag, 
-        count(*) AS total
-    FROM tweet_tags
-    GROUP BY tag
-    ORDER BY total DESC
+        row_number() over (order by t.total desc) AS row,
+        g.tag, 
+        t.total
+    FROM (
+        SELECT id_tag, count(*) AS total
+        FROM tweet_tags
+        GROUP BY id_tag
+    ) t
+    JOIN tags g ON g.id_tag = t.id_tag
+    ORDER BY t.total DESC
+);
+
+/*
+ * Looks up the count of the tags autocomplete suggests
+ */
+CREATE INDEX IF NOT EXISTS idx_tweet_tags_total_tag ON tweet_tags_total (tag);
+
+/*
+ * The 20 most used tags for every tag prefix of up to three characters
+ * (#, #a, #ab, ...). Autocomplete reads short prefixes from here, because
+ * ranking all the tags they match would read most of tags. Must match
+ * TAG_VIEWS_SQL in services/web/project/compaction.py and
+ * TOP_TAGS_PER_PREFIX in services/web/project/autocomplete.py.
+ */
+CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_prefix_top AS (
+    SELECT prefix, tag, total
+    FROM (
+        SELECT
+            left(lower(g.tag), n) AS prefix,
+            g.tag,
+            t.total,
+            row_number() over (partition by left(lower(g.tag), n) order by t.total desc, g.tag) AS rank
+        FROM (
+            SELECT id_tag, count(*) AS total
+            FROM tweet_tags
+            GROUP BY id_tag
+        ) t
+        JOIN tags g ON g.id_tag = t.id_tag
+        CROSS JOIN LATERAL generate_series(1, least(length(g.tag), 3)) AS n
+    ) ranked
+    WHERE rank <= 20
 );
+CREATE INDEX IF NOT EXISTS idx_tweet_tags_prefix_top_prefix ON tweet_tags_prefix_top (prefix, total DESC);
 
 /*
- * Precomputes the number of hashtags that co-occur with each other
+ * Precomputes the number of hashtags that co-occur with each other. The
+ * self-join and grouping work on integer pairs; tag text is joined on last.
  */
 CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_cooccurrence AS (
     SELECT 
-        t1.tag AS tag1,
-        t2.tag AS tag2,
-        count(*) AS total
-    FROM tweet_tags t1
-    INNER JOIN tweet_tags t2 ON t1.id_tweets = t2.id_tweets
-    GROUP BY t1.tag, t2.tag
-    ORDER BY total DESC
+        g1.tag AS tag1,
+        g2.tag AS tag2,
+        c.total
+    FROM (
+        SELECT t1.id_tag AS id_tag1, t2.id_tag AS id_tag2, count(*) AS total
+        FROM tweet_tags t1
+        INNER JOIN tweet_tags t2 ON t1.id_tweets = t2.id_tweets
+        GROUP BY t1.id_tag, t2.id_tag
+    ) c
+    JOIN tags g1 ON g1.id_tag = c.id_tag1
+    JOIN tags g2 ON g2.id_tag = c.id_tag2
+    ORDER BY c.total DESC
 );
 
 COMMIT;
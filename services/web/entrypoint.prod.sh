@@ -9,6 +9,18 @@ then
     done
 
     echo "PostgreSQL started"
+
+    # Make sure next month's partitions exist before any row needs them
+    python manage.py create_partitions || echo "Couldn't create partitions"
+fi
+
+# Copy this image's static files, fingerprinted copies included, into the
+# volume nginx serves /static/ from. Docker only fills a named volume from an
+# image once, so without this it would keep serving the first build's files.
+# Hashed copies from earlier builds stay, for pages that still link to them.
+if [ -n "$STATIC_VOLUME_DIR" ]
+then
+    cp -R project/static/. "$STATIC_VOLUME_DIR"/
 fi
 
 exec "$@"
@@ -19,4 +19,10 @@ then
     echo "Database initialized"
 fi
 
+# Make sure next month's partitions exist before any row needs them
+if [ "$DATABASE" = "postgres" ]
+then
+    python manage.py create_partitions || echo "Couldn't create partitions"
+fi
+
 exec "$@"
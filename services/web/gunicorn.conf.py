@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for the Flask app, driven by the server profile in
+project/config.py. Set SERVER_WORKER_CLASS, SERVER_WORKERS, SERVER_THREADS,
+SERVER_KEEPALIVE and DB_POOL_SIZE in the env file to tune it; the profile is
+validated here so a bad combination fails before any worker is forked.
+"""
+
+import os
+import shutil
+
+from project.config import Config, validate_server_profile
+
+settings = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+validate_server_profile(settings)
+
+bind = os.environ.get("SERVER_BIND", "0.0.0.0:5000")
+worker_class = Config.SERVER_WORKER_CLASS
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+keepalive = Config.SERVER_KEEPALIVE
+timeout = Config.SERVER_TIMEOUT
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks the whole gevent hub unless it is made green
+    if server.cfg.worker_class_str == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def on_starting(server):
+    # Workers write their metrics here so /metrics can add them up; clear out
+    # files left by the previous run
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,19 @@
+import click
+import sqlalchemy
 from flask.cli import FlaskGroup
 from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
 
 from project import app, db, User
+from project.indexes import INDEXES, diff_indexes, extension_available, build_index, rebuild_index, unused_indexes
+from project.partitions import (
+    PARTITIONED_TABLES, is_partitioned, partition_table, ensure_partitions, detach_partition, month_start
+)
+from project.compaction import (
+    COMPACTED_TABLES, TAG_VIEWS_SQL, pending_tables, add_compact_columns, fill_lookups, tweet_relations,
+    backfill_tweets, backfill_media, backfill_tags, drop_wide_columns, measure, time_view_refresh, format_change
+)
+from project.tweet_search import SETUP_SQL as TWEET_SEARCH_SETUP_SQL, backfill_text_tsv
 
 
 cli = FlaskGroup(app)
@@ -25,12 +36,24 @@ def create_db():
     
     safe_drop('DROP MATERIALIZED VIEW IF EXISTS tweet_tags_total CASCADE')
     safe_drop('DROP TABLE IF EXISTS tweet_tags_total CASCADE')
+
+    safe_drop('DROP MATERIALIZED VIEW IF EXISTS tweet_tags_prefix_top CASCADE')
+
+    # Not a model; partition_table creates it again from the tweets it copies
+    safe_drop('DROP TABLE IF EXISTS tweet_ids CASCADE')
     
     # Now drop and recreate all tables
     try:
         db.drop_all()
         db.create_all()
         db.session.commit()
+        with db.engine.begin() as connection:
+            for table in PARTITIONED_TABLES:
+                partition_table(connection, table, [
+                    spec for spec in INDEXES if spec.table == table and not spec.extension
+                ])
+            for sql in TWEET_SEARCH_SETUP_SQL:
+                connection.execute(text(sql))
         print("Database recreated successfully!")
     except Exception as e:
         db.session.rollback()
@@ -44,5 +67,214 @@ def seed_db():
     db.session.commit()
 
 
+@cli.command("sync_indexes")
+@click.option("--dry-run", is_flag=True, help="Only show what would be built")
+def sync_indexes(dry_run):
+    """
+    Build the indexes in project/indexes.py that the database is missing,
+    and rebuild the ones whose definition no longer matches the registry
+    """
+    # Straight to postgres, never through pgbouncer: concurrent builds run
+    # for a long time outside any transaction
+    engine = sqlalchemy.create_engine(app.config['DATABASE_URL'], isolation_level="AUTOCOMMIT")
+
+    with engine.connect() as connection:
+        missing, invalid, changed, extra = diff_indexes(connection)
+        unavailable = {
+            spec.extension for spec in missing + invalid
+            if spec.extension and not extension_available(connection, spec.extension)
+        }
+
+    for spec in invalid:
+        print(f"Invalid (interrupted build): {spec.name}")
+    for spec in missing:
+        print(f"Missing: {spec.name} ON {spec.table} {spec.definition}")
+    for spec, definition in changed:
+        print(f"Changed: {spec.name}\n  database: {definition}\n  registry: {spec.definition}")
+    for name in extra:
+        print(f"Not in the registry: {name}")
+    if not missing and not invalid and not changed:
+        print(f"All {len(INDEXES)} indexes are present and up to date.")
+    if dry_run:
+        return
+
+    for spec in invalid + missing:
+        if spec.extension in unavailable:
+            print(f"Skipping {spec.name}: the {spec.extension} extension isn't available")
+            continue
+        # An index on a partitioned table stays invalid until every partition
+        # has its piece attached, and building it again picks up where it stopped
+        if spec in invalid and spec.table not in PARTITIONED_TABLES:
+            with engine.connect() as connection:
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {spec.name}"))
+        print(f"Building {spec.name}...")
+        elapsed = build_index(engine, spec)
+        print(f"Built {spec.name} in {elapsed:.1f} seconds")
+
+    for spec, _ in changed:
+        print(f"Rebuilding {spec.name}...")
+        elapsed = rebuild_index(engine, spec)
+        print(f"Rebuilt {spec.name} in {elapsed:.1f} seconds")
+
+
+@cli.command("unused_indexes")
+def show_unused_indexes():
+    """List indexes that haven't been scanned since statistics were reset"""
+    with db.engine.connect() as connection:
+        rows = unused_indexes(connection)
+
+    if not rows:
+        print("Every index has been used.")
+    for row in rows:
+        print(f"{row.name} ON {row.table} ({row.size}) has never been scanned")
+
+
+def direct_engine():
+    """Straight to postgres, bypassing pgbouncer, for long-running maintenance"""
+    return sqlalchemy.create_engine(app.config['DATABASE_URL'])
+
+
+@cli.command("partition_tables")
+@click.option("--months-ahead", default=3, help="Empty partitions to create past the current month")
+@click.option("--keep-old", is_flag=True, help="Keep the original tables as <table>_unpartitioned")
+def partition_tables(months_ahead, keep_old):
+    """
+    Convert messages and tweets to monthly partitions, copying every row.
+    Each table is locked while it is copied; run this in a maintenance window.
+    """
+    engine = direct_engine()
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as connection:
+            indexes = [
+                spec for spec in INDEXES
+                if spec.table == table and (not spec.extension or extension_available(connection, spec.extension))
+            ]
+            print(f"Partitioning {table}...")
+            if partition_table(connection, table, indexes, months_ahead, drop_old=not keep_old):
+                print(f"{table} is now partitioned by month")
+            else:
+                print(f"{table} was already partitioned")
+
+
+@cli.command("create_partitions")
+@click.option("--months-ahead", default=3, help="Empty partitions to create past the current month")
+def create_partitions(months_ahead):
+    """
+    Add the monthly partitions that don't exist yet, moving any rows that
+    were waiting for them out of the default partition. Run on every start
+    and from cron, so next month's partition is always there in time.
+    """
+    engine = direct_engine()
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as connection:
+            if not is_partitioned(connection, table):
+                print(f"{table} isn't partitioned yet; run manage.py partition_tables")
+                continue
+            for name in ensure_partitions(connection, table, months_ahead):
+                print(f"Created {name}")
+
+
+@cli.command("detach_partition")
+@click.argument("table", type=click.Choice(list(PARTITIONED_TABLES)))
+@click.argument("month", type=click.DateTime(formats=["%Y-%m"]))
+def detach_old_partition(table, month):
+    """
+    Detach one month (YYYY-MM) of TABLE into a standalone table, to be
+    archived with pg_dump and dropped without touching the rest
+    """
+    with direct_engine().begin() as connection:
+        name = detach_partition(connection, table, month_start(month))
+    if name:
+        print(f"Detached {name}; archive it with pg_dump -t {name}, then DROP TABLE {name}")
+    else:
+        print(f"{table} has no partition for {month:%Y-%m}")
+
+
+@cli.command("compact_tweets")
+@click.option("--skip-vacuum", is_flag=True, help="Don't rewrite the tables afterwards (sizes won't shrink yet)")
+@click.option("--time-views", is_flag=True, help="Also time a refresh of the tag views before compacting")
+def compact_tweets(skip_vacuum, time_views):
+    """
+    Move tweets.source, tweets.lang, tweet_media.url and tweet_tags.tag into
+    lookup tables, leaving small ids in their place, and report how much
+    smaller and quicker to scan the tables got. Run it before starting an
+    app version that expects the compact columns. The VACUUM FULL at the
+    end locks each partition while it is rewritten.
+    """
+    engine = direct_engine()
+
+    with engine.begin() as connection:
+        tables = pending_tables(connection)
+        if not tables:
+            print("tweets, tweet_media and tweet_tags are already compact")
+            return
+        before = {table: measure(connection, table) for table in COMPACTED_TABLES}
+    if time_views:
+        with engine.begin() as connection:
+            before_views = {view: time_view_refresh(connection, view) for view in TAG_VIEWS_SQL}
+
+    with engine.begin() as connection:
+        add_compact_columns(connection)
+        fill_lookups(connection, tables)
+        relations = tweet_relations(connection)
+
+    # One transaction per partition, so the locks and the WAL stay bounded
+    if 'tweets' in tables:
+        for relation in relations:
+            with engine.begin() as connection:
+                print(f"{relation}: {backfill_tweets(connection, relation)} rows encoded")
+    with engine.begin() as connection:
+        if 'tweet_media' in tables:
+            print(f"tweet_media: {backfill_media(connection)} rows encoded")
+        if 'tweet_tags' in tables:
+            print(f"tweet_tags: {backfill_tags(connection)} rows encoded")
+        drop_wide_columns(connection, tables)
+
+    if skip_vacuum:
+        print("Skipped VACUUM FULL; the dropped columns still take up space until the tables are rewritten")
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for relation in relations + ['tweet_media', 'tweet_tags']:
+            print(f"Rewriting {relation}...")
+            connection.execute(text(f"VACUUM FULL {relation}"))
+        connection.execute(text("ANALYZE tweets, tweet_media, tweet_tags, tags"))
+
+    with engine.begin() as connection:
+        after = {table: measure(connection, table) for table in COMPACTED_TABLES}
+
+    print(f"\n{'':<14}{'heap MB':>20}{'indexes MB':>20}{'scan ms':>20}{'buffers':>20}")
+    for table in COMPACTED_TABLES:
+        cells = []
+        for key, scale in (('heap', 1 << 20), ('indexes', 1 << 20), ('scan_ms', 1), ('buffers', 1)):
+            old, new = before[table][key], after[table][key]
+            cells.append(f"{old / scale:.1f} -> {new / scale:.1f} {format_change(old, new):>5}")
+        print(f"{table:<14}" + "".join(f"{cell:>20}" for cell in cells))
+
+    if time_views:
+        with engine.begin() as connection:
+            for view in TAG_VIEWS_SQL:
+                old, new = before_views[view], time_view_refresh(connection, view)
+                print(f"REFRESH {view}: {old:.0f} ms -> {new:.0f} ms {format_change(old, new)}")
+
+@cli.command("setup_tweet_search")
+def setup_tweet_search():
+    """
+    Add tweets.text_tsv with the trigger that maintains it, and fill it in
+    for existing tweets one partition at a time. Then run sync_indexes to
+    build the RUM indexes over it.
+    """
+    engine = direct_engine()
+    with engine.begin() as connection:
+        for sql in TWEET_SEARCH_SETUP_SQL:
+            connection.execute(text(sql))
+        relations = tweet_relations(connection)
+
+    for relation in relations:
+        with engine.begin() as connection:
+            print(f"{relation}: {backfill_text_tsv(connection, relation)} rows parsed")
+    print("Done; run manage.py sync_indexes to build the tweet search indexes")
+
+
 if __name__ == "__main__":
     cli()
@@ -1,14 +1,104 @@
 import os
 import time
-from flask import Flask, jsonify, send_from_directory, request, render_template, make_response, redirect
+import json
+import hmac
+from functools import wraps
+from datetime import datetime
+from flask import Flask, jsonify, send_from_directory, request, render_template, make_response, redirect, Response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text, event
+from sqlalchemy.types import TypeDecorator
 from werkzeug.utils import secure_filename
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from geoalchemy2 import Geometry
-import re
+from project.cache import TTLCache
+from project.config import server_profile, validate_server_profile
+from project.replicas import ReplicaRouter, REPLICA_LAG_SQL, is_sticky
+from project.page_cache import cached_page_key, page_entry, page_headers, cache_control, tweet_card_renderer
+from project.assets import load_manifest, asset_url_builder
+from project import metrics
+from project.profiling import RequestProfiler
+from project import autocomplete as suggest
+from project import tweet_search
+from project import search_query
+from project import read_model
+from project import search_page
+from project import timelines
+from project import tweet_batch
+from project.timelines import encode_cursor, decode_cursor
+from project.prepared import PreparedStatements
+from project.partitions import UNDATED
 
 app = Flask(__name__)
 app.config.from_object("project.config.Config")
-db = SQLAlchemy(app)
+validate_server_profile(app.config)
+
+
+class RoutingSession(Session):
+    """
+    Sends queries from views marked @read_only to the replica picked for
+    the request, and everything else to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('replica_bind_key'):
+            return self._db.engines[g.replica_bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_write(session):
+    # Picked up by stick_to_primary once the response is ready
+    if has_request_context():
+        g.wrote_to_primary = True
+
+
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+replica_router = ReplicaRouter(
+    app.config['SQLALCHEMY_BINDS'],
+    max_lag=app.config['REPLICA_MAX_LAG'],
+    check_interval=app.config['REPLICA_LAG_CHECK_INTERVAL']
+)
+
+# Assembled tweet dicts keyed by id_tweets, shared by the batch lookup API
+tweet_cache = TTLCache(maxsize=app.config['TWEET_CACHE_SIZE'], ttl=app.config['TWEET_CACHE_TTL'])
+
+# Rendered message timeline pages keyed by (username, cursor, since, limit)
+message_timeline_cache = TTLCache(maxsize=10000, ttl=app.config['TIMELINE_CACHE_TTL'])
+
+# Assembled conversation trees keyed by the requested id_tweets
+thread_cache = TTLCache(maxsize=2000, ttl=app.config['THREAD_CACHE_TTL'])
+
+# Whole rendered pages, and the HTML of individual tweet cards in tweets.html
+# create_message clears page_cache, but only in this process: the async app
+# (project/async_app.py) holds its own copy, which nothing there evicts on a
+# write, so its pages can be up to PAGE_CACHE_TTL seconds stale. The writer
+# doesn't see that, since the primary_until cookie skips the cache; everyone
+# else can.
+page_cache = TTLCache(maxsize=2000, ttl=app.config['PAGE_CACHE_TTL'])
+fragment_cache = TTLCache(maxsize=20000, ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+# Autocomplete suggestions keyed by (kind, normalized prefix). Each entry
+# holds the full AUTOCOMPLETE_MAX_LIMIT list, so every limit shares it.
+autocomplete_cache = TTLCache(maxsize=app.config['AUTOCOMPLETE_CACHE_SIZE'], ttl=app.config['AUTOCOMPLETE_CACHE_TTL'])
+
+# Parsed search queries as tsquery text, keyed by how they were parsed and
+# their canonical form, so a repeated search skips parsing
+tsquery_cache = TTLCache(maxsize=app.config['TSQUERY_CACHE_SIZE'], ttl=app.config['TSQUERY_CACHE_TTL'])
+app.jinja_env.globals['tweet_card'] = tweet_card_renderer(app.jinja_env, fragment_cache)
+
+# The hot statements, registered next to their SQL below and prepared on
+# each new connection to the primary and the replicas
+prepared_statements = PreparedStatements(enabled=app.config['PREPARED_STATEMENTS'])
+with app.app_context():
+    prepared_statements.install(db.engines.values())
+
+# Fingerprinted names of the stylesheets and scripts under static/, from the
+# manifest the image build writes (project/assets.py)
+asset_manifest = load_manifest()
+app.jinja_env.globals['asset_url'] = asset_url_builder(asset_manifest, app.static_url_path)
 
 # messages data
 
@@ -56,12 +146,49 @@ class User(db.Model):
     description = db.Column(db.Text)
     withheld_in_countries = db.Column(db.ARRAY(db.String(2)))
 
+# Lookup tables for values that repeat across millions of tweets. The rows
+# store small ids into these, and the models below read the text back, so
+# code using Tweet.source, Tweet.lang, TweetMedia.url and TweetTag.tag
+# doesn't notice.
+class TweetSource(db.Model):
+    __tablename__ = "tweet_sources"
+
+    id_source = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.Text, unique=True, nullable=False)
+
+class Lang(db.Model):
+    __tablename__ = "langs"
+
+    id_lang = db.Column(db.SmallInteger, primary_key=True)
+    lang = db.Column(db.Text, unique=True, nullable=False)
+
+class MediaUrlPrefix(db.Model):
+    __tablename__ = "media_url_prefixes"
+
+    id_prefix = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.Text, unique=True, nullable=False)
+
+class TweetDate(TypeDecorator):
+    """
+    tweets.created_at, which is '-infinity' for tweets without a date (see
+    project/partitions.py). The drivers return that as datetime.min; it is
+    read back as None, so callers see undated tweets as they always have.
+    """
+    impl = db.DateTime
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.replace(tzinfo=None) == datetime.min:
+            return None
+        return value
+
+
 class Tweet(db.Model):
     __tablename__ = "tweets"
     
     id_tweets = db.Column(db.BigInteger, primary_key=True)
     id_users = db.Column(db.BigInteger, db.ForeignKey('users.id_users'))
-    created_at = db.Column(db.DateTime(timezone=True))
+    created_at = db.Column(TweetDate(timezone=True), nullable=False, server_default=text(UNDATED))
     in_reply_to_status_id = db.Column(db.BigInteger)
     in_reply_to_user_id = db.Column(db.BigInteger)
     quoted_status_id = db.Column(db.BigInteger)
@@ -70,17 +197,29 @@ class Tweet(db.Model):
     quote_count = db.Column(db.SmallInteger)
     withheld_copyright = db.Column(db.Boolean)
     withheld_in_countries = db.Column(db.ARRAY(db.String(2)))
-    source = db.Column(db.Text)
+    id_source = db.Column(db.Integer, db.ForeignKey('tweet_sources.id_source'))
     text = db.Column(db.Text)
     country_code = db.Column(db.String(2))
     state_code = db.Column(db.String(2))
-    lang = db.Column(db.Text)
+    id_lang = db.Column(db.SmallInteger, db.ForeignKey('langs.id_lang'))
     place_name = db.Column(db.Text)
     geo = db.Column(Geometry)
+    # Maintained by the tweets_text_tsv trigger for tweet search; deferred
+    # so loading a Tweet doesn't fetch it
+    text_tsv = db.deferred(db.Column(TSVECTOR))
+
+    source = db.column_property(
+        db.select(TweetSource.source).where(TweetSource.id_source == id_source).scalar_subquery()
+    )
+    lang = db.column_property(
+        db.select(Lang.lang).where(Lang.id_lang == id_lang).scalar_subquery()
+    )
     
     # Relationship with User
     user = db.relationship('User', backref=db.backref('tweets', lazy=True))
 
+# db.create_all() points the tweet_* foreign keys at tweets;
+# partition_table moves them to tweet_ids once tweets is partitioned
 class TweetUrl(db.Model):
     __tablename__ = "tweet_urls"
     
@@ -100,11 +239,21 @@ class TweetMention(db.Model):
     tweet = db.relationship('Tweet', backref=db.backref('mentions', lazy=True))
     user = db.relationship('User', backref=db.backref('mentioned_in', lazy=True))
 
+class Tag(db.Model):
+    __tablename__ = "tags"
+
+    id_tag = db.Column(db.Integer, primary_key=True)
+    tag = db.Column(db.Text, unique=True, nullable=False)
+
 class TweetTag(db.Model):
     __tablename__ = "tweet_tags"
     
     id_tweets = db.Column(db.BigInteger, db.ForeignKey('tweets.id_tweets'), primary_key=True)
-    tag = db.Column(db.Text, primary_key=True)
+    id_tag = db.Column(db.Integer, db.ForeignKey('tags.id_tag'), primary_key=True)
+
+    tag = db.column_property(
+        db.select(Tag.tag).where(Tag.id_tag == id_tag).scalar_subquery()
+    )
     
     # Relationship with Tweet
     tweet = db.relationship('Tweet', backref=db.backref('tags', lazy=True))
@@ -113,8 +262,13 @@ class TweetMedia(db.Model):
     __tablename__ = "tweet_media"
     
     id_tweets = db.Column(db.BigInteger, db.ForeignKey('tweets.id_tweets'), primary_key=True)
-    url = db.Column(db.Text, primary_key=True)
+    id_prefix = db.Column(db.Integer, db.ForeignKey('media_url_prefixes.id_prefix'), primary_key=True)
+    url_key = db.Column(db.Text, primary_key=True)
     type = db.Column(db.Text)
+
+    url = db.column_property(
+        db.select(MediaUrlPrefix.prefix).where(MediaUrlPrefix.id_prefix == id_prefix).scalar_subquery() + url_key
+    )
     
     # Relationship with Tweet
     tweet = db.relationship('Tweet', backref=db.backref('media', lazy=True))
@@ -153,6 +307,143 @@ def print_debug_info():
 
     
 
+def choose_replica():
+    """
+    Pick the replica bind key for a read-only request, or None to use the primary.
+    Lag is re-measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per worker.
+    """
+    if not replica_router.bind_keys or is_sticky(request.cookies, 'primary_until'):
+        return None
+
+    for key in replica_router.stale_keys():
+        try:
+            with db.engines[key].connect() as connection:
+                lag = float(connection.execute(REPLICA_LAG_SQL).scalar())
+        except Exception as e:
+            print(f"Error checking replica {key}: {e}")
+            lag = None
+        replica_router.record_lag(key, lag)
+
+    return replica_router.choose()
+
+
+def read_only(view):
+    """Let a view's queries go to a replica; it must not write anything"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_bind_key = choose_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def cached_page(view):
+    """
+    Serve a page from page_cache while it is fresh, with Cache-Control and
+    ETag headers so nginx can keep anonymous copies and browsers can revalidate.
+    Someone who just wrote something skips the cache until they can read it back.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = cached_page_key(request.method, request.path, request.query_string.decode(), request.cookies)
+        if key is None or g.get('profiler'):
+            return view(*args, **kwargs)
+
+        cached = page_cache.get(key)
+
+        if cached is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cached = page_entry(response.get_data())
+            page_cache.set(key, cached)
+
+        body, etag = cached
+        response = Response(body, mimetype='text/html',
+                            headers=page_headers(etag, request.cookies, app.config['PAGE_CACHE_TTL']))
+        return response.make_conditional(request)
+    return wrapper
+
+
+metrics.instrument_engines(app.config['SLOW_QUERY_MS'])
+
+profiler = RequestProfiler(
+    app.config['PROFILE_DIR'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    routes=app.config['PROFILE_ROUTES'],
+    max_files=app.config['PROFILE_MAX_FILES']
+)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = metrics.begin_request(request.url_rule.rule if request.url_rule else None)
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_token' in g:
+        metrics.end_request(g.pop('metrics_token'), request.method, response.status_code)
+    return response
+
+
+@app.before_request
+def start_profiler():
+    """
+    Profile this request if an admin asked for it with ?profile=1 (or
+    ?profile=text to get the report back instead of the page) or an
+    X-Profile header, or if it was picked by PROFILE_SAMPLE_RATE
+    """
+    route = request.url_rule.rule if request.url_rule else None
+    requested = request.args.get('profile') or request.headers.get('X-Profile')
+    if (requested and is_admin()) or profiler.should_sample(route):
+        g.profiler = profiler.start()
+        g.profile_started = time.perf_counter()
+
+
+@app.after_request
+def save_profile(response):
+    if not g.get('profiler'):
+        return response
+    route = request.url_rule.rule if request.url_rule else None
+    name = profiler.finish(g.pop('profiler'), route, time.perf_counter() - g.profile_started)
+    if request.args.get('profile') == 'text' and is_admin():
+        return Response(profiler.report(name), mimetype='text/plain', headers={'X-Profile-Id': name})
+    response.headers['X-Profile-Id'] = name
+    return response
+
+
+@app.after_request
+def stick_to_primary(response):
+    """After a write, send this client's reads to the primary until replicas catch up"""
+    if g.get('wrote_to_primary'):
+        sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        response.set_cookie('primary_until', str(time.time() + sticky_seconds), max_age=sticky_seconds)
+    return response
+
+
+def is_admin():
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+
+def admin_required(view):
+    """Only let requests carrying the configured X-Admin-Token through"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({
+                "status": "error",
+                "message": "Admin token required"
+            }), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+CHECK_CREDENTIALS_SQL = prepared_statements.add('check_credentials', text("""
+SELECT id_users FROM accounts WHERE username = :username AND password = :password LIMIT 1
+"""))
+
+
 def check_credentials(username, password):
     """
     Check if the provided username and password match a record in the accounts table.
@@ -163,15 +454,53 @@ def check_credentials(username, password):
         
     try:
         # Query the accounts table to find a matching account
-        account = Account.query.filter_by(username=username, password=password).first()
-        
+        account = prepared_statements.execute(
+            db.session, 'check_credentials', {'username': username, 'password': password}
+        ).first()
+
         # If we found a matching account, return True
         return account is not None
     except Exception as e:
         print(f"Error checking credentials: {e}")
         return False
 
+
+prepared_statements.add('messages_page', read_model.MESSAGES_PAGE_SQL)
+prepared_statements.add('tweets_page', read_model.TWEETS_PAGE_SQL)
+prepared_statements.add('tweet_rows_by_id', read_model.TWEET_ROWS_BY_ID_SQL)
+MESSAGES_COUNT_SQL = prepared_statements.add('messages_count', text("SELECT COUNT(*) FROM messages"))
+TWEETS_COUNT_SQL = prepared_statements.add('tweets_count', text("SELECT COUNT(*) FROM tweets"))
+
+
+def load_message_page(user_id, limit, offset):
+    """One page of the newest messages as read_model.MessageRows"""
+    rows = prepared_statements.execute(db.session, 'messages_page', {'limit': limit, 'offset': offset})
+    return read_model.message_rows(rows, user_id)
+
+
+def load_tweet_page(limit, offset):
+    """One page of the newest tweets as read_model.TweetRows"""
+    rows = prepared_statements.execute(db.session, 'tweets_page', {'limit': limit, 'offset': offset}).all()
+    # The relations come from the batch lookups and tweet_cache rather
+    # than lazy loads per tweet
+    related = get_tweets_by_id([row.id_tweets for row in rows])
+    return read_model.tweet_rows(rows, related)
+
+
+def load_tweet_rows(tweets):
+    """read_model.TweetRows for the tweet dicts of get_tweets_by_id, in the same order"""
+    if not tweets:
+        return []
+    related = {tweet['id']: tweet for tweet in tweets}
+    position = {tweet_id: index for index, tweet_id in enumerate(related)}
+    rows = prepared_statements.execute(db.session, 'tweet_rows_by_id', {'ids': list(related)}).all()
+    rows.sort(key=lambda row: position[row.id_tweets])
+    return read_model.tweet_rows(rows, related)
+
+
 @app.route("/")
+@cached_page
+@read_only
 def root():
     # login check
     username = request.cookies.get('username')
@@ -181,27 +510,7 @@ def root():
 
     # Query the 20 most recent messages from all users
     try:
-        # Using a join to get both messages and usernames
-        recent_messages = db.session.query(
-            Message, Account.username
-        ).join(
-            Account, Message.id_users == Account.id_users
-        ).order_by(
-            Message.created_at.desc()
-        ).limit(20).all()
-
-        # Format messages with username
-        messages = []
-        for message, username in recent_messages:
-            messages.append({
-                'id': message.id_message,
-                'text': message.message_text,
-                'created_at': message.created_at,
-                'username': username,
-                # Optional: flag messages from the current user
-                'is_own': str(message.id_users) == user_id if user_id else False
-            })
-            
+        messages = load_message_page(user_id, 20, 0)
     except Exception as e:
         print(f"Error fetching messages: {e}")
         messages = []
@@ -255,7 +564,16 @@ def logout():
     response.set_cookie('id_users', '')
     return response
 
+@app.route("/metrics")
+@admin_required
+def prometheus_metrics():
+    """Request latency, SQL counts and slow queries in Prometheus text format"""
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @app.route("/api/test")
+@read_only
 def test_db():
     """Simple test endpoint to verify database connection"""
     try:
@@ -302,6 +620,7 @@ def test_db():
 
 
 @app.route("/api/data")
+@read_only
 def get_data():
     """Simple endpoint to retrieve sample data from the database tables"""
     try:
@@ -357,43 +676,374 @@ def get_data():
 
 
 @app.route("/api/messages/<username>")
+@read_only
 def get_messages(username):
-    """Get messages for a specific user"""
+    """
+    Get a page of messages for a specific user, newest first.
+    Pages are cached for TIMELINE_CACHE_TTL seconds, so a client polling
+    with If-None-Match gets a 304 without touching the database.
+    """
     try:
-        # Find account by username
-        account = Account.query.filter_by(username=username).first()
+        query = timelines.message_timeline_query(username, request.args)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid parameter: {e}"
+        }), 400
+
+    cached = message_timeline_cache.get(query.cache_key)
+
+    if cached is None:
+        try:
+            id_users = db.session.execute(timelines.ACCOUNT_ID_SQL, {'username': username}).scalar()
+
+            if id_users is None:
+                return jsonify({
+                    "status": "error",
+                    "message": "Account not found"
+                }), 404
+
+            rows = db.session.execute(query.statement, dict(query.params, id_users=id_users)).all()
+            cached = timelines.message_timeline_page(username, rows, query.per_page)
+            message_timeline_cache.set(query.cache_key, cached)
 
-        if not account:
+        except Exception as e:
             return jsonify({
                 "status": "error",
-                "message": "Account not found"
-            }), 404
+                "message": str(e)
+            }), 500
 
-        # Get messages for this account
-        messages = Message.query.filter_by(id_users=account.id_users).all()
+    etag, last_modified, payload = cached
+    response = jsonify(payload)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+def parse_export_filters():
+    """
+    Read the time-range and user filters shared by the export endpoints.
+    Raises ValueError if a timestamp or user id is malformed.
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    user_id = request.args.get('id_users')
+
+    return {
+        'since': datetime.fromisoformat(since) if since else None,
+        'until': datetime.fromisoformat(until) if until else None,
+        'id_users': int(user_id) if user_id else None,
+        'username': request.args.get('username') or request.args.get('screen_name')
+    }
+
+
+def stream_ndjson(statement, format_row):
+    """
+    Stream the rows of a select as newline-delimited JSON.
+    Rows are fetched from a server-side cursor in batches of EXPORT_BATCH_SIZE,
+    so memory use stays constant no matter how many rows match.
+    """
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    statement = statement.execution_options(yield_per=batch_size)
+
+    def generate():
+        try:
+            result = db.session.execute(statement)
+            for partition in result.partitions():
+                yield ''.join(json.dumps(format_row(row)) + '\n' for row in partition)
+        finally:
+            db.session.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-        # Format messages
-        messages_data = [
-            {
-                "id": message.id_message,
-                "text": message.message_text
-            }
-            for message in messages
-        ]
 
+@app.route("/api/export/tweets")
+@read_only
+def export_tweets():
+    """Stream tweets as NDJSON, optionally filtered by time range and user"""
+    try:
+        filters = parse_export_filters()
+    except ValueError as e:
         return jsonify({
-            "status": "success",
-            "username": username,
-            "message_count": len(messages_data),
-            "messages": messages_data
+            "status": "error",
+            "message": f"Invalid filter: {e}"
+        }), 400
+
+    statement = db.select(
+        Tweet.id_tweets,
+        Tweet.id_users,
+        User.screen_name,
+        Tweet.created_at,
+        Tweet.in_reply_to_status_id,
+        Tweet.quoted_status_id,
+        Tweet.retweet_count,
+        Tweet.favorite_count,
+        Tweet.quote_count,
+        Tweet.lang,
+        Tweet.country_code,
+        Tweet.text
+    ).join(
+        User, Tweet.id_users == User.id_users
+    )
+
+    if filters['since']:
+        statement = statement.where(Tweet.created_at >= filters['since'])
+    if filters['until']:
+        statement = statement.where(Tweet.created_at < filters['until'])
+    if filters['id_users'] is not None:
+        statement = statement.where(Tweet.id_users == filters['id_users'])
+    if filters['username']:
+        statement = statement.where(User.screen_name == filters['username'])
+
+    def format_row(row):
+        return {
+            "id": row.id_tweets,
+            "id_users": row.id_users,
+            "screen_name": row.screen_name,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "in_reply_to_status_id": row.in_reply_to_status_id,
+            "quoted_status_id": row.quoted_status_id,
+            "retweet_count": row.retweet_count,
+            "favorite_count": row.favorite_count,
+            "quote_count": row.quote_count,
+            "lang": row.lang,
+            "country_code": row.country_code,
+            "text": row.text
+        }
+
+    return stream_ndjson(statement, format_row)
+
+
+@app.route("/api/export/messages")
+@read_only
+def export_messages():
+    """Stream messages as NDJSON, optionally filtered by time range and user"""
+    try:
+        filters = parse_export_filters()
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid filter: {e}"
+        }), 400
+
+    statement = db.select(
+        Message.id_message,
+        Message.id_users,
+        Account.username,
+        Message.created_at,
+        Message.message_text
+    ).join(
+        Account, Message.id_users == Account.id_users
+    )
+
+    if filters['since']:
+        statement = statement.where(Message.created_at >= filters['since'])
+    if filters['until']:
+        statement = statement.where(Message.created_at < filters['until'])
+    if filters['id_users'] is not None:
+        statement = statement.where(Message.id_users == filters['id_users'])
+    if filters['username']:
+        statement = statement.where(Account.username == filters['username'])
+
+    def format_row(row):
+        return {
+            "id": row.id_message,
+            "id_users": row.id_users,
+            "username": row.username,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "text": row.message_text
+        }
+
+    return stream_ndjson(statement, format_row)
+
+# Goes through tweet_ids for each tweet's created_at, so every id opens
+# only the partition that holds it (see project/partitions.py)
+TWEETS_BY_ID_SQL = prepared_statements.add('tweets_by_id', text("""
+SELECT t.id_tweets, t.id_users, NULLIF(t.created_at, '-infinity') AS created_at, t.text, t.retweet_count,
+       t.favorite_count, t.quote_count, l.lang, s.source,
+       t.in_reply_to_status_id, t.quoted_status_id,
+       u.screen_name, u.name
+FROM tweet_ids i
+JOIN tweets t ON t.id_tweets = i.id_tweets AND t.created_at = i.created_at
+LEFT JOIN users u ON u.id_users = t.id_users
+LEFT JOIN langs l ON l.id_lang = t.id_lang
+LEFT JOIN tweet_sources s ON s.id_source = t.id_source
+WHERE i.id_tweets = ANY(:ids)
+"""))
+
+# One query per relation table
+prepared_statements.add('tweet_tags_by_id', text("""
+SELECT tt.id_tweets, g.tag
+FROM tweet_tags tt
+JOIN tags g ON g.id_tag = tt.id_tag
+WHERE tt.id_tweets = ANY(:ids)
+"""))
+prepared_statements.add('tweet_mentions_by_id', text("""
+SELECT m.id_tweets, m.id_users, u.screen_name
+FROM tweet_mentions m
+LEFT JOIN users u ON u.id_users = m.id_users
+WHERE m.id_tweets = ANY(:ids)
+"""))
+prepared_statements.add('tweet_media_by_id', text("""
+SELECT m.id_tweets, p.prefix || m.url_key AS url, m.type
+FROM tweet_media m
+JOIN media_url_prefixes p ON p.id_prefix = m.id_prefix
+WHERE m.id_tweets = ANY(:ids)
+"""))
+prepared_statements.add('tweet_urls_by_id', text("SELECT id_tweets, url FROM tweet_urls WHERE id_tweets = ANY(:ids)"))
+
+# Names of the relation statements, in the order attach_tweet_relations takes their rows
+TWEET_RELATION_STATEMENTS = ['tweet_tags_by_id', 'tweet_mentions_by_id', 'tweet_media_by_id', 'tweet_urls_by_id']
+
+
+def format_tweet_row(row):
+    """Turn a TWEETS_BY_ID_SQL row into the tweet dict the APIs return"""
+    return {
+        "id": row.id_tweets,
+        "text": row.text,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "retweet_count": row.retweet_count,
+        "favorite_count": row.favorite_count,
+        "quote_count": row.quote_count,
+        "lang": row.lang,
+        "source": row.source,
+        "in_reply_to_status_id": row.in_reply_to_status_id,
+        "quoted_status_id": row.quoted_status_id,
+        "user": {
+            "id": row.id_users,
+            "screen_name": row.screen_name,
+            "name": row.name
+        },
+        "tags": [],
+        "mentions": [],
+        "media": [],
+        "urls": []
+    }
+
+
+def attach_tweet_relations(tweets, tag_rows, mention_rows, media_rows, url_rows):
+    """Fill in the relation lists of format_tweet_row dicts from TWEET_RELATION_STATEMENTS results"""
+    for row in tag_rows:
+        tweets[row.id_tweets]["tags"].append(row.tag)
+    for row in mention_rows:
+        tweets[row.id_tweets]["mentions"].append({
+            "id": row.id_users,
+            "screen_name": row.screen_name
         })
+    for row in media_rows:
+        tweets[row.id_tweets]["media"].append({"url": row.url, "type": row.type})
+    for row in url_rows:
+        tweets[row.id_tweets]["urls"].append(row.url)
+    return tweets
+
+
+def load_tweets_by_id(tweet_ids):
+    """
+    Assemble tweets with their user, tags, mentions, media and urls.
+    Uses one query per table no matter how many ids are passed, and returns
+    a dict keyed by id_tweets. Ids that don't exist are left out.
+    """
+    if not tweet_ids:
+        return {}
+
+    tweets = {
+        row.id_tweets: format_tweet_row(row)
+        for row in prepared_statements.execute(db.session, 'tweets_by_id', {'ids': list(tweet_ids)})
+    }
+    if not tweets:
+        return tweets
+
+    params = {'ids': list(tweets)}
+    relations = [prepared_statements.execute(db.session, name, params) for name in TWEET_RELATION_STATEMENTS]
+    return attach_tweet_relations(tweets, *relations)
 
+
+def get_tweets_by_id(tweet_ids):
+    """
+    Look tweets up in tweet_cache first and load only the misses from Postgres.
+    Returns a dict keyed by id_tweets.
+    """
+    tweets = tweet_cache.get_many(tweet_ids)
+    missing = [tweet_id for tweet_id in tweet_ids if tweet_id not in tweets]
+    if missing:
+        loaded = load_tweets_by_id(missing)
+        tweet_cache.set_many(loaded)
+        tweets.update(loaded)
+    return tweets
+
+
+@app.route("/api/tweets/batch", methods=['POST'])
+@read_only
+def get_tweets_batch():
+    """Get many tweets by id in one request"""
+    try:
+        tweet_ids = tweet_batch.parse_batch(request.get_json(silent=True), app.config['TWEET_BATCH_MAX_IDS'])
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    try:
+        return jsonify(tweet_batch.batch_result(tweet_ids, get_tweets_by_id(tweet_ids)))
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
 
+def autocomplete_suggestions(kind, prefix):
+    """
+    Up to AUTOCOMPLETE_MAX_LIMIT users or tags for `prefix`: prefix matches
+    first, then trigram matches if those don't fill the list
+    """
+    cached = autocomplete_cache.get((kind, prefix))
+    if cached is not None:
+        return cached
+
+    limit = app.config['AUTOCOMPLETE_MAX_LIMIT']
+    prefix_sql, fuzzy_sql, params, format_row, key = suggest.suggestion_queries(kind, prefix, limit)
+    found = [format_row(row) for row in db.session.execute(prefix_sql, params)]
+    if suggest.wants_fuzzy(prefix, found, limit):
+        extra = [format_row(row) for row in db.session.execute(fuzzy_sql, params)]
+        suggest.merge(found, extra, key, limit)
+
+    autocomplete_cache.set((kind, prefix), found)
+    return found
+
+
+@app.route("/api/autocomplete")
+@read_only
+def get_autocomplete():
+    """
+    Suggest users and tags for a search box as someone types. `q` is what
+    they have typed so far, `type` is users, tags or all, and `limit` caps
+    each list.
+    """
+    try:
+        prefix, kind, limit = suggest.parse_request(request.args, app.config['AUTOCOMPLETE_MAX_LIMIT'])
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    try:
+        payload = {"status": "success", "query": prefix}
+        for name in suggest.requested_kinds(kind):
+            payload[name] = autocomplete_suggestions(name, prefix)[:limit] if prefix else []
+
+        response = jsonify(payload)
+        response.headers['Cache-Control'] = cache_control(True, app.config['AUTOCOMPLETE_CACHE_TTL'])
+        return response
+
+    except Exception as e:
+        print(f"Autocomplete error: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @app.route("/create_account", methods=['GET', 'POST'])
 def create_account():
     if request.method == 'GET':
@@ -486,6 +1136,8 @@ def create_message():
 
         db.session.add(new_message)
         db.session.commit()
+        message_timeline_cache.delete_where(lambda key: key[0] == username)
+        page_cache.clear()
 
         # Redirect to home page where messages are displayed
         return redirect('/')
@@ -495,7 +1147,93 @@ def create_message():
         return render_template('create_message.html', error=f"Error creating message: {str(e)}", logged_in=True)
 
 
+# Messages are searched in English. Both statements take the query already
+# parsed by parsed_tsquery, so neither parses it again. The configuration
+# the query is parsed with is bound like tweet_search.LANG_CONFIG's :lang,
+# not spliced into the SQL.
+SEARCH_CONFIG = "CAST(:config AS regconfig)"
+SEARCH_LANGUAGE = 'english'
+
+SEARCH_COUNT_SQL = prepared_statements.add('search_count', text("""
+SELECT COUNT(*)
+FROM messages m
+JOIN accounts a ON m.id_users = a.id_users
+WHERE to_tsvector('english', m.message_text) @@ CAST(:tsquery AS tsquery)
+"""))
+
+SEARCH_SQL = prepared_statements.add('search_page', text("""
+SELECT 
+    m.id_message, 
+    m.message_text, 
+    m.created_at, 
+    m.id_users, 
+    a.username,
+    ts_rank(to_tsvector('english', m.message_text), CAST(:tsquery AS tsquery)) AS rank
+FROM messages m
+JOIN accounts a ON m.id_users = a.id_users
+WHERE to_tsvector('english', m.message_text) @@ CAST(:tsquery AS tsquery)
+ORDER BY 
+    rank DESC,
+    m.created_at DESC
+LIMIT :limit OFFSET :offset
+"""))
+
+# Every combination of tweet search filters and order. Only the unfiltered
+# searches are prepared on every connection; a filtered one is prepared on
+# a connection the first time it runs there. The count doesn't depend on
+# the order, so there is one count statement per set of filters.
+for filters in tweet_search.filter_sets():
+    for order in tweet_search.ORDERS:
+        count_name, page_name = tweet_search.statement_names(filters, order)
+        count_sql, page_sql = tweet_search.search_sql(filters, order)
+        prepared_statements.add(page_name, page_sql, lazy=bool(filters))
+    prepared_statements.add(count_name, count_sql, lazy=bool(filters))
+
+
+def message_tsquery_lookup(parsed):
+    """project.search_query.tsquery_lookup for a message search"""
+    return search_query.tsquery_lookup(parsed, config=SEARCH_CONFIG, params={'config': SEARCH_LANGUAGE})
+
+
+def parsed_tsquery(lookup):
+    """
+    The tsquery text for a (statement, params, cache key) from
+    search_query.tsquery_lookup, parsed by Postgres once per canonical query
+    """
+    statement, params, key = lookup
+    tsquery = tsquery_cache.get(key)
+    if tsquery is None:
+        tsquery = db.session.execute(statement, params).scalar() or ''
+        tsquery_cache.set(key, tsquery)
+    return tsquery
+
+
+def search_messages(parsed, limit, offset):
+    """The number of messages matching the parsed query, and one page of them"""
+    tsquery = parsed_tsquery(message_tsquery_lookup(parsed))
+    if not tsquery:
+        return 0, []
+    total = prepared_statements.execute(db.session, 'search_count', {'tsquery': tsquery}).scalar() or 0
+    rows = prepared_statements.execute(
+        db.session, 'search_page', {'tsquery': tsquery, 'limit': limit, 'offset': offset}
+    ).all()
+    return total, rows
+
+
+def search_tweets(parsed, filters, order, limit, offset):
+    """The number of tweets matching the parsed query and filters, and one page of them"""
+    tsquery = parsed_tsquery(tweet_search.search_tsquery_lookup(parsed, filters))
+    if not tsquery:
+        return 0, []
+    count_name, page_name = tweet_search.statement_names(tuple(sorted(filters)), order)
+    params = dict(filters, tsquery=tsquery)
+    total = prepared_statements.execute(db.session, count_name, params).scalar() or 0
+    rows = prepared_statements.execute(db.session, page_name, dict(params, limit=limit, offset=offset)).all()
+    return total, rows
+
+
 @app.route("/search", methods=['GET', 'POST'])
+@read_only
 def search():
     # Check if user is logged in
     username = request.cookies.get('username')
@@ -503,112 +1241,42 @@ def search():
     user_id = request.cookies.get('id_users')
     good_credentials = check_credentials(username, password)
 
-    # Initialize variables
-    results = []
     query_text = request.form.get('query', '') if request.method == 'POST' else request.args.get('query', '')
-    page = int(request.args.get('page', 1))
-    per_page = 30
+    search = search_page.parse_search(query_text, request.values, request.args)
+    results = []
     total_results = 0
     query_time_ms = None
 
     if query_text:
         try:
-            from sqlalchemy import text
-            import time
-
             start_time = time.time()
+            offset = search_page.search_offset(search)
+
+            # None when the query has no words to search for
+            parsed = search_query.parse(query_text)
+
+            if parsed and search.mode == 'tweets':
+                total_results, rows = search_tweets(parsed, search.filters, search.order, search_page.PER_PAGE, offset)
+                results = search_page.tweet_results(rows, query_text)
+            elif parsed:
+                total_results, rows = search_messages(parsed, search_page.PER_PAGE, offset)
+                results = search_page.message_results(rows, query_text, user_id)
 
-            # First get total count for pagination
-            count_sql = text("""
-            SELECT COUNT(*)
-            FROM messages m
-            JOIN accounts a ON m.id_users = a.id_users
-            WHERE to_tsvector('english', m.message_text) @@ to_tsquery('english', :query)
-            """)
-
-            count_result = db.session.execute(count_sql, {'query': query_text}).scalar()
-            total_results = count_result or 0
-
-            # Then get paginated results
-            search_sql = text("""
-            SELECT 
-                m.id_message, 
-                m.message_text, 
-                m.created_at, 
-                m.id_users, 
-                a.username,
-                ts_rank(to_tsvector('english', m.message_text), to_tsquery('english', :query)) AS rank
-            FROM messages m
-            JOIN accounts a ON m.id_users = a.id_users
-            WHERE to_tsvector('english', m.message_text) @@ to_tsquery('english', :query)
-            ORDER BY 
-                rank DESC,
-                m.created_at DESC
-            LIMIT :limit OFFSET :offset
-            """)
-
-            offset = (page - 1) * per_page
-            result = db.session.execute(
-                search_sql,
-                {'query': query_text, 'limit': per_page, 'offset': offset}
-            )
             query_time = time.time() - start_time
             query_time_ms = int(query_time * 1000)
-            # Process results
-            for row in result:
-                # Get the message text and split the query into words
-                message_text = row.message_text
-                search_terms = query_text.lower().split()
-
-                # Create highlighted version of the message
-                highlighted_text = message_text
-                for term in search_terms:
-                    if len(term) > 2:  # Only highlight meaningful terms
-                        pattern = re.compile(r'\b(' + re.escape(term) + r')\b', re.IGNORECASE)
-                        highlighted_text = pattern.sub(r'<span class="highlight">\1</span>', highlighted_text)
-
-                results.append({
-                    'id': row.id_message,
-                    'text': row.message_text,
-                    'highlighted_text': highlighted_text,
-                    'created_at': row.created_at,
-                    'username': row.username,
-                    'is_own': str(row.id_users) == user_id if user_id else False
-                })
-
 
         except Exception as e:
-            # Make sure to define all template variables even when an exception occurs
-            return render_template('search.html',
-                                logged_in=good_credentials,
-                                error=f"Search error: {str(e)}",
-                                query=query_text,
-                                results=[],
-                                total_results=0,
-                                page=page,
-                                total_pages=0,
-                                has_prev=False,
-                                has_next=False,
-                                query_time_ms=None)
-
-    # Calculate pagination info
-    total_pages = max(1, (total_results + per_page - 1) // per_page)
-    has_prev = page > 1
-    has_next = page < total_pages
+            return render_template('search.html', logged_in=good_credentials,
+                                   **search_page.error_context(search, e))
 
     # For both GET and POST
-    return render_template('search.html',
-                          logged_in=good_credentials,
-                          results=results,
-                          query=query_text,
-                          page=page,
-                          total_pages=total_pages,
-                          total_results=total_results,
-                          has_prev=has_prev,
-                          has_next=has_next,
-                          query_time_ms=query_time_ms)
-    
+    return render_template('search.html', logged_in=good_credentials,
+                           **search_page.page_context(search, results, total_results, query_time_ms))
+
+
 @app.route("/all_messages")
+@cached_page
+@read_only
 def all_messages():
     # login check
     username = request.cookies.get('username')
@@ -622,32 +1290,13 @@ def all_messages():
     
     try:
         # Get total count for pagination
-        total_count = db.session.query(Message).count()
+        total_count = prepared_statements.execute(db.session, 'messages_count').scalar()
         
         # Get paginated messages
-        paginated_messages = db.session.query(
-            Message, Account.username
-        ).join(
-            Account, Message.id_users == Account.id_users
-        ).order_by(
-            Message.created_at.desc()
-        ).limit(per_page).offset((page - 1) * per_page).all()
-
-        # Format messages
-        messages = []
-        for message, username in paginated_messages:
-            messages.append({
-                'id': message.id_message,
-                'text': message.message_text,
-                'created_at': message.created_at,
-                'username': username,
-                'is_own': str(message.id_users) == user_id if user_id else False
-            })
-            
+        messages = load_message_page(user_id, per_page, (page - 1) * per_page)
+
         # Calculate pagination values
-        total_pages = max(1, (total_count + per_page - 1) // per_page)
-        has_prev = page > 1
-        has_next = page < total_pages
+        total_pages, has_prev, has_next = read_model.pagination(page, per_page, total_count)
             
     except Exception as e:
         print(f"Error fetching messages: {e}")
@@ -665,6 +1314,8 @@ def all_messages():
                            has_next=has_next)
 
 @app.route("/tweets")
+@cached_page
+@read_only
 def tweets():
     # login check
     username = request.cookies.get('username')
@@ -678,80 +1329,13 @@ def tweets():
 
     try:
         # Get total count for pagination
-        total_count = db.session.query(Tweet).count()
+        total_count = prepared_statements.execute(db.session, 'tweets_count').scalar()
 
         # Get paginated tweets with related data
-        tweets_data = db.session.query(Tweet).join(
-            User, Tweet.id_users == User.id_users
-        ).order_by(
-            Tweet.created_at.desc()
-        ).limit(per_page).offset((page - 1) * per_page).all()
-
-        # Format tweets
-        tweets = []
-        for tweet in tweets_data:
-            # Get hashtags
-            hashtags = [tag.tag for tag in tweet.tags]
-
-            # Get mentions with user information
-            mentions = []
-            for mention in tweet.mentions:
-                # Try to get the mentioned user's information
-                mentioned_user = User.query.get(mention.id_users)
-                if mentioned_user:
-                    mentions.append({
-                        'id': mention.id_users,
-                        'screen_name': mentioned_user.screen_name,
-                        'name': mentioned_user.name
-                    })
-
-            # Get media items
-            media_items = [{'url': m.url, 'type': m.type} for m in tweet.media]
-
-            # Format URLs
-            urls = [{'url': u.url} for u in tweet.urls]
-
-            # Check if it's a retweet/quote
-            is_retweet = tweet.text.startswith('RT @')
-            is_quote = tweet.quoted_status_id is not None
-
-            # Get Tweet info
-            tweet_info = {
-                'id': tweet.id_tweets,
-                'text': tweet.text,
-                'created_at': tweet.created_at,
-                'retweet_count': tweet.retweet_count,
-                'favorite_count': tweet.favorite_count,
-                'quote_count': tweet.quote_count,
-                'source': tweet.source,
-                'lang': tweet.lang,
-                'user': {
-                    'id': tweet.user.id_users,
-                    'screen_name': tweet.user.screen_name,
-                    'name': tweet.user.name,
-                    'description': tweet.user.description,
-                    'location': tweet.user.location,
-                    'verified': tweet.user.verified,
-                    'url': tweet.user.url
-                },
-                'hashtags': hashtags,
-                'mentions': mentions,
-                'media': media_items,
-                'urls': urls,
-                'is_retweet': is_retweet,
-                'is_quote': is_quote,
-                'location': {
-                    'place_name': tweet.place_name,
-                    'country_code': tweet.country_code,
-                    'state_code': tweet.state_code
-                }
-            }
-            tweets.append(tweet_info)
+        tweets = load_tweet_page(per_page, (page - 1) * per_page)
 
         # Calculate pagination values
-        total_pages = max(1, (total_count + per_page - 1) // per_page)
-        has_prev = page > 1
-        has_next = page < total_pages
+        total_pages, has_prev, has_next = read_model.pagination(page, per_page, total_count)
 
     except Exception as e:
         print(f"Error fetching tweets: {e}")
@@ -769,3 +1353,330 @@ def tweets():
                           total_count=total_count,
                           has_prev=has_prev,
                           has_next=has_next)
+
+
+def user_tweet_page(screen_name, cursor, per_page):
+    """
+    Load one page of a user's tweets, newest first.
+    Returns (user, tweets, next_cursor), or (None, [], None) if the user doesn't exist.
+    Raises ValueError if the cursor is malformed.
+    """
+    cursor_created_at, cursor_id = decode_cursor(cursor) if cursor else (None, None)
+
+    user = User.query.filter_by(screen_name=screen_name).first()
+    if not user:
+        return None, [], None
+
+    # Only the ids come from idx_tweets_id_users_created_at; the tweets
+    # themselves are batch-loaded (or served from tweet_cache) afterwards
+    query = db.session.query(
+        Tweet.id_tweets, Tweet.created_at
+    ).filter(
+        Tweet.id_users == user.id_users
+    )
+    if cursor:
+        # Undated tweets are stored as '-infinity', so they come after every
+        # dated one and a cursor among them compares against that
+        query = query.filter(
+            db.tuple_(Tweet.created_at, Tweet.id_tweets)
+            < db.tuple_(cursor_created_at or db.literal_column(UNDATED), cursor_id)
+        )
+    rows = query.order_by(
+        Tweet.created_at.desc(), Tweet.id_tweets.desc()
+    ).limit(per_page + 1).all()
+
+    # We fetched one extra row to know whether there is another page
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id_tweets)
+
+    tweets_by_id = get_tweets_by_id([row.id_tweets for row in rows])
+    tweets = [tweets_by_id[row.id_tweets] for row in rows if row.id_tweets in tweets_by_id]
+
+    return user, tweets, next_cursor
+
+
+@app.route("/users/<screen_name>/tweets")
+@read_only
+def user_tweets(screen_name):
+    # login check
+    username = request.cookies.get('username')
+    password = request.cookies.get('password')
+    good_credentials = check_credentials(username, password)
+
+    try:
+        user, tweets, next_cursor = user_tweet_page(screen_name, request.args.get('cursor'), 20)
+        # Rows in the shape tweet_card() renders, the same as on /tweets
+        tweets = load_tweet_rows(tweets)
+    except ValueError:
+        return redirect(f'/users/{screen_name}/tweets')
+    except Exception as e:
+        print(f"Error fetching tweets for {screen_name}: {e}")
+        return render_template('user_tweets.html',
+                               logged_in=good_credentials,
+                               user={'screen_name': screen_name, 'name': screen_name},
+                               tweets=[],
+                               next_cursor=None)
+
+    if not user:
+        return render_template('user_tweets.html',
+                               logged_in=good_credentials,
+                               user={'screen_name': screen_name, 'name': screen_name},
+                               tweets=[],
+                               next_cursor=None), 404
+
+    return render_template('user_tweets.html',
+                           logged_in=good_credentials,
+                           user=user,
+                           tweets=tweets,
+                           next_cursor=next_cursor)
+
+
+@app.route("/api/users/<screen_name>/tweets")
+@read_only
+def get_user_tweets(screen_name):
+    """Get a page of tweets for a specific user, newest first"""
+    try:
+        per_page = min(max(int(request.args.get('limit', 20)), 1), 200)
+        user, tweets, next_cursor = user_tweet_page(screen_name, request.args.get('cursor'), per_page)
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid parameter: {e}"
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    if not user:
+        return jsonify({
+            "status": "error",
+            "message": "User not found"
+        }), 404
+
+    return jsonify({
+        "status": "success",
+        "screen_name": user.screen_name,
+        "tweet_count": len(tweets),
+        "tweets": tweets,
+        "next_cursor": next_cursor
+    })
+
+
+THREAD_ROOT_SQL = text("""
+WITH RECURSIVE ancestors AS (
+    SELECT t.id_tweets, t.in_reply_to_status_id, t.quoted_status_id, 0 AS depth, ARRAY[t.id_tweets] AS path
+    FROM tweet_ids i
+    JOIN tweets t ON t.id_tweets = i.id_tweets AND t.created_at = i.created_at
+    WHERE i.id_tweets = :id_tweets
+    UNION ALL
+    SELECT p.id_tweets, p.in_reply_to_status_id, p.quoted_status_id, a.depth + 1, a.path || p.id_tweets
+    FROM ancestors a
+    JOIN tweet_ids i ON i.id_tweets = COALESCE(a.in_reply_to_status_id, a.quoted_status_id)
+    JOIN tweets p ON p.id_tweets = i.id_tweets AND p.created_at = i.created_at
+    WHERE a.depth < :max_depth
+      AND NOT p.id_tweets = ANY(a.path)
+)
+SELECT id_tweets FROM ancestors ORDER BY depth DESC LIMIT 1
+""")
+
+# Each level only follows the first :max_fanout replies/quotes of a tweet,
+# through the partial indexes on in_reply_to_status_id and quoted_status_id.
+# UNION ALL produces the rows a level at a time, parents before children,
+# so the bare LIMIT stops the recursion once :max_nodes rows are out;
+# sorting them first would build the whole tree up to :max_depth. A tweet
+# that replies to one thread tweet and quotes another comes out once per
+# parent; load_thread keeps the first.
+THREAD_DESCENDANTS_SQL = text("""
+WITH RECURSIVE thread AS (
+    SELECT id_tweets, NULL::BIGINT AS parent_id, NULL::TEXT AS relation,
+           0 AS depth, ARRAY[id_tweets] AS path
+    FROM tweet_ids
+    WHERE id_tweets = :root_id
+    UNION ALL
+    SELECT c.id_tweets, t.id_tweets, c.relation, t.depth + 1, t.path || c.id_tweets
+    FROM thread t
+    CROSS JOIN LATERAL (
+        SELECT r.id_tweets,
+               CASE WHEN r.in_reply_to_status_id = t.id_tweets THEN 'reply' ELSE 'quote' END AS relation
+        FROM tweets r
+        WHERE r.in_reply_to_status_id = t.id_tweets OR r.quoted_status_id = t.id_tweets
+        ORDER BY r.created_at
+        LIMIT :max_fanout
+    ) c
+    WHERE t.depth < :max_depth
+      AND NOT c.id_tweets = ANY(t.path)
+)
+SELECT id_tweets, parent_id, relation, depth
+FROM thread
+LIMIT :max_nodes
+""")
+
+
+def load_thread(tweet_id):
+    """
+    Reconstruct the conversation a tweet belongs to as a tree of replies and quotes.
+    Takes two recursive queries plus the fixed batch load of the tweets, and
+    stops at THREAD_MAX_DEPTH levels, THREAD_MAX_FANOUT children per tweet and
+    THREAD_MAX_NODES tweets overall. Returns None if the tweet doesn't exist.
+    """
+    cached = thread_cache.get(tweet_id)
+    if cached is not None:
+        return cached
+
+    max_depth = app.config['THREAD_MAX_DEPTH']
+    max_nodes = app.config['THREAD_MAX_NODES']
+
+    root_id = db.session.execute(THREAD_ROOT_SQL, {
+        'id_tweets': tweet_id,
+        'max_depth': max_depth
+    }).scalar()
+    if root_id is None:
+        return None
+
+    rows = db.session.execute(THREAD_DESCENDANTS_SQL, {
+        'root_id': root_id,
+        'max_depth': max_depth,
+        'max_fanout': app.config['THREAD_MAX_FANOUT'],
+        'max_nodes': max_nodes + 1
+    }).all()
+    truncated = len(rows) > max_nodes
+    rows = rows[:max_nodes]
+
+    tweets = get_tweets_by_id(list(dict.fromkeys(row.id_tweets for row in rows)))
+
+    # Rows come out parents first, so every parent is in nodes before its
+    # children. A tweet reached again through another parent, and so its
+    # replies again, is skipped.
+    nodes = {}
+    for row in rows:
+        if row.id_tweets not in tweets or row.id_tweets in nodes:
+            continue
+        node = dict(tweets[row.id_tweets], relation=row.relation, depth=row.depth, replies=[])
+        nodes[row.id_tweets] = node
+        if row.parent_id in nodes:
+            nodes[row.parent_id]['replies'].append(node)
+
+    thread = {
+        'root': nodes.get(root_id),
+        'focus_id': tweet_id,
+        'tweet_count': len(nodes),
+        'truncated': truncated
+    }
+    thread_cache.set(tweet_id, thread)
+    return thread
+
+
+@app.route("/tweets/<int:tweet_id>/thread")
+@read_only
+def tweet_thread(tweet_id):
+    # login check
+    username = request.cookies.get('username')
+    password = request.cookies.get('password')
+    good_credentials = check_credentials(username, password)
+
+    try:
+        thread = load_thread(tweet_id)
+    except Exception as e:
+        print(f"Error fetching thread: {e}")
+        thread = None
+
+    if not thread or not thread['root']:
+        return render_template('thread.html', logged_in=good_credentials, thread=None), 404
+
+    return render_template('thread.html', logged_in=good_credentials, thread=thread)
+
+
+@app.route("/api/tweets/<int:tweet_id>/thread")
+@read_only
+def get_tweet_thread(tweet_id):
+    """Get the reply and quote tree a tweet belongs to"""
+    try:
+        thread = load_thread(tweet_id)
+
+        if not thread or not thread['root']:
+            return jsonify({
+                "status": "error",
+                "message": "Tweet not found"
+            }), 404
+
+        return jsonify(dict(thread, status="success"))
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@app.route("/admin/profiles")
+@admin_required
+def list_profiles():
+    """Saved request profiles, newest first"""
+    return jsonify({
+        "status": "success",
+        "sample_rate": profiler.sample_rate,
+        "routes": sorted(profiler.routes),
+        "profiles": profiler.list()
+    })
+
+
+@app.route("/admin/profiles/<name>")
+@admin_required
+def get_profile(name):
+    """
+    Download a saved profile as a .prof file, or with ?format=text
+    get the slowest functions by cumulative time
+    """
+    path = profiler.path(name)
+    if path is None:
+        return jsonify({
+            "status": "error",
+            "message": f"No profile named {name}"
+        }), 404
+
+    if request.args.get('format') == 'text':
+        try:
+            report = profiler.report(name, sort=request.args.get('sort', 'cumulative'))
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid parameter: {e}"
+            }), 400
+        return Response(report, mimetype='text/plain')
+    return send_from_directory(profiler.directory, name, as_attachment=True)
+
+
+@app.route("/admin/server_profile")
+@admin_required
+def get_server_profile():
+    """Show the worker model, pool sizing and live connection usage"""
+    profile = server_profile(app.config)
+
+    try:
+        max_connections = int(db.session.execute(text("SHOW max_connections")).scalar())
+        open_connections = db.session.execute(text(
+            "SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()"
+        )).scalar()
+
+        return jsonify({
+            "status": "success",
+            "profile": profile,
+            "pool": db.engine.pool.status(),
+            "replicas": replica_router.status(),
+            "postgres": {
+                "max_connections": max_connections,
+                "open_connections": open_connections,
+                "within_budget": profile["total_connections"] <= max_connections - app.config['POSTGRES_RESERVED_CONNECTIONS']
+            }
+        })
+
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e),
+            "profile": profile
+        }), 500
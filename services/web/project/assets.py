@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+
+# Files that get a content hash in their name. Anything else under static/
+# is served under its own name.
+FINGERPRINTED = ('.css', '.js', '.svg')
+
+# site.3f2a9c1d0b7e.css -- already a fingerprinted copy
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^.]+$')
+
+# Where the image build writes the manifest. It sits next to static/ rather
+# than in it, so the static volume mounted over static/ in production can't
+# hide it or keep an old one.
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'asset_manifest.json')
+
+
+def fingerprint(path):
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+def build_assets(static_folder):
+    """
+    Copy every asset under `static_folder` to a name containing a hash of its
+    contents (css/site.css -> css/site.3f2a9c1d0b7e.css) and return a manifest
+    mapping the original relative path to the hashed one. Copies that already
+    exist are left alone. Runs when the image is built, never at startup.
+
+    A new version of a file gets a new name, which is what lets nginx send
+    the hashed names with a one-year immutable Cache-Control.
+    """
+    manifest = {}
+    for directory, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            if not filename.endswith(FINGERPRINTED) or HASHED_NAME.search(filename):
+                continue
+            source = os.path.join(directory, filename)
+            target = fingerprint(source)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+            manifest[os.path.relpath(source, static_folder)] = os.path.relpath(target, static_folder)
+    return manifest
+
+
+def write_manifest(manifest, path=MANIFEST_PATH):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    The manifest written at build time, or an empty one where assets were
+    never built (the dev server), so asset_url falls back to plain names
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url_builder(manifest, static_url_path='/static'):
+    """
+    Build the asset_url() template global, which turns a path under static/
+    into the URL of its fingerprinted copy. Paths that aren't in the manifest
+    are returned unhashed.
+    """
+    def asset_url(path):
+        return f"{static_url_path}/{manifest.get(path, path)}"
+
+    return asset_url
+
+
+if __name__ == "__main__":
+    # Run at image build time: python project/assets.py project/static
+    manifest = build_assets(sys.argv[1])
+    write_manifest(manifest)
+    for source, target in sorted(manifest.items()):
+        print(f"{source} -> {target}")
@@ -0,0 +1,595 @@
+"""
+Async serving mode for the read-only routes.
+
+This is an ASGI app that serves `/`, `/tweets`, `/all_messages`, `/search`
+and the read-only `/api/*` endpoints on top of asyncpg and SQLAlchemy's
+asyncio extension, so one worker can have hundreds of queries in flight
+instead of one. It reuses the models, SQL and templates of the Flask app in
+project/__init__.py; nginx sends these routes here and everything else
+(logins, posting, exports) to the Flask app.
+
+Run it with
+
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:5001 project.async_app:app
+"""
+
+import hmac
+import os
+import time
+from functools import wraps
+from contextlib import asynccontextmanager
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.middleware import Middleware
+from starlette.routing import Match, Route
+from starlette.templating import Jinja2Templates
+
+from project import (
+    app as flask_app, User, Tweet, TweetTagTotal,
+    CHECK_CREDENTIALS_SQL, MESSAGES_COUNT_SQL, TWEETS_COUNT_SQL,
+    SEARCH_COUNT_SQL, SEARCH_SQL, TWEETS_BY_ID_SQL, TWEET_RELATION_STATEMENTS,
+    prepared_statements, message_tsquery_lookup, format_tweet_row, attach_tweet_relations,
+    tweet_cache, message_timeline_cache,
+    page_cache, fragment_cache, autocomplete_cache, tsquery_cache, asset_manifest
+)
+from project.replicas import ReplicaRouter, REPLICA_LAG_SQL, is_sticky
+from project.page_cache import cached_page_key, page_entry, page_headers, cache_control, tweet_card_renderer
+from project.assets import asset_url_builder
+from project import metrics
+from project import autocomplete as suggest
+from project import tweet_search
+from project import search_query
+from project import read_model
+from project import search_page
+from project import timelines
+from project import tweet_batch
+
+config = flask_app.config
+
+# page_cache, message_timeline_cache and the other caches imported above are
+# this process's own instances. Writes go through the Flask app, which only
+# evicts its copies, so entries here live out their TTL: a new message shows
+# up on the pages served here at most PAGE_CACHE_TTL (TIMELINE_CACHE_TTL for
+# /api/messages) seconds later, for everyone but its writer.
+
+engine = create_async_engine(config['ASYNC_DATABASE_URL'], **config['ASYNC_ENGINE_OPTIONS'])
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# Every route here is read-only, so all of them may use a replica
+replica_options = dict(config['ASYNC_ENGINE_OPTIONS'])
+replica_options['connect_args'] = dict(replica_options.get('connect_args', {}), timeout=2)
+replica_engines = {
+    f"replica_{i}": create_async_engine(url, **replica_options)
+    for i, url in enumerate(config['ASYNC_REPLICA_URLS'])
+}
+replica_router = ReplicaRouter(
+    replica_engines,
+    max_lag=config['REPLICA_MAX_LAG'],
+    check_interval=config['REPLICA_LAG_CHECK_INTERVAL']
+)
+
+templates = Jinja2Templates(directory=os.path.join(flask_app.root_path, flask_app.template_folder))
+templates.env.globals['tweet_card'] = tweet_card_renderer(templates.env, fragment_cache)
+templates.env.globals['asset_url'] = asset_url_builder(asset_manifest, flask_app.static_url_path)
+
+
+async def read_session(request):
+    """Open a session on a replica that is caught up enough, or on the primary"""
+    if not replica_engines or is_sticky(request.cookies, 'primary_until'):
+        return Session()
+
+    for key in replica_router.stale_keys():
+        try:
+            async with replica_engines[key].connect() as connection:
+                lag = float((await connection.execute(REPLICA_LAG_SQL)).scalar())
+        except Exception as e:
+            print(f"Error checking replica {key}: {e}")
+            lag = None
+        replica_router.record_lag(key, lag)
+
+    key = replica_router.choose()
+    return Session(bind=replica_engines[key]) if key else Session()
+
+
+def render(request, template_name, status_code=200, **context):
+    return templates.TemplateResponse(request, template_name, context, status_code=status_code)
+
+
+def cached_page(view):
+    """
+    Same policy as project.cached_page, except that pages cached here are
+    only dropped by PAGE_CACHE_TTL, never on write (see the note on the
+    caches above).
+    """
+    @wraps(view)
+    async def wrapper(request):
+        key = cached_page_key(request.method, request.url.path, request.url.query, request.cookies)
+        if key is None:
+            return await view(request)
+
+        cached = page_cache.get(key)
+
+        if cached is None:
+            response = await view(request)
+            if response.status_code != 200:
+                return response
+            cached = page_entry(response.body)
+            page_cache.set(key, cached)
+
+        body, etag = cached
+        headers = page_headers(etag, request.cookies, config['PAGE_CACHE_TTL'])
+        if request.headers.get('if-none-match') == headers['ETag']:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type='text/html', headers=headers)
+    return wrapper
+
+
+async def check_credentials(session, username, password):
+    """Async version of project.check_credentials"""
+    if not username or not password:
+        return False
+
+    try:
+        account = (await session.execute(
+            CHECK_CREDENTIALS_SQL, {'username': username, 'password': password}
+        )).first()
+        return account is not None
+    except Exception as e:
+        print(f"Error checking credentials: {e}")
+        return False
+
+
+async def logged_in(session, request):
+    return await check_credentials(
+        session, request.cookies.get('username'), request.cookies.get('password')
+    )
+
+
+async def load_tweets_by_id(session, tweet_ids):
+    """Async version of project.load_tweets_by_id, using the same queries"""
+    if not tweet_ids:
+        return {}
+
+    result = await session.execute(TWEETS_BY_ID_SQL, {'ids': list(tweet_ids)})
+    tweets = {row.id_tweets: format_tweet_row(row) for row in result}
+    if not tweets:
+        return tweets
+
+    params = {'ids': list(tweets)}
+    relations = [
+        (await session.execute(prepared_statements.statements[name].plain_sql, params)).all()
+        for name in TWEET_RELATION_STATEMENTS
+    ]
+    return attach_tweet_relations(tweets, *relations)
+
+
+async def get_tweets_by_id(session, tweet_ids):
+    """Async version of project.get_tweets_by_id, sharing its cache"""
+    tweets = tweet_cache.get_many(tweet_ids)
+    missing = [tweet_id for tweet_id in tweet_ids if tweet_id not in tweets]
+    if missing:
+        loaded = await load_tweets_by_id(session, missing)
+        tweet_cache.set_many(loaded)
+        tweets.update(loaded)
+    return tweets
+
+
+async def load_message_page(session, user_id, limit, offset):
+    """Async version of project.load_message_page"""
+    rows = await session.execute(read_model.MESSAGES_PAGE_SQL, {'limit': limit, 'offset': offset})
+    return read_model.message_rows(rows, user_id)
+
+
+async def load_tweet_page(session, limit, offset):
+    """Async version of project.load_tweet_page"""
+    rows = (await session.execute(read_model.TWEETS_PAGE_SQL, {'limit': limit, 'offset': offset})).all()
+    related = await get_tweets_by_id(session, [row.id_tweets for row in rows])
+    return read_model.tweet_rows(rows, related)
+
+
+@cached_page
+async def root(request):
+    user_id = request.cookies.get('id_users')
+
+    async with await read_session(request) as session:
+        good_credentials = await logged_in(session, request)
+
+        try:
+            messages = await load_message_page(session, user_id, 20, 0)
+        except Exception as e:
+            print(f"Error fetching messages: {e}")
+            messages = []
+
+    return render(request, 'root.html', logged_in=good_credentials, messages=messages)
+
+
+@cached_page
+async def all_messages(request):
+    user_id = request.cookies.get('id_users')
+    page = int(request.query_params.get('page', 1))
+    per_page = 50
+
+    async with await read_session(request) as session:
+        good_credentials = await logged_in(session, request)
+
+        try:
+            total_count = (await session.execute(MESSAGES_COUNT_SQL)).scalar()
+            messages = await load_message_page(session, user_id, per_page, (page - 1) * per_page)
+
+            total_pages, has_prev, has_next = read_model.pagination(page, per_page, total_count)
+
+        except Exception as e:
+            print(f"Error fetching messages: {e}")
+            messages = []
+            total_pages = 1
+            has_prev = False
+            has_next = False
+
+    return render(request, 'all_messages.html',
+                  logged_in=good_credentials,
+                  messages=messages,
+                  page=page,
+                  total_pages=total_pages,
+                  has_prev=has_prev,
+                  has_next=has_next)
+
+
+@cached_page
+async def tweets(request):
+    page = int(request.query_params.get('page', 1))
+    per_page = 20
+
+    async with await read_session(request) as session:
+        good_credentials = await logged_in(session, request)
+
+        try:
+            total_count = (await session.execute(TWEETS_COUNT_SQL)).scalar()
+
+            tweets = await load_tweet_page(session, per_page, (page - 1) * per_page)
+
+            total_pages, has_prev, has_next = read_model.pagination(page, per_page, total_count)
+
+        except Exception as e:
+            print(f"Error fetching tweets: {e}")
+            tweets = []
+            total_pages = 1
+            has_prev = False
+            has_next = False
+            total_count = 0
+
+    return render(request, 'tweets.html',
+                  logged_in=good_credentials,
+                  tweets=tweets,
+                  page=page,
+                  total_pages=total_pages,
+                  total_count=total_count,
+                  has_prev=has_prev,
+                  has_next=has_next)
+
+
+async def parsed_tsquery(session, lookup):
+    """Async version of project.parsed_tsquery"""
+    statement, params, key = lookup
+    tsquery = tsquery_cache.get(key)
+    if tsquery is None:
+        tsquery = (await session.execute(statement, params)).scalar() or ''
+        tsquery_cache.set(key, tsquery)
+    return tsquery
+
+
+async def search_messages(session, parsed, limit, offset):
+    """Async version of project.search_messages"""
+    tsquery = await parsed_tsquery(session, message_tsquery_lookup(parsed))
+    if not tsquery:
+        return 0, []
+    total = (await session.execute(SEARCH_COUNT_SQL, {'tsquery': tsquery})).scalar() or 0
+    rows = (await session.execute(SEARCH_SQL, {'tsquery': tsquery, 'limit': limit, 'offset': offset})).all()
+    return total, rows
+
+
+async def search_tweets(session, parsed, filters, order, limit, offset):
+    """Async version of project.search_tweets"""
+    tsquery = await parsed_tsquery(session, tweet_search.search_tsquery_lookup(parsed, filters))
+    if not tsquery:
+        return 0, []
+    count_sql, page_sql = tweet_search.search_sql(tuple(sorted(filters)), order)
+    params = dict(filters, tsquery=tsquery)
+    total = (await session.execute(count_sql, params)).scalar() or 0
+    rows = (await session.execute(page_sql, dict(params, limit=limit, offset=offset))).all()
+    return total, rows
+
+
+async def search(request):
+    user_id = request.cookies.get('id_users')
+    if request.method == 'POST':
+        form = await request.form()
+        query_text = form.get('query', '')
+        values = dict(request.query_params, **form)
+    else:
+        query_text = request.query_params.get('query', '')
+        values = request.query_params
+    search = search_page.parse_search(query_text, values, request.query_params)
+    results = []
+    total_results = 0
+    query_time_ms = None
+
+    async with await read_session(request) as session:
+        good_credentials = await logged_in(session, request)
+
+        if query_text:
+            try:
+                start_time = time.time()
+                offset = search_page.search_offset(search)
+
+                # None when the query has no words to search for
+                parsed = search_query.parse(query_text)
+
+                if parsed and search.mode == 'tweets':
+                    total_results, rows = await search_tweets(
+                        session, parsed, search.filters, search.order, search_page.PER_PAGE, offset
+                    )
+                    results = search_page.tweet_results(rows, query_text)
+                elif parsed:
+                    total_results, rows = await search_messages(session, parsed, search_page.PER_PAGE, offset)
+                    results = search_page.message_results(rows, query_text, user_id)
+
+                query_time_ms = int((time.time() - start_time) * 1000)
+
+            except Exception as e:
+                return render(request, 'search.html', logged_in=good_credentials,
+                              **search_page.error_context(search, e))
+
+    return render(request, 'search.html', logged_in=good_credentials,
+                  **search_page.page_context(search, results, total_results, query_time_ms))
+
+
+async def api_test(request):
+    """Simple test endpoint to verify database connection"""
+    try:
+        async with await read_session(request) as session:
+            user_count = (await session.execute(select(func.count()).select_from(User))).scalar()
+            tweet_count = (await session.execute(select(func.count()).select_from(Tweet))).scalar()
+            sample_user = (await session.execute(select(User).limit(1))).scalar()
+            sample_tweet = (await session.execute(select(Tweet).limit(1))).scalar()
+
+        user_data = None
+        if sample_user:
+            user_data = {
+                "id": sample_user.id_users,
+                "name": sample_user.name,
+                "screen_name": sample_user.screen_name,
+                "tweets_count": sample_user.statuses_count
+            }
+
+        tweet_data = None
+        if sample_tweet:
+            tweet_data = {
+                "id": sample_tweet.id_tweets,
+                "text": sample_tweet.text,
+                "created_at": sample_tweet.created_at.isoformat() if sample_tweet.created_at else None
+            }
+
+        return JSONResponse({
+            "status": "success",
+            "database_info": {
+                "user_count": user_count,
+                "tweet_count": tweet_count
+            },
+            "sample_user": user_data,
+            "sample_tweet": tweet_data
+        })
+
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+async def api_data(request):
+    """Simple endpoint to retrieve sample data from the database tables"""
+    try:
+        async with await read_session(request) as session:
+            tweet_ids = (await session.execute(
+                select(Tweet.id_tweets).order_by(Tweet.created_at.desc()).limit(10)
+            )).scalars().all()
+            tweets = await get_tweets_by_id(session, tweet_ids)
+
+            top_tags = (await session.execute(
+                select(TweetTagTotal.tag, TweetTagTotal.total).order_by(TweetTagTotal.total.desc()).limit(5)
+            )).all()
+
+        result = []
+        for tweet_id in tweet_ids:
+            tweet = tweets[tweet_id]
+            result.append({
+                "id": tweet["id"],
+                "text": tweet["text"],
+                "created_at": tweet["created_at"],
+                "retweet_count": tweet["retweet_count"],
+                "favorite_count": tweet["favorite_count"],
+                "user": tweet["user"],
+                "tags": tweet["tags"],
+                "mentions": tweet["mentions"],
+                "media": tweet["media"]
+            })
+
+        return JSONResponse({
+            "status": "success",
+            "tweets": result,
+            "top_tags": [{"tag": row.tag, "count": row.total} for row in top_tags]
+        })
+
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+async def api_messages(request):
+    """Async version of project.get_messages, sharing its page cache"""
+    username = request.path_params['username']
+
+    try:
+        query = timelines.message_timeline_query(username, request.query_params)
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": f"Invalid parameter: {e}"}, status_code=400)
+
+    cached = message_timeline_cache.get(query.cache_key)
+
+    if cached is None:
+        try:
+            async with await read_session(request) as session:
+                id_users = (await session.execute(timelines.ACCOUNT_ID_SQL, {'username': username})).scalar()
+
+                if id_users is None:
+                    return JSONResponse({"status": "error", "message": "Account not found"}, status_code=404)
+
+                rows = (await session.execute(query.statement, dict(query.params, id_users=id_users))).all()
+
+            cached = timelines.message_timeline_page(username, rows, query.per_page)
+            message_timeline_cache.set(query.cache_key, cached)
+
+        except Exception as e:
+            return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+    etag, last_modified, payload = cached
+    headers = {'ETag': f'"{etag}"'}
+    if last_modified:
+        headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+
+async def api_tweets_batch(request):
+    """Async version of project.get_tweets_batch"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+
+    try:
+        tweet_ids = tweet_batch.parse_batch(payload, config['TWEET_BATCH_MAX_IDS'])
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+
+    try:
+        async with await read_session(request) as session:
+            tweets = await get_tweets_by_id(session, tweet_ids)
+
+        return JSONResponse(tweet_batch.batch_result(tweet_ids, tweets))
+
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+async def autocomplete_suggestions(session, kind, prefix):
+    """Async version of project.autocomplete_suggestions, sharing its cache"""
+    cached = autocomplete_cache.get((kind, prefix))
+    if cached is not None:
+        return cached
+
+    limit = config['AUTOCOMPLETE_MAX_LIMIT']
+    prefix_sql, fuzzy_sql, params, format_row, key = suggest.suggestion_queries(kind, prefix, limit)
+    found = [format_row(row) for row in await session.execute(prefix_sql, params)]
+    if suggest.wants_fuzzy(prefix, found, limit):
+        extra = [format_row(row) for row in await session.execute(fuzzy_sql, params)]
+        suggest.merge(found, extra, key, limit)
+
+    autocomplete_cache.set((kind, prefix), found)
+    return found
+
+
+async def api_autocomplete(request):
+    """Async version of project.get_autocomplete"""
+    try:
+        prefix, kind, limit = suggest.parse_request(request.query_params, config['AUTOCOMPLETE_MAX_LIMIT'])
+    except ValueError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+
+    try:
+        payload = {"status": "success", "query": prefix}
+        async with await read_session(request) as session:
+            for name in suggest.requested_kinds(kind):
+                payload[name] = (await autocomplete_suggestions(session, name, prefix))[:limit] if prefix else []
+
+        return JSONResponse(payload, headers={
+            'Cache-Control': cache_control(True, config['AUTOCOMPLETE_CACHE_TTL'])
+        })
+
+    except Exception as e:
+        print(f"Autocomplete error: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+def is_admin(request):
+    """Async version of project.is_admin"""
+    token = config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+
+async def prometheus_metrics(request):
+    if not is_admin(request):
+        return JSONResponse({"status": "error", "message": "Admin token required"}, status_code=403)
+    body, content_type = metrics.render_metrics()
+    return Response(body, headers={'Content-Type': content_type})
+
+
+class RequestMetricsMiddleware:
+    """Feeds project.metrics with the latency and SQL totals of every request"""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def route_path(self, scope):
+        for route in self.routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        token = metrics.begin_request(self.route_path(scope))
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.end_request(token, scope['method'], status[0])
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+    for replica_engine in replica_engines.values():
+        await replica_engine.dispose()
+
+
+routes = [
+    Route("/", root),
+    Route("/all_messages", all_messages),
+    Route("/tweets", tweets),
+    Route("/search", search, methods=['GET', 'POST']),
+    Route("/api/test", api_test),
+    Route("/api/data", api_data),
+    Route("/api/messages/{username}", api_messages),
+    Route("/api/tweets/batch", api_tweets_batch, methods=['POST']),
+    Route("/api/autocomplete", api_autocomplete),
+    Route("/metrics", prometheus_metrics),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(RequestMetricsMiddleware, routes=routes)],
+    lifespan=lifespan
+)
@@ -0,0 +1,167 @@
+import re
+
+from sqlalchemy import text
+
+# Longest prefix looked up; anything after is ignored
+MAX_PREFIX_LENGTH = 50
+
+# Trigrams need at least three characters to say anything useful, so
+# shorter prefixes only get the index-ordered prefix matches
+MIN_FUZZY_LENGTH = 3
+
+KINDS = ('users', 'tags')
+
+# Prefix matches walk idx_users_screen_name_prefix in order and stop after
+# :limit rows, so they cost the same for "a" as for "alexander". Comparing
+# under the C collation is what lets LIKE 'abc%' use a plain btree.
+USER_PREFIX_SQL = text("""
+SELECT id_users, screen_name, name
+FROM users
+WHERE lower(screen_name) COLLATE "C" LIKE :pattern
+ORDER BY lower(screen_name) COLLATE "C"
+LIMIT :limit
+""")
+
+# Fills up with screen names and display names that contain a word starting
+# like the prefix, found through the pg_trgm GIN indexes
+USER_FUZZY_SQL = text("""
+SELECT id_users, screen_name, name,
+       GREATEST(word_similarity(:prefix, lower(screen_name)), word_similarity(:prefix, lower(name))) AS score
+FROM users
+WHERE :prefix <% lower(screen_name) OR :prefix <% lower(name)
+ORDER BY score DESC, lower(screen_name)
+LIMIT :limit
+""")
+
+# Prefixes up to this many characters after the # or $ match so many tags
+# that ranking them on the fly reads most of the tags table. Their top
+# TOP_TAGS_PER_PREFIX tags are precomputed in the tweet_tags_prefix_top view
+# (see schema.sql), which covers prefixes of up to three characters.
+TOP_TAG_PREFIX_LENGTH = 2
+TOP_TAGS_PER_PREFIX = 20
+
+# Short prefixes: at most 2 * TOP_TAGS_PER_PREFIX rows, read in order from
+# idx_tweet_tags_prefix_top_prefix
+TAG_TOP_SQL = text("""
+SELECT tag, total
+FROM tweet_tags_prefix_top
+WHERE prefix IN (:hashtag_prefix, :cashtag_prefix)
+ORDER BY total DESC, tag
+LIMIT :limit
+""")
+
+# Tags start with # or $; without one the prefix matches both kinds. Ranked
+# by how often each tag is used, from the tweet_tags_total view. Longer
+# prefixes match few enough tags to rank all of them.
+TAG_PREFIX_SQL = text("""
+SELECT g.tag, COALESCE(t.total, 0) AS total
+FROM tags g
+LEFT JOIN tweet_tags_total t ON t.tag = g.tag
+WHERE lower(g.tag) COLLATE "C" LIKE :hashtag_pattern
+   OR lower(g.tag) COLLATE "C" LIKE :cashtag_pattern
+ORDER BY total DESC, g.tag
+LIMIT :limit
+""")
+
+TAG_FUZZY_SQL = text("""
+SELECT g.tag, COALESCE(t.total, 0) AS total
+FROM tags g
+LEFT JOIN tweet_tags_total t ON t.tag = g.tag
+WHERE :prefix <% lower(g.tag)
+ORDER BY word_similarity(:prefix, lower(g.tag)) DESC, total DESC
+LIMIT :limit
+""")
+
+
+def parse_request(args, max_limit):
+    """
+    (prefix, kind, limit) from the args `q`, `type` and `limit` of an
+    autocomplete request. Raises ValueError with the message for the 400
+    response.
+    """
+    prefix = normalize_prefix(args.get('q', ''))
+    kind = args.get('type', 'all')
+
+    if kind not in KINDS + ('all',):
+        raise ValueError(f"type must be one of {', '.join(KINDS)} or all")
+
+    try:
+        limit = min(max(int(args.get('limit', max_limit)), 1), max_limit)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    return prefix, kind, limit
+
+
+def requested_kinds(kind):
+    """The KINDS a request for `kind` (one of them, or all) returns"""
+    return [name for name in KINDS if kind in (name, 'all')]
+
+
+def normalize_prefix(prefix):
+    """Lowercase, trim and collapse whitespace, so equivalent input shares a cache entry"""
+    return ' '.join(prefix.lower().split())[:MAX_PREFIX_LENGTH]
+
+
+def escape_like(value):
+    return re.sub(r'([\\%_])', r'\\\1', value)
+
+
+def user_params(prefix, limit):
+    return {'pattern': escape_like(prefix) + '%', 'prefix': prefix, 'limit': limit}
+
+
+def tag_params(prefix, limit):
+    word = prefix.lstrip('#$')
+    if prefix.startswith(('#', '$')):
+        prefixes = [prefix] * 2
+    else:
+        prefixes = ['#' + word, '$' + word]
+    return {
+        'hashtag_prefix': prefixes[0],
+        'cashtag_prefix': prefixes[1],
+        'hashtag_pattern': escape_like(prefixes[0]) + '%',
+        'cashtag_pattern': escape_like(prefixes[1]) + '%',
+        'prefix': word,
+        'limit': limit,
+    }
+
+
+def tag_prefix_sql(prefix):
+    """The statement that finds the tags starting with `prefix`, by its length"""
+    word = prefix[1:] if prefix.startswith(('#', '$')) else prefix
+    return TAG_TOP_SQL if len(word) <= TOP_TAG_PREFIX_LENGTH else TAG_PREFIX_SQL
+
+
+def suggestion_queries(kind, prefix, limit):
+    """
+    How to find `kind` suggestions for `prefix`: (prefix statement, fuzzy
+    statement, params for both, row formatter, key that identifies a
+    suggestion). The fuzzy statement only runs if wants_fuzzy says so.
+    """
+    if kind == 'users':
+        return USER_PREFIX_SQL, USER_FUZZY_SQL, user_params(prefix, limit), format_user, 'id'
+    return tag_prefix_sql(prefix), TAG_FUZZY_SQL, tag_params(prefix, limit), format_tag, 'tag'
+
+
+def wants_fuzzy(prefix, found, limit):
+    return len(found) < limit and len(prefix.lstrip('#$')) >= MIN_FUZZY_LENGTH
+
+
+def format_user(row):
+    return {"id": row.id_users, "screen_name": row.screen_name, "name": row.name}
+
+
+def format_tag(row):
+    return {"tag": row.tag, "count": row.total}
+
+
+def merge(found, extra, key, limit):
+    """Append the `extra` suggestions that aren't in `found` yet, up to `limit` in all"""
+    seen = {item[key] for item in found}
+    for item in extra:
+        if len(found) >= limit:
+            break
+        if item[key] not in seen:
+            seen.add(item[key])
+            found.append(item)
+    return found
@@ -0,0 +1,282 @@
+import json
+import time
+
+from sqlalchemy import text
+
+from project.partitions import is_partitioned, list_partitions
+
+# A media URL's prefix is its scheme, host and first path segment, e.g.
+# https://pbs.twimg.com/media/. URLs that don't match get the empty prefix.
+MEDIA_URL_PREFIX_PATTERN = '^https?://[^/]+/[^/]+/'
+
+# Tables whose size and scan speed are reported before and after compacting
+COMPACTED_TABLES = ['tweets', 'tweet_media', 'tweet_tags']
+
+# A table still needs compacting while it has this text column
+WIDE_COLUMNS = {
+    'tweets': 'source',
+    'tweet_media': 'url',
+    'tweet_tags': 'tag',
+}
+
+LOOKUP_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS tweet_sources (
+        id_source INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        source TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS langs (
+        id_lang SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        lang TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS media_url_prefixes (
+        id_prefix INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        prefix TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tags (
+        id_tag INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        tag TEXT NOT NULL UNIQUE
+    )
+    """,
+]
+
+# Only values a lookup table doesn't have yet are inserted; ON CONFLICT on
+# its own would still use up an id from the sequence for every duplicate,
+# and langs only has a SMALLINT's worth
+FILL_LOOKUPS_SQL = {
+    'tweets': [
+        """
+        INSERT INTO tweet_sources (source)
+        SELECT DISTINCT t.source FROM tweets t
+        WHERE t.source IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM tweet_sources s WHERE s.source = t.source)
+        """,
+        """
+        INSERT INTO langs (lang)
+        SELECT DISTINCT t.lang FROM tweets t
+        WHERE t.lang IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM langs l WHERE l.lang = t.lang)
+        """,
+    ],
+    'tweet_media': [
+        """
+        INSERT INTO media_url_prefixes (prefix)
+        SELECT DISTINCT COALESCE(substring(m.url FROM :pattern), '') AS prefix FROM tweet_media m
+        WHERE NOT EXISTS (
+            SELECT 1 FROM media_url_prefixes p WHERE p.prefix = COALESCE(substring(m.url FROM :pattern), '')
+        )
+        """,
+    ],
+    'tweet_tags': [
+        """
+        INSERT INTO tags (tag)
+        SELECT DISTINCT tt.tag FROM tweet_tags tt
+        WHERE NOT EXISTS (SELECT 1 FROM tags g WHERE g.tag = tt.tag)
+        """,
+    ],
+}
+
+# The materialized views over tweet_tags, as in schema.sql. They group by
+# the integer id_tag and only look up the text of the groups they return.
+TAG_VIEWS_SQL = {
+    'tweet_tags_total': """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_total AS (
+            SELECT
+                row_number() over (order by t.total desc) AS row,
+                g.tag,
+                t.total
+            FROM (
+                SELECT id_tag, count(*) AS total
+                FROM tweet_tags
+                GROUP BY id_tag
+            ) t
+            JOIN tags g ON g.id_tag = t.id_tag
+            ORDER BY t.total DESC
+        )
+    """,
+    'tweet_tags_cooccurrence': """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_cooccurrence AS (
+            SELECT
+                g1.tag AS tag1,
+                g2.tag AS tag2,
+                c.total
+            FROM (
+                SELECT t1.id_tag AS id_tag1, t2.id_tag AS id_tag2, count(*) AS total
+                FROM tweet_tags t1
+                INNER JOIN tweet_tags t2 ON t1.id_tweets = t2.id_tweets
+                GROUP BY t1.id_tag, t2.id_tag
+            ) c
+            JOIN tags g1 ON g1.id_tag = c.id_tag1
+            JOIN tags g2 ON g2.id_tag = c.id_tag2
+            ORDER BY c.total DESC
+        )
+    """,
+    'tweet_tags_prefix_top': """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS tweet_tags_prefix_top AS (
+            SELECT prefix, tag, total
+            FROM (
+                SELECT
+                    left(lower(g.tag), n) AS prefix,
+                    g.tag,
+                    t.total,
+                    row_number() over (partition by left(lower(g.tag), n) order by t.total desc, g.tag) AS rank
+                FROM (
+                    SELECT id_tag, count(*) AS total
+                    FROM tweet_tags
+                    GROUP BY id_tag
+                ) t
+                JOIN tags g ON g.id_tag = t.id_tag
+                CROSS JOIN LATERAL generate_series(1, least(length(g.tag), 3)) AS n
+            ) ranked
+            WHERE rank <= 20
+        )
+    """,
+}
+
+
+def has_column(connection, table, column):
+    return connection.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table AND column_name = :column
+    """), {'table': table, 'column': column}).scalar() is not None
+
+
+def pending_tables(connection):
+    """The tables in COMPACTED_TABLES that still have their wide text column"""
+    return [table for table in COMPACTED_TABLES if has_column(connection, table, WIDE_COLUMNS[table])]
+
+
+def add_compact_columns(connection):
+    """Create the lookup tables and the id columns next to the text ones they replace"""
+    for sql in LOOKUP_TABLES_SQL:
+        connection.execute(text(sql))
+    connection.execute(text("""
+        ALTER TABLE tweets
+            ADD COLUMN IF NOT EXISTS id_source INTEGER REFERENCES tweet_sources(id_source),
+            ADD COLUMN IF NOT EXISTS id_lang SMALLINT REFERENCES langs(id_lang)
+    """))
+    connection.execute(text("""
+        ALTER TABLE tweet_media
+            ADD COLUMN IF NOT EXISTS id_prefix INTEGER REFERENCES media_url_prefixes(id_prefix),
+            ADD COLUMN IF NOT EXISTS url_key TEXT
+    """))
+    connection.execute(text("""
+        ALTER TABLE tweet_tags
+            ADD COLUMN IF NOT EXISTS id_tag INTEGER REFERENCES tags(id_tag)
+    """))
+
+
+def fill_lookups(connection, tables):
+    for table in tables:
+        for sql in FILL_LOOKUPS_SQL[table]:
+            connection.execute(text(sql), {'pattern': MEDIA_URL_PREFIX_PATTERN})
+
+
+def tweet_relations(connection):
+    """The tables holding tweet rows: each partition, or tweets itself"""
+    return list_partitions(connection, 'tweets') if is_partitioned(connection, 'tweets') else ['tweets']
+
+
+def backfill_tweets(connection, relation):
+    """
+    Set id_source and id_lang on the rows of one tweets partition. Rows that
+    already have them are skipped, so an interrupted run can pick up where
+    it stopped. Returns the number of rows updated.
+    """
+    return connection.execute(text(f"""
+        UPDATE {relation} t
+        SET id_source = (SELECT s.id_source FROM tweet_sources s WHERE s.source = t.source),
+            id_lang = (SELECT l.id_lang FROM langs l WHERE l.lang = t.lang)
+        WHERE (t.source IS NOT NULL AND t.id_source IS NULL)
+           OR (t.lang IS NOT NULL AND t.id_lang IS NULL)
+    """)).rowcount
+
+
+def backfill_media(connection):
+    return connection.execute(text("""
+        UPDATE tweet_media m
+        SET id_prefix = p.id_prefix,
+            url_key = substr(m.url, length(p.prefix) + 1)
+        FROM media_url_prefixes p
+        WHERE p.prefix = COALESCE(substring(m.url FROM :pattern), '')
+          AND m.id_prefix IS NULL
+    """), {'pattern': MEDIA_URL_PREFIX_PATTERN}).rowcount
+
+
+def backfill_tags(connection):
+    return connection.execute(text("""
+        UPDATE tweet_tags tt
+        SET id_tag = g.id_tag
+        FROM tags g
+        WHERE g.tag = tt.tag
+          AND tt.id_tag IS NULL
+    """)).rowcount
+
+
+def drop_wide_columns(connection, tables):
+    """
+    Drop the text columns the ids replace. Postgres only marks a dropped
+    column as gone; the bytes stay in every row until the table is
+    rewritten, which is what the VACUUM FULL afterwards is for.
+
+    The materialized views over tweet_tags read its tag column, so they are
+    dropped with it and built again from TAG_VIEWS_SQL.
+    """
+    if 'tweets' in tables:
+        connection.execute(text("ALTER TABLE tweets DROP COLUMN IF EXISTS source, DROP COLUMN IF EXISTS lang"))
+    if 'tweet_media' in tables:
+        connection.execute(text("ALTER TABLE tweet_media DROP CONSTRAINT IF EXISTS tweet_media_pkey"))
+        connection.execute(text("ALTER TABLE tweet_media DROP COLUMN url"))
+        connection.execute(text("ALTER TABLE tweet_media ADD PRIMARY KEY (id_tweets, id_prefix, url_key)"))
+    if 'tweet_tags' in tables:
+        for view in TAG_VIEWS_SQL:
+            connection.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {view}"))
+        connection.execute(text("ALTER TABLE tweet_tags DROP CONSTRAINT IF EXISTS tweet_tags_pkey"))
+        connection.execute(text("ALTER TABLE tweet_tags DROP COLUMN tag"))
+        connection.execute(text("ALTER TABLE tweet_tags ADD PRIMARY KEY (id_tweets, id_tag)"))
+        for sql in TAG_VIEWS_SQL.values():
+            connection.execute(text(sql))
+
+
+def measure(connection, table):
+    """
+    Size of `table` summed over its partitions, and the time and shared
+    buffers a full sequential scan of it takes. Index scans are turned off
+    for the scan, so call this inside a transaction.
+    """
+    sizes = connection.execute(text("""
+        SELECT COALESCE(SUM(pg_table_size(relid)), 0) AS heap,
+               COALESCE(SUM(pg_indexes_size(relid)), 0) AS indexes
+        FROM pg_partition_tree(CAST(:table AS regclass))
+    """), {'table': table}).first()
+
+    for setting in ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan'):
+        connection.execute(text(f"SET LOCAL {setting} = off"))
+    result = connection.execute(text(
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT * FROM {table}"
+    )).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+
+    return {
+        'heap': sizes.heap,
+        'indexes': sizes.indexes,
+        'scan_ms': plan['Execution Time'],
+        'buffers': plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0),
+    }
+
+
+def time_view_refresh(connection, view):
+    """Milliseconds to rebuild one of the tag materialized views"""
+    start_time = time.perf_counter()
+    connection.execute(text(f"REFRESH MATERIALIZED VIEW {view}"))
+    return (time.perf_counter() - start_time) * 1000
+
+
+def format_change(before, after):
+    return f"{(after - before) / before * 100:+.0f}%" if before else "n/a"
@@ -1,4 +1,7 @@
 import os
+import uuid
+import importlib.util
+from sqlalchemy.pool import NullPool
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -8,6 +11,211 @@ class Config:
     DEBUG = os.environ.get("DEBUG", "True").lower() in ["true", "t", "1"]
     TESTING = os.environ.get("TESTING", "False").lower() in ["true", "t", "1"]
     
-    # Database configuration
-    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql://hello_flask:hello_flask@db:5432/hello_flask_dev")
+    # Database configuration. DATABASE_URL always points straight at postgres;
+    # set PGBOUNCER_URL to send the app's own queries through the
+    # transaction-mode pooler in services/pgbouncer instead
+    DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://hello_flask:hello_flask@db:5432/hello_flask_dev")
+    PGBOUNCER_URL = os.environ.get("PGBOUNCER_URL", "")
+    DB_TRANSACTION_POOLER = bool(PGBOUNCER_URL)
+    SQLALCHEMY_DATABASE_URI = PGBOUNCER_URL or DATABASE_URL
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Streaming replicas, as a comma-separated list of URLs. Read-only views
+    # are spread across the ones that are less than REPLICA_MAX_LAG seconds
+    # behind; writes, and reads by a client that wrote in the last
+    # REPLICA_STICKY_SECONDS, always go to the primary
+    REPLICA_URLS = [url for url in os.environ.get("REPLICA_URLS", "").split(",") if url]
+    SQLALCHEMY_BINDS = {
+        f"replica_{i}": {"url": url, "connect_args": {"connect_timeout": 2}}
+        for i, url in enumerate(REPLICA_URLS)
+    }
+    REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("REPLICA_LAG_CHECK_INTERVAL", 5))
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 15))
+
+    # Server profile: how gunicorn runs the Flask app (read by gunicorn.conf.py)
+    SERVER_WORKER_CLASS = os.environ.get("SERVER_WORKER_CLASS", "sync")
+    SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 1))
+    SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 1))
+    SERVER_WORKER_CONNECTIONS = int(os.environ.get("SERVER_WORKER_CONNECTIONS", 100))
+    SERVER_KEEPALIVE = int(os.environ.get("SERVER_KEEPALIVE", 2))
+    SERVER_TIMEOUT = int(os.environ.get("SERVER_TIMEOUT", 30))
+    ASYNC_SERVER_WORKERS = int(os.environ.get("ASYNC_SERVER_WORKERS", 1))
+
+    # Connection pool per worker process. By default a worker gets one
+    # connection per request it can serve at once
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", {
+        "gthread": SERVER_THREADS,
+        "gevent": 10
+    }.get(SERVER_WORKER_CLASS, 1)))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    if DB_TRANSACTION_POOLER:
+        # pgbouncer already pools server connections, so don't hold any here
+        SQLALCHEMY_ENGINE_OPTIONS = {"poolclass": NullPool}
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True
+        }
+
+    # Prepare the hot statements on each pooled connection (project/prepared.py).
+    # Always off behind the transaction pooler, where a prepared statement
+    # doesn't follow the client from one transaction to the next
+    PREPARED_STATEMENTS = (
+        os.environ.get("PREPARED_STATEMENTS", "True").lower() in ["true", "t", "1"]
+        and not DB_TRANSACTION_POOLER
+    )
+
+    # Postgres max_connections, and how many of those to leave free for
+    # psql, the data loader and the index scripts
+    POSTGRES_MAX_CONNECTIONS = int(os.environ.get("POSTGRES_MAX_CONNECTIONS", 100))
+    POSTGRES_RESERVED_CONNECTIONS = int(os.environ.get("POSTGRES_RESERVED_CONNECTIONS", 10))
+
+    # default_pool_size + reserve_pool_size in services/pgbouncer/pgbouncer.ini
+    PGBOUNCER_SERVER_CONNECTIONS = int(os.environ.get("PGBOUNCER_SERVER_CONNECTIONS", 25))
+
+    # Token for the /admin endpoints; they are disabled while it is unset
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+    # Statements taking at least this long are printed with their parameters
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+
+    # Fraction of requests to PROFILE_ROUTES (all routes when empty) to run
+    # under cProfile, where to keep the results, and how many to keep
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+    PROFILE_ROUTES = [route for route in os.environ.get("PROFILE_ROUTES", "").split(",") if route]
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+    PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 200))
+
+    # The async serving mode (project/async_app.py) talks to the same database through asyncpg
+    ASYNC_DATABASE_URL = os.environ.get(
+        "ASYNC_DATABASE_URL",
+        SQLALCHEMY_DATABASE_URI.replace("postgresql://", "postgresql+asyncpg://", 1)
+    )
+    ASYNC_REPLICA_URLS = [url.replace("postgresql://", "postgresql+asyncpg://", 1) for url in REPLICA_URLS]
+    ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", 20))
+    ASYNC_POOL_MAX_OVERFLOW = int(os.environ.get("ASYNC_POOL_MAX_OVERFLOW", 10))
+    if DB_TRANSACTION_POOLER:
+        # asyncpg prepares every statement by default, and a prepared
+        # statement can't outlive a transaction behind pgbouncer
+        ASYNC_ENGINE_OPTIONS = {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__"
+            }
+        }
+    else:
+        ASYNC_ENGINE_OPTIONS = {
+            "pool_size": ASYNC_POOL_SIZE,
+            "max_overflow": ASYNC_POOL_MAX_OVERFLOW,
+            "pool_pre_ping": True
+        }
+
+    # Rows fetched per round trip by the streaming export endpoints
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 5000))
+
+    # Batch tweet lookup API limits and its per-worker tweet cache
+    TWEET_BATCH_MAX_IDS = int(os.environ.get("TWEET_BATCH_MAX_IDS", 1000))
+    TWEET_CACHE_SIZE = int(os.environ.get("TWEET_CACHE_SIZE", 50000))
+    TWEET_CACHE_TTL = int(os.environ.get("TWEET_CACHE_TTL", 60))
+
+    # Seconds a rendered page (and, via Cache-Control, nginx's copy of an
+    # anonymous one) and a rendered tweet card stay cached
+    PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 10))
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", 60))
+
+    # Seconds a per-user timeline page may be served from cache
+    TIMELINE_CACHE_TTL = int(os.environ.get("TIMELINE_CACHE_TTL", 10))
+
+    # Limits on how much of a conversation /tweets/<id>/thread will assemble
+    THREAD_MAX_DEPTH = int(os.environ.get("THREAD_MAX_DEPTH", 20))
+    THREAD_MAX_FANOUT = int(os.environ.get("THREAD_MAX_FANOUT", 50))
+    THREAD_MAX_NODES = int(os.environ.get("THREAD_MAX_NODES", 500))
+    THREAD_CACHE_TTL = int(os.environ.get("THREAD_CACHE_TTL", 60))
+
+    # Most suggestions /api/autocomplete returns per list (short tag
+    # prefixes have at most 20, see tweet_tags_prefix_top), and how many
+    # prefixes' suggestions each worker keeps and for how many seconds
+    AUTOCOMPLETE_MAX_LIMIT = int(os.environ.get("AUTOCOMPLETE_MAX_LIMIT", 10))
+    AUTOCOMPLETE_CACHE_SIZE = int(os.environ.get("AUTOCOMPLETE_CACHE_SIZE", 20000))
+    AUTOCOMPLETE_CACHE_TTL = int(os.environ.get("AUTOCOMPLETE_CACHE_TTL", 300))
+
+    # Parsed search queries kept per worker. Parsing only depends on the
+    # query and the text search dictionaries, so entries can live long.
+    TSQUERY_CACHE_SIZE = int(os.environ.get("TSQUERY_CACHE_SIZE", 10000))
+    TSQUERY_CACHE_TTL = int(os.environ.get("TSQUERY_CACHE_TTL", 3600))
+
+
+WORKER_CLASSES = ["sync", "gthread", "gevent"]
+
+
+def server_profile(config):
+    """
+    Summarize the worker model and how many Postgres connections it can open.
+    `config` is anything that can be indexed by setting name, like app.config.
+    """
+    per_worker = config["DB_POOL_SIZE"] + config["DB_MAX_OVERFLOW"]
+    per_async_worker = config["ASYNC_POOL_SIZE"] + config["ASYNC_POOL_MAX_OVERFLOW"]
+    if config["DB_TRANSACTION_POOLER"]:
+        # Workers only talk to pgbouncer; it alone holds postgres connections
+        total = config["PGBOUNCER_SERVER_CONNECTIONS"]
+    else:
+        total = config["SERVER_WORKERS"] * per_worker + config["ASYNC_SERVER_WORKERS"] * per_async_worker
+    budget = config["POSTGRES_MAX_CONNECTIONS"] - config["POSTGRES_RESERVED_CONNECTIONS"]
+
+    return {
+        "worker_class": config["SERVER_WORKER_CLASS"],
+        "workers": config["SERVER_WORKERS"],
+        "threads": config["SERVER_THREADS"],
+        "worker_connections": config["SERVER_WORKER_CONNECTIONS"],
+        "keepalive": config["SERVER_KEEPALIVE"],
+        "transaction_pooler": config["DB_TRANSACTION_POOLER"],
+        "prepared_statements": config["PREPARED_STATEMENTS"],
+        "timeout": config["SERVER_TIMEOUT"],
+        "async_workers": config["ASYNC_SERVER_WORKERS"],
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "connections_per_worker": per_worker,
+        "connections_per_async_worker": per_async_worker,
+        "total_connections": total,
+        "connection_budget": budget
+    }
+
+
+def validate_server_profile(config):
+    """
+    Check the server profile makes sense before any worker starts.
+    Raises ValueError listing every problem found.
+    """
+    problems = []
+    worker_class = config["SERVER_WORKER_CLASS"]
+
+    if worker_class not in WORKER_CLASSES:
+        problems.append(f"SERVER_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not '{worker_class}'")
+    if worker_class == "gevent" and importlib.util.find_spec("gevent") is None:
+        problems.append("SERVER_WORKER_CLASS is gevent but gevent is not installed")
+
+    for name in ["SERVER_WORKERS", "SERVER_THREADS", "SERVER_WORKER_CONNECTIONS", "DB_POOL_SIZE"]:
+        if config[name] < 1:
+            problems.append(f"{name} must be at least 1")
+
+    # A gthread worker runs SERVER_THREADS requests at once, and each needs its own connection
+    if worker_class == "gthread" and not config["DB_TRANSACTION_POOLER"] and config["DB_POOL_SIZE"] + config["DB_MAX_OVERFLOW"] < config["SERVER_THREADS"]:
+        problems.append("DB_POOL_SIZE + DB_MAX_OVERFLOW is smaller than SERVER_THREADS, so threads would queue for connections")
+
+    profile = server_profile(config)
+    if profile["total_connections"] > profile["connection_budget"]:
+        problems.append(
+            f"Workers can open {profile['total_connections']} connections but only "
+            f"{profile['connection_budget']} are available (POSTGRES_MAX_CONNECTIONS - POSTGRES_RESERVED_CONNECTIONS)"
+        )
+
+    if problems:
+        raise ValueError("Invalid server profile:\n  " + "\n  ".join(problems))
@@ -0,0 +1,261 @@
+import re
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from project.partitions import is_partitioned, list_partitions
+
+# One index the database should have. `definition` is everything after
+# "ON <table>", and `extension` names an extension the index needs.
+IndexSpec = namedtuple('IndexSpec', ['name', 'table', 'definition', 'extension'], defaults=[None])
+
+# Every secondary index the app relies on. manage.py sync_indexes builds the
+# ones a database is missing; schema.sql creates the same ones on a fresh
+# database, where there is nothing to lock yet.
+INDEXES = [
+    IndexSpec('idx_accounts_username', 'accounts', '(username)'),
+    IndexSpec('idx_messages_id_users_created_at', 'messages', '(id_users, created_at DESC)'),
+    IndexSpec('idx_messages_created_at', 'messages', '(created_at DESC)'),
+    IndexSpec('idx_users_screen_name', 'users', '(screen_name)'),
+    IndexSpec('idx_tweets_id_users_created_at', 'tweets', '(id_users, created_at DESC)'),
+    IndexSpec('idx_tweets_created_at', 'tweets', '(created_at DESC)'),
+    IndexSpec('idx_tweets_in_reply_to_status_id', 'tweets',
+              '(in_reply_to_status_id) WHERE in_reply_to_status_id IS NOT NULL'),
+    IndexSpec('idx_tweets_quoted_status_id', 'tweets',
+              '(quoted_status_id) WHERE quoted_status_id IS NOT NULL'),
+    IndexSpec('idx_tweet_mentions_id_users', 'tweet_mentions', '(id_users)'),
+    IndexSpec('idx_tweet_tags_id_tag', 'tweet_tags', '(id_tag)'),
+
+    # Autocomplete: ordered prefix matches, then trigram matches inside names
+    IndexSpec('idx_users_screen_name_prefix', 'users', '((lower(screen_name) COLLATE "C"))'),
+    IndexSpec('idx_users_screen_name_trgm', 'users', 'USING gin (lower(screen_name) gin_trgm_ops)', 'pg_trgm'),
+    IndexSpec('idx_users_name_trgm', 'users', 'USING gin (lower(name) gin_trgm_ops)', 'pg_trgm'),
+    IndexSpec('idx_tags_tag_prefix', 'tags', '((lower(tag) COLLATE "C"))'),
+    IndexSpec('idx_tags_tag_trgm', 'tags', 'USING gin (lower(tag) gin_trgm_ops)', 'pg_trgm'),
+    IndexSpec('idx_tweet_tags_total_tag', 'tweet_tags_total', '(tag)'),
+    IndexSpec('idx_tweet_tags_prefix_top_prefix', 'tweet_tags_prefix_top', '(prefix, total DESC)'),
+
+    # Full-text search on messages, ranked by relevance and recency
+    IndexSpec('idx_messages_rum_text_timestamp', 'messages',
+              "USING rum (to_tsvector('english', message_text) rum_tsvector_ops, created_at)", 'rum'),
+    IndexSpec('idx_messages_rum_advanced', 'messages',
+              "USING rum (to_tsvector('english', message_text) rum_tsvector_ops, created_at, id_users)", 'rum'),
+
+    # Tweet search: ranked, with the lang and country filters checked inside
+    # the index, and newest first through created_at attached to each entry
+    IndexSpec('idx_tweets_rum_text_rank', 'tweets',
+              "USING rum (text_tsv rum_tsvector_ops, id_lang rum_int2_ops, country_code rum_varchar_ops)", 'rum'),
+    IndexSpec('idx_tweets_rum_text_created_at', 'tweets',
+              "USING rum (text_tsv rum_tsvector_addon_ops, created_at) WITH (attach = 'created_at', to = 'text_tsv')",
+              'rum'),
+]
+
+EXISTING_INDEXES_SQL = text("""
+SELECT c.relname AS name, t.relname AS table, i.indisvalid AS valid,
+       i.indisunique OR i.indisprimary AS is_constraint,
+       pg_get_indexdef(i.indexrelid) AS definition
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_class t ON t.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = 'public'
+  -- the per-partition pieces of an index on a partitioned table
+  AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = i.indexrelid)
+""")
+
+# The "CREATE INDEX <name> ON [ONLY] <table> " that pg_get_indexdef() starts
+# with; what follows it is comparable with an IndexSpec's definition
+INDEXDEF_PREFIX = re.compile(r'^CREATE (?:UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ ')
+
+# Empty copy of a table that a registry definition is built on, so Postgres
+# prints it the way pg_get_indexdef() prints the real index
+PROBE_TABLE = 'index_probe'
+
+# Whether an index is valid, or None when there is no index by that name
+INDEX_VALID_SQL = text("""
+SELECT i.indisvalid
+FROM pg_index i
+WHERE i.indexrelid = to_regclass(:name)
+""")
+
+BUILD_PROGRESS_SQL = text("""
+SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+FROM pg_stat_progress_create_index
+WHERE relid = CAST(:table AS regclass)
+""")
+
+# Never-scanned indexes since statistics were last reset. Unique and primary
+# key indexes enforce constraints, so they earn their keep without scans.
+UNUSED_INDEXES_SQL = text("""
+SELECT s.indexrelname AS name, s.relname AS table,
+       pg_size_pretty(pg_relation_size(s.indexrelid)) AS size
+FROM pg_stat_user_indexes s
+JOIN pg_index i ON i.indexrelid = s.indexrelid
+WHERE s.idx_scan = 0
+  AND NOT i.indisunique
+  AND NOT i.indisprimary
+ORDER BY pg_relation_size(s.indexrelid) DESC
+""")
+
+
+def normalized_definition(indexdef):
+    """pg_get_indexdef() output without its CREATE INDEX <name> ON <table> part"""
+    return INDEXDEF_PREFIX.sub('', indexdef)
+
+
+def registry_definition(connection, spec):
+    """
+    `spec.definition` as pg_get_indexdef() prints it, with default access
+    methods, casts and parentheses filled in. It is built on an empty
+    temporary copy of the table, which is dropped again.
+    """
+    connection.execute(text(f"CREATE TEMPORARY TABLE {PROBE_TABLE} (LIKE {spec.table})"))
+    try:
+        connection.execute(text(f"CREATE INDEX {PROBE_TABLE}_index ON {PROBE_TABLE} {spec.definition}"))
+        indexdef = connection.execute(text(
+            f"SELECT pg_get_indexdef(CAST('{PROBE_TABLE}_index' AS regclass))"
+        )).scalar()
+    finally:
+        connection.execute(text(f"DROP TABLE IF EXISTS {PROBE_TABLE}"))
+    return normalized_definition(indexdef)
+
+
+def diff_indexes(connection, indexes=INDEXES):
+    """
+    Compare the registry with the database. Returns (missing, invalid,
+    changed, extra): registry entries the database lacks, registry entries
+    whose index was left invalid by an interrupted concurrent build, (spec,
+    definition in the database) pairs for indexes that exist under the
+    registry's name but with a different definition, and the names of
+    non-constraint indexes the registry doesn't know about.
+    """
+    existing = {row.name: row for row in connection.execute(EXISTING_INDEXES_SQL)}
+    wanted = {spec.name for spec in indexes}
+
+    missing = [spec for spec in indexes if spec.name not in existing]
+    invalid = [spec for spec in indexes if spec.name in existing and not existing[spec.name].valid]
+    changed = []
+    for spec in indexes:
+        row = existing.get(spec.name)
+        if row is None or not row.valid:
+            continue
+        definition = normalized_definition(row.definition)
+        if row.table != spec.table or definition != registry_definition(connection, spec):
+            changed.append((spec, definition))
+    extra = sorted(name for name, row in existing.items() if name not in wanted and not row.is_constraint)
+    return missing, invalid, changed, extra
+
+
+def extension_available(connection, extension):
+    return connection.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = :name"), {'name': extension}
+    ).scalar() is not None
+
+
+def build_concurrently(engine, name, table, definition, progress_interval=5):
+    """
+    Run CREATE INDEX CONCURRENTLY for one index on one plain table, printing
+    progress from pg_stat_progress_create_index every `progress_interval`
+    seconds while it runs.
+    """
+    error = []
+
+    def run():
+        try:
+            with engine.connect() as connection:
+                connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+        except Exception as e:
+            error.append(e)
+
+    builder = threading.Thread(target=run)
+    builder.start()
+
+    with engine.connect() as connection:
+        while builder.is_alive():
+            builder.join(progress_interval)
+            if not builder.is_alive():
+                break
+            row = connection.execute(BUILD_PROGRESS_SQL, {'table': table}).first()
+            if row is None:
+                continue
+            if row.blocks_total:
+                done = f"{row.blocks_done}/{row.blocks_total} blocks ({100 * row.blocks_done / row.blocks_total:.0f}%)"
+            elif row.tuples_total:
+                done = f"{row.tuples_done}/{row.tuples_total} tuples ({100 * row.tuples_done / row.tuples_total:.0f}%)"
+            else:
+                done = ""
+            print(f"  {name}: {row.phase} {done}")
+
+    if error:
+        raise error[0]
+
+
+def build_index(engine, spec, progress_interval=5):
+    """
+    Build one index without blocking writes to its table. `engine` must
+    connect straight to postgres in autocommit mode; a concurrent build can't
+    run in a transaction.
+
+    Postgres can't build an index on a partitioned table concurrently, so for
+    those the index is declared on the parent alone, built concurrently on
+    each partition in turn, and attached piece by piece. It becomes valid
+    once the last partition is attached. A piece left invalid by an
+    interrupted build is dropped and built again, since CREATE INDEX ... IF
+    NOT EXISTS would keep it and ATTACH would take it as it is.
+    """
+    start_time = time.time()
+
+    with engine.connect() as connection:
+        if spec.extension:
+            connection.execute(text(f"CREATE EXTENSION IF NOT EXISTS {spec.extension}"))
+        partitions = list_partitions(connection, spec.table) if is_partitioned(connection, spec.table) else []
+
+    if not partitions:
+        build_concurrently(engine, spec.name, spec.table, spec.definition, progress_interval)
+        return time.time() - start_time
+
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {spec.name} ON ONLY {spec.table} {spec.definition}"))
+
+    for partition in partitions:
+        child = f"{spec.name}_{partition[len(spec.table) + 1:]}"
+        with engine.connect() as connection:
+            if connection.execute(INDEX_VALID_SQL, {'name': child}).scalar() is False:
+                print(f"  {child}: dropping the invalid index an interrupted build left")
+                connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {child}"))
+        build_concurrently(engine, child, partition, spec.definition, progress_interval)
+        with engine.connect() as connection:
+            connection.execute(text(f"ALTER INDEX {spec.name} ATTACH PARTITION {child}"))
+
+    return time.time() - start_time
+
+
+def rebuild_index(engine, spec, progress_interval=5):
+    """
+    Replace the index named `spec.name` with one built to `spec`. The new
+    index is built next to the old one under a temporary name, the same way
+    as build_index, then the old one is dropped and the new one renamed, so
+    queries are never left without it.
+
+    Postgres can't drop an index on a partitioned table concurrently, so
+    that drop takes a brief exclusive lock on the table.
+    """
+    replacement = spec._replace(name=f"{spec.name}_new")
+    elapsed = build_index(engine, replacement, progress_interval)
+
+    with engine.connect() as connection:
+        partitions = list_partitions(connection, spec.table) if is_partitioned(connection, spec.table) else []
+        concurrently = '' if partitions else 'CONCURRENTLY '
+        connection.execute(text(f"DROP INDEX {concurrently}IF EXISTS {spec.name}"))
+        connection.execute(text(f"ALTER INDEX {replacement.name} RENAME TO {spec.name}"))
+        for partition in partitions:
+            suffix = partition[len(spec.table) + 1:]
+            connection.execute(text(f"ALTER INDEX {replacement.name}_{suffix} RENAME TO {spec.name}_{suffix}"))
+
+    return elapsed
+
+
+def unused_indexes(connection):
+    return connection.execute(UNUSED_INDEXES_SQL).all()
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent serving a request',
+    ['route', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements executed per request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent in SQL per request',
+    ['route'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+SLOW_QUERIES = Counter(
+    'sql_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS',
+    ['route']
+)
+
+# Bound parameters whose name matches are printed as REDACTED in the slow
+# query log. ORM queries number their parameters, as in password_1.
+SENSITIVE_PARAMETER = re.compile(r'password|passwd|secret|token', re.IGNORECASE)
+REDACTED = 'REDACTED'
+
+# Timings for the request being served in this thread, greenlet or task
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    __slots__ = ('route', 'started', 'sql_statements', 'sql_seconds')
+
+    def __init__(self, route):
+        self.route = route or 'unmatched'
+        self.started = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+
+def begin_request(route):
+    """
+    Start timing a request to `route`, the URL rule it matched rather than
+    the raw path, so /api/messages/alice and /api/messages/bob share a series.
+    Returns a token for end_request().
+    """
+    return _current.set(RequestStats(route))
+
+
+def end_request(token, method, status):
+    stats = _current.get()
+    _current.reset(token)
+    if stats is None:
+        return
+    REQUEST_LATENCY.labels(stats.route, method, str(status)).observe(time.perf_counter() - stats.started)
+    REQUEST_SQL_STATEMENTS.labels(stats.route).observe(stats.sql_statements)
+    REQUEST_SQL_SECONDS.labels(stats.route).observe(stats.sql_seconds)
+
+
+def redact_parameters(statement, parameters):
+    """
+    `parameters` as they can be printed: values of sensitive names replaced
+    by REDACTED. Positional parameters, as asyncpg uses, have no names, so
+    they are all redacted when the statement mentions a sensitive column.
+    """
+    if isinstance(parameters, dict):
+        return {
+            name: REDACTED if SENSITIVE_PARAMETER.search(str(name)) else value
+            for name, value in parameters.items()
+        }
+    if isinstance(parameters, list):
+        return [redact_parameters(statement, item) for item in parameters]
+    if parameters and SENSITIVE_PARAMETER.search(statement):
+        return tuple(REDACTED for _ in parameters)
+    return parameters
+
+
+def instrument_engines(slow_query_ms):
+    """
+    Count and time every statement run by any engine in the process (primary,
+    replicas, and the sync engines underneath the async ones), and print
+    statements slower than `slow_query_ms` with their parameters.
+    """
+    # A connection runs one statement at a time, so one start time per
+    # connection is enough. A statement that raises never reaches
+    # after_cursor_execute, and the next one simply overwrites its start.
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop('query_started')
+        stats = _current.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            route = stats.route if stats is not None else 'unmatched'
+            SLOW_QUERIES.labels(route).inc()
+            print(f"Slow query ({elapsed * 1000:.1f} ms) on {route}: {statement} "
+                  f"{redact_parameters(statement, parameters)!r}")
+
+
+def render_metrics():
+    """
+    Prometheus text format for this process, or for every worker when
+    PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py).
+    Returns (body, content_type).
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
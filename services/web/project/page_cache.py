@@ -0,0 +1,81 @@
+import hashlib
+
+from markupsafe import Markup
+
+from project.replicas import is_sticky
+
+# Cookies that make a page personal. A request without any of them is
+# anonymous and gets the same page as every other anonymous request.
+AUTH_COOKIES = ('username', 'password', 'id_users')
+
+
+def is_anonymous(cookies):
+    return not any(cookies.get(name) for name in AUTH_COOKIES)
+
+
+def page_cache_key(path, cookies):
+    """
+    Key a rendered page by its path and query string plus who is looking at it.
+    Anonymous requests all share one key; logged-in ones are keyed by a hash
+    of their auth cookies, so nobody is served someone else's page.
+    """
+    if is_anonymous(cookies):
+        return (path, None)
+    viewer = '|'.join(cookies.get(name, '') for name in AUTH_COOKIES)
+    return (path, hashlib.sha256(viewer.encode()).hexdigest())
+
+
+def cached_page_key(method, path, query_string, cookies):
+    """
+    The page_cache key of a request to a cached page, or None if it must
+    skip the cache: anything but GET, and anyone who just wrote something
+    and has to read it back from the primary.
+    """
+    if method != 'GET' or is_sticky(cookies, 'primary_until'):
+        return None
+    return page_cache_key(f"{path}?{query_string}", cookies)
+
+
+def page_etag(body):
+    return hashlib.md5(body).hexdigest()
+
+
+def page_entry(body):
+    """What page_cache holds for a rendered page: (body, etag)"""
+    return body, page_etag(body)
+
+
+def page_headers(etag, cookies, ttl):
+    """ETag and Cache-Control headers of a cached page"""
+    return {
+        'ETag': f'"{etag}"',
+        'Cache-Control': cache_control(is_anonymous(cookies), ttl)
+    }
+
+
+def cache_control(anonymous, ttl):
+    """
+    Anonymous pages may be kept by nginx's proxy_cache and by browsers for
+    `ttl` seconds. Logged-in pages must be revalidated with the ETag every time.
+    """
+    if anonymous:
+        return f"public, max-age={ttl}"
+    return "private, no-cache"
+
+
+def tweet_card_renderer(env, cache):
+    """
+    Build the tweet_card() template global, which renders _tweet_card.html
+    for one tweet and keeps the HTML in `cache` keyed by tweet id. Cards look
+    the same to every viewer, so they are shared between all pages.
+    """
+    def tweet_card(tweet):
+        # Tweets may be dicts or read_model rows, so look the id up the way templates do
+        tweet_id = env.getattr(tweet, 'id')
+        html = cache.get(tweet_id)
+        if html is None:
+            html = Markup(env.get_template('_tweet_card.html').render(tweet=tweet))
+            cache.set(tweet_id, html)
+        return html
+
+    return tweet_card
@@ -0,0 +1,285 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+# Tweets without a date (unhydrated ones) are stored with this created_at.
+# No monthly partition covers it, so they live in the default partition,
+# and it sorts after every real date in a newest-first list.
+UNDATED = "'-infinity'"
+
+# Tables range-partitioned by month on created_at. Each one's primary key
+# has to include created_at, so Postgres only enforces the id together with
+# its date: storing an id again under another date adds a second row
+# instead of conflicting. Writers must keep an id's created_at as it is;
+# partition_table refuses to convert a table whose ids already repeat.
+#
+# created_at becomes NOT NULL, so partition_table first gives rows without
+# one the `null_created_at` of their table: '-infinity' for tweets (see
+# UNDATED), and the time of the conversion for messages, which is what the
+# column's CURRENT_TIMESTAMP default would have stored.
+# tweets keeps one row per id in the unpartitioned tweet_ids, filled by the
+# tweets_track_id trigger. Its primary key is what stops a tweet id from
+# being stored twice under different dates, the tweet_* tables' foreign
+# keys point at it, and lookups by id read the date there first so they
+# only open the partition that holds the tweet instead of probing every
+# month's primary key. Deleting a tweet leaves its tweet_ids row behind
+# until the id is stored again, so writers that delete tweets delete it
+# too. Must match schema.sql.
+TWEET_IDS_SETUP_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS tweet_ids (
+        id_tweets BIGINT PRIMARY KEY,
+        created_at TIMESTAMPTZ NOT NULL
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION tweets_track_id() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            UPDATE tweet_ids SET created_at = NEW.created_at WHERE id_tweets = NEW.id_tweets;
+            RETURN NULL;
+        END IF;
+        -- An id that is already mapped may only move if its old row is gone,
+        -- as when an UPDATE of created_at moves the row to another partition
+        INSERT INTO tweet_ids (id_tweets, created_at) VALUES (NEW.id_tweets, NEW.created_at)
+        ON CONFLICT (id_tweets) DO UPDATE SET created_at = EXCLUDED.created_at
+        WHERE NOT EXISTS (
+            SELECT 1 FROM tweets t
+            WHERE t.id_tweets = EXCLUDED.id_tweets AND t.created_at = tweet_ids.created_at
+        );
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'tweet % is already stored under another created_at', NEW.id_tweets
+                USING ERRCODE = 'unique_violation';
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS tweets_track_id ON tweets",
+    """
+    CREATE TRIGGER tweets_track_id AFTER INSERT OR UPDATE OF created_at ON tweets
+    FOR EACH ROW EXECUTE FUNCTION tweets_track_id()
+    """,
+]
+
+PARTITIONED_TABLES = {
+    'messages': {
+        'columns': '(id_users, id_message, created_at)',
+        'id_columns': 'id_users, id_message',
+        'undated': None,
+        'null_created_at': 'CURRENT_TIMESTAMP',
+        'foreign_keys': [],
+        'id_map': None,
+        'id_map_sql': [],
+        'referenced_by': [],
+    },
+    'tweets': {
+        'columns': '(id_tweets, created_at)',
+        'id_columns': 'id_tweets',
+        'undated': UNDATED,
+        'null_created_at': UNDATED,
+        'foreign_keys': ['(id_users) REFERENCES users(id_users)'],
+        'id_map': 'tweet_ids',
+        'id_map_sql': TWEET_IDS_SETUP_SQL,
+        # Tables whose foreign keys to tweets move to tweet_ids
+        'referenced_by': ['tweet_urls', 'tweet_mentions', 'tweet_tags', 'tweet_media'],
+    },
+}
+
+# Held while partitions are created, so web and web_async starting together
+# don't race each other
+PARTITION_LOCK_ID = 4304
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection, table):
+    return connection.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :table
+    """), {'table': table}).scalar() is not None
+
+
+def list_partitions(connection, table):
+    """Names of the partitions attached to `table`, default partition included"""
+    return connection.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table
+        ORDER BY child.relname
+    """), {'table': table}).scalars().all()
+
+
+def referencing_foreign_keys(connection, table):
+    """(table, constraint name) of every foreign key that points at `table`"""
+    return connection.execute(text("""
+        SELECT c.conrelid::regclass::text AS referencing, c.conname
+        FROM pg_constraint c
+        WHERE c.contype = 'f' AND c.confrelid = CAST(:table AS regclass)
+        ORDER BY 1, 2
+    """), {'table': table}).all()
+
+
+def create_month_partition(connection, table, month):
+    """
+    Attach the partition for `month` if it doesn't exist yet. Rows for that
+    month that landed in the default partition in the meantime are moved into
+    it first; Postgres refuses to attach a partition whose range the default
+    partition already holds rows for.
+    """
+    name = partition_name(table, month)
+    if name in list_partitions(connection, table):
+        return False
+
+    start, end = month, add_months(month, 1)
+    bounds = {'start': start, 'end': end}
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default
+            WHERE created_at >= :start AND created_at < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds)
+    connection.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return True
+
+
+def ensure_partitions(connection, table, months_ahead=3, since=None):
+    """
+    Make sure `table` has a partition for every month from `since` (by
+    default the oldest row in its default partition) up to `months_ahead`
+    months from now. Returns the names of the partitions created.
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': PARTITION_LOCK_ID})
+
+    this_month = month_start(datetime.now(timezone.utc).date())
+    if since is None:
+        since = connection.execute(text(
+            f"SELECT MIN(created_at) FROM {table}_default WHERE isfinite(created_at)"
+        )).scalar()
+    month = min(this_month, month_start(since.date())) if since else this_month
+
+    created = []
+    while month <= add_months(this_month, months_ahead):
+        if create_month_partition(connection, table, month):
+            created.append(partition_name(table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def partition_table(connection, table, indexes=(), months_ahead=3, drop_old=True):
+    """
+    Turn an existing heap table into one partitioned by month on created_at,
+    copying every row across and then building `indexes` (IndexSpecs from
+    project/indexes.py) on it. Takes an ACCESS EXCLUSIVE lock on the table
+    for the whole copy, so run it in a maintenance window.
+
+    Foreign keys that point at the table can't be kept (Postgres only allows
+    them against a unique key on the partitioned table, which would have to
+    include created_at). Those from the tables in its `referenced_by` are
+    dropped and added again against its id map (tweet_ids for tweets),
+    which is filled from the copied rows.
+
+    Raises ValueError, before changing anything, if an id is stored more
+    than once (once created_at is part of the key, nothing would stop the
+    copies from ending up in different months), or if a table outside
+    `referenced_by` has a foreign key to it.
+    """
+    if is_partitioned(connection, table):
+        return False
+
+    spec = PARTITIONED_TABLES[table]
+    old = f"{table}_unpartitioned"
+
+    connection.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    repeated = connection.execute(text(f"""
+        SELECT count(*) FROM (
+            SELECT 1 FROM {table} GROUP BY {spec['id_columns']} HAVING count(*) > 1
+        ) r
+    """)).scalar()
+    if repeated:
+        raise ValueError(f"{table} has {repeated} ids stored more than once; remove the copies first")
+    foreign_keys = referencing_foreign_keys(connection, table)
+    unexpected = [f"{referencing}.{name}" for referencing, name in foreign_keys
+                  if referencing not in spec['referenced_by']]
+    if unexpected:
+        raise ValueError(f"Foreign keys to {table} would be lost: {', '.join(unexpected)}")
+
+    for referencing, name in foreign_keys:
+        connection.execute(text(f"ALTER TABLE {referencing} DROP CONSTRAINT {name}"))
+    connection.execute(text(f"UPDATE {table} SET created_at = {spec['null_created_at']} WHERE created_at IS NULL"))
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+
+    # Free up the index and constraint names for the new table
+    for index in connection.execute(text("""
+        SELECT indexname FROM pg_indexes WHERE tablename = :table
+    """), {'table': old}).scalars().all():
+        connection.execute(text(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned"))
+
+    connection.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"))
+    if spec['undated']:
+        connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET DEFAULT {spec['undated']}"))
+    connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+    connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY {spec['columns']}"))
+    for foreign_key in spec['foreign_keys']:
+        connection.execute(text(f"ALTER TABLE {table} ADD FOREIGN KEY {foreign_key}"))
+    connection.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+
+    # Partitions first, so the copy routes each row straight to its month
+    oldest = connection.execute(text(f"SELECT MIN(created_at) FROM {old} WHERE isfinite(created_at)")).scalar()
+    ensure_partitions(connection, table, months_ahead, since=oldest)
+    connection.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+
+    if spec['id_map']:
+        # Filled in one go here; the trigger keeps it up to date from now on
+        for sql in spec['id_map_sql']:
+            connection.execute(text(sql))
+        connection.execute(text(
+            f"INSERT INTO {spec['id_map']} ({spec['id_columns']}, created_at) "
+            f"SELECT {spec['id_columns']}, created_at FROM {old}"
+        ))
+        for referencing in spec['referenced_by']:
+            connection.execute(text(
+                f"ALTER TABLE {referencing} ADD FOREIGN KEY ({spec['id_columns']}) "
+                f"REFERENCES {spec['id_map']} ({spec['id_columns']})"
+            ))
+
+    # The table is locked anyway, and one build after the copy is quicker
+    # than maintaining the indexes row by row during it
+    for index in indexes:
+        connection.execute(text(f"CREATE INDEX {index.name} ON {table} {index.definition}"))
+
+    if drop_old:
+        connection.execute(text(f"DROP TABLE {old}"))
+    return True
+
+
+def detach_partition(connection, table, month):
+    """
+    Detach one month from `table`. The rows stay in a standalone table of the
+    same name, ready to be dumped and dropped, and stop showing up in queries.
+    """
+    name = partition_name(table, month)
+    if name not in list_partitions(connection, table):
+        return None
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    return name
@@ -0,0 +1,105 @@
+import re
+
+from sqlalchemy import event, text
+
+# A :name bind parameter, but not the second colon of a :: cast or the
+# minutes of a time literal
+PARAM_PATTERN = re.compile(r'(?<![:\w]):(\w+)')
+
+# Keys in a pooled connection's info dict for the names prepared on it, and
+# for the lazy ones that failed to prepare there
+INFO_KEY = 'prepared_statements'
+FAILED_INFO_KEY = 'prepared_statements_failed'
+
+
+class PreparedStatement:
+    __slots__ = ('name', 'prepare_sql', 'execute_sql', 'plain_sql', 'lazy')
+
+    def __init__(self, name, sql, lazy=False):
+        params = []
+
+        def positional(match):
+            if match.group(1) not in params:
+                params.append(match.group(1))
+            return f"${params.index(match.group(1)) + 1}"
+
+        self.name = name
+        self.prepare_sql = f"PREPARE {name} AS {PARAM_PATTERN.sub(positional, sql)}"
+        arguments = f"({', '.join(':' + param for param in params)})" if params else ''
+        self.execute_sql = text(f"EXECUTE {name}{arguments}")
+        self.plain_sql = text(sql)
+        self.lazy = lazy
+
+
+class PreparedStatements:
+    """
+    The hot statements, prepared by name on every connection the pool opens.
+
+    Postgres parses and analyzes a prepared statement once, and after a few
+    executions reuses a generic plan instead of planning each time. psycopg2
+    never prepares on its own, so without this every request parses and
+    plans the same SQL again.
+
+    A statement that fails to prepare on a connection, say because a column
+    it reads doesn't exist yet, is run as plain SQL there. When `enabled` is
+    False, as behind a transaction pooler where the next transaction may
+    land on a server connection that never saw the PREPARE, nothing is
+    prepared and every statement runs as plain SQL.
+
+    A statement added with lazy=True, one that few requests run, is prepared
+    on a connection the first time it runs there instead of when the
+    connection opens, so new connections don't pay for it up front.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.statements = {}
+
+    def add(self, name, statement, lazy=False):
+        """Register a text() statement under `name`, a valid SQL identifier. Returns the statement."""
+        self.statements[name] = PreparedStatement(name, statement.text, lazy)
+        return statement
+
+    def install(self, engines):
+        """Prepare every registered statement on each new connection of `engines`"""
+        if not self.enabled:
+            return
+        for engine in engines:
+            event.listen(engine, 'connect', self.prepare_connection)
+
+    def prepare_connection(self, dbapi_connection, connection_record):
+        prepared = connection_record.info.setdefault(INFO_KEY, set())
+        cursor = dbapi_connection.cursor()
+        for name, statement in self.statements.items():
+            if statement.lazy:
+                continue
+            try:
+                cursor.execute(statement.prepare_sql)
+                dbapi_connection.commit()
+                prepared.add(name)
+            except Exception as e:
+                dbapi_connection.rollback()
+                print(f"Error preparing statement {name}: {e}")
+        cursor.close()
+
+    def execute(self, session, name, params=None):
+        """Run statement `name` in `session`, by name where it was prepared on the session's connection"""
+        statement = self.statements[name]
+        if self.enabled:
+            info = session.connection().info
+            if statement.lazy and name not in info.get(INFO_KEY, ()) and name not in info.get(FAILED_INFO_KEY, ()):
+                self.prepare_lazily(session, statement)
+            if name in info.get(INFO_KEY, ()):
+                return session.execute(statement.execute_sql, params or {})
+        return session.execute(statement.plain_sql, params or {})
+
+    def prepare_lazily(self, session, statement):
+        """Prepare a lazy statement on the session's connection, in a savepoint so a failure leaves the transaction usable"""
+        connection = session.connection()
+        try:
+            with session.begin_nested():
+                connection.exec_driver_sql(statement.prepare_sql)
+            connection.info.setdefault(INFO_KEY, set()).add(statement.name)
+        except Exception as e:
+            connection.info.setdefault(FAILED_INFO_KEY, set()).add(statement.name)
+            print(f"Error preparing statement {statement.name}: {e}")
@@ -0,0 +1,85 @@
+import io
+import os
+import re
+import time
+import random
+import pstats
+import cProfile
+
+# The orders report() accepts
+SORT_KEYS = sorted(key.value for key in pstats.SortKey)
+
+
+class RequestProfiler:
+    """
+    Runs cProfile around single requests and keeps the results as .prof files
+    in `directory`, which snakeviz, flameprof or `python -m pstats` can open.
+
+    A request is profiled when an admin asks for it, or at random with
+    probability `sample_rate` when its route is in `routes` (every route if
+    `routes` is empty). With sample_rate at 0 the only cost to other requests
+    is the check in should_sample().
+    """
+
+    def __init__(self, directory, sample_rate=0.0, routes=(), max_files=200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.routes = set(routes)
+        self.max_files = max_files
+
+    def should_sample(self, route):
+        if not self.sample_rate:
+            return False
+        if self.routes and route not in self.routes:
+            return False
+        return random.random() < self.sample_rate
+
+    def start(self):
+        """Return an enabled profiler, or None if another one already runs in this thread"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return None
+        return profiler
+
+    def finish(self, profiler, route, elapsed):
+        """Stop `profiler`, save its stats and return the file name"""
+        profiler.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route or 'unmatched').strip('_') or 'root'
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{slug}-{int(elapsed * 1000)}ms.prof"
+        profiler.dump_stats(os.path.join(self.directory, name))
+        self.prune()
+        return name
+
+    def prune(self):
+        names = self.list()
+        for name in names[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def list(self):
+        """Saved profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        # Names start with a timestamp, so they sort by age
+        return sorted((name for name in os.listdir(self.directory) if name.endswith('.prof')), reverse=True)
+
+    def path(self, name):
+        """Full path of a saved profile, or None if there is no such file"""
+        if os.path.basename(name) != name or not name.endswith('.prof'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
+
+    def report(self, name, sort='cumulative', limit=50):
+        """The top `limit` functions of a saved profile as pstats text, ordered by one of SORT_KEYS"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        output = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
@@ -0,0 +1,102 @@
+from collections import namedtuple
+
+from sqlalchemy import text
+
+# Rows for the list pages. They select only what root.html, all_messages.html
+# and _tweet_card.html show, and are built straight from the result rows as
+# named tuples, with no ORM entities or identity map in between. Templates
+# read them like the dicts they replace.
+
+# Newest messages first with their author, for / and /all_messages
+MESSAGES_PAGE_SQL = text("""
+SELECT m.id_message, m.message_text, m.created_at, m.id_users, a.username
+FROM messages m
+JOIN accounts a ON m.id_users = a.id_users
+ORDER BY m.created_at DESC
+LIMIT :limit OFFSET :offset
+""")
+
+# The columns of a TweetRow. Tags, mentions, media and urls come from the
+# batch lookups, see tweet_rows. Undated tweets come back with created_at None.
+TWEET_ROW_COLUMNS = """
+SELECT t.id_tweets, t.text, NULLIF(t.created_at, '-infinity') AS created_at, t.retweet_count, t.favorite_count,
+       t.quote_count, s.source, l.lang, t.quoted_status_id,
+       t.place_name, t.country_code, t.state_code,
+       u.id_users, u.screen_name, u.name, u.description, u.location, u.verified, u.url
+"""
+
+# Newest tweets first with their author, for /tweets. Undated tweets sort last.
+TWEETS_PAGE_SQL = text(f"""{TWEET_ROW_COLUMNS}
+FROM tweets t
+JOIN users u ON u.id_users = t.id_users
+LEFT JOIN tweet_sources s ON s.id_source = t.id_source
+LEFT JOIN langs l ON l.id_lang = t.id_lang
+ORDER BY t.created_at DESC
+LIMIT :limit OFFSET :offset
+""")
+
+# The same rows for a list of ids, in no particular order, for pages that
+# find their tweet ids some other way. Goes through tweet_ids so each id
+# touches one partition.
+TWEET_ROWS_BY_ID_SQL = text(f"""{TWEET_ROW_COLUMNS}
+FROM tweet_ids i
+JOIN tweets t ON t.id_tweets = i.id_tweets AND t.created_at = i.created_at
+JOIN users u ON u.id_users = t.id_users
+LEFT JOIN tweet_sources s ON s.id_source = t.id_source
+LEFT JOIN langs l ON l.id_lang = t.id_lang
+WHERE i.id_tweets = ANY(:ids)
+""")
+
+MessageRow = namedtuple('MessageRow', ['id', 'text', 'created_at', 'username', 'is_own'])
+
+TweetRow = namedtuple('TweetRow', [
+    'id', 'text', 'created_at', 'retweet_count', 'favorite_count', 'quote_count',
+    'source', 'lang', 'user', 'hashtags', 'mentions', 'media', 'urls',
+    'is_retweet', 'is_quote', 'location',
+])
+TweetUser = namedtuple('TweetUser', ['id', 'screen_name', 'name', 'description', 'location', 'verified', 'url'])
+TweetLocation = namedtuple('TweetLocation', ['place_name', 'country_code', 'state_code'])
+
+NO_RELATIONS = {}
+
+
+def message_rows(rows, user_id):
+    """MessageRows from MESSAGES_PAGE_SQL rows, flagging the ones `user_id` wrote"""
+    return [
+        MessageRow(
+            row.id_message, row.message_text, row.created_at, row.username,
+            str(row.id_users) == user_id if user_id else False
+        )
+        for row in rows
+    ]
+
+
+def tweet_rows(rows, related):
+    """
+    TweetRows from TWEETS_PAGE_SQL or TWEET_ROWS_BY_ID_SQL rows. `related` maps id_tweets to the
+    tweet dicts of the batch lookups (project.get_tweets_by_id), which
+    supply the relation lists.
+    """
+    tweets = []
+    for row in rows:
+        extra = related.get(row.id_tweets, NO_RELATIONS)
+        tweets.append(TweetRow(
+            row.id_tweets, row.text, row.created_at, row.retweet_count,
+            row.favorite_count, row.quote_count, row.source, row.lang,
+            TweetUser(row.id_users, row.screen_name, row.name, row.description,
+                      row.location, row.verified, row.url),
+            extra.get('tags', []),
+            extra.get('mentions', []),
+            extra.get('media', []),
+            [{'url': url} for url in extra.get('urls', [])],
+            row.text.startswith('RT @'),
+            row.quoted_status_id is not None,
+            TweetLocation(row.place_name, row.country_code, row.state_code),
+        ))
+    return tweets
+
+
+def pagination(page, per_page, total_count):
+    """(total_pages, has_prev, has_next) of page `page` of `total_count` rows"""
+    total_pages = max(1, (total_count + per_page - 1) // per_page)
+    return total_pages, page > 1, page < total_pages
@@ -0,0 +1,76 @@
+import random
+import time
+import threading
+
+from sqlalchemy import text
+
+# Seconds this replica is behind its primary. A replica that has replayed
+# everything it received is up to date even if the primary has been idle
+# since, and a server that isn't in recovery is a primary.
+REPLICA_LAG_SQL = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+
+
+class ReplicaRouter:
+    """
+    Keeps track of how far behind each replica is and picks one that is
+    close enough to the primary to serve reads.
+
+    Lag readings expire after `check_interval` seconds. The router doesn't
+    talk to the database itself: callers measure every key in stale_keys()
+    with REPLICA_LAG_SQL (sync or async), hand the result to record_lag(),
+    and then call choose().
+    """
+
+    def __init__(self, bind_keys, max_lag=5, check_interval=5):
+        self.bind_keys = list(bind_keys)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._readings = {}
+        self._lock = threading.Lock()
+
+    def stale_keys(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                key for key in self.bind_keys
+                if key not in self._readings or self._readings[key][0] < now
+            ]
+
+    def record_lag(self, key, lag):
+        """Store a lag reading in seconds; pass None if the replica couldn't be reached"""
+        with self._lock:
+            self._readings[key] = (time.monotonic() + self.check_interval, lag)
+
+    def choose(self):
+        """Return a random replica whose lag is within max_lag, or None to use the primary"""
+        with self._lock:
+            healthy = [
+                key for key, (_, lag) in self._readings.items()
+                if lag is not None and lag <= self.max_lag
+            ]
+        return random.choice(healthy) if healthy else None
+
+    def status(self):
+        with self._lock:
+            return {
+                key: {
+                    "lag_seconds": self._readings[key][1] if key in self._readings else None,
+                    "healthy": key in self._readings and self._readings[key][1] is not None
+                               and self._readings[key][1] <= self.max_lag
+                }
+                for key in self.bind_keys
+            }
+
+
+def is_sticky(cookies, cookie_name):
+    """True if this client wrote something recently and should read from the primary"""
+    try:
+        return float(cookies.get(cookie_name, 0)) > time.time()
+    except ValueError:
+        return False
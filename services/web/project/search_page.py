@@ -0,0 +1,136 @@
+import re
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from markupsafe import Markup, escape
+
+from project import tweet_search
+from project.read_model import pagination
+
+# The /search page, which both apps serve: what a request asks for, the
+# result dicts search.html shows, and the template context. The apps only
+# run the searches (project.search_messages / search_tweets and their async
+# versions) and render.
+
+PER_PAGE = 30
+
+# What one /search request asks for. `mode` is 'messages' or 'tweets';
+# `filters` and `order` only apply to tweets.
+SearchRequest = namedtuple('SearchRequest', ['query', 'mode', 'filters', 'order', 'page'])
+
+
+def parse_search(query_text, values, args):
+    """
+    The SearchRequest for `query_text`, the form and query string `values`
+    and the query string `args`, which hold the page number
+    """
+    mode = 'tweets' if values.get('mode') == 'tweets' else 'messages'
+    filters, order = tweet_search.parse_filters(values)
+    return SearchRequest(query_text, mode, filters, order, int(args.get('page', 1)))
+
+
+def search_offset(search):
+    return (search.page - 1) * PER_PAGE
+
+
+def highlight_terms(message_text, query_text):
+    """
+    Wrap each search term longer than two characters in a highlight span.
+    The text is user content, so everything outside the spans is escaped;
+    returns Markup.
+    """
+    terms = {term for term in re.findall(r'\w+', query_text.lower()) if len(term) > 2}  # Only highlight meaningful terms
+    if not terms:
+        return escape(message_text)
+
+    # One pass over the raw text, so a term can't match inside an escaped
+    # entity or inside a span added for another term
+    pattern = re.compile(
+        r'\b(' + '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)) + r')\b',
+        re.IGNORECASE
+    )
+    parts = []
+    position = 0
+    for match in pattern.finditer(message_text):
+        parts.append(escape(message_text[position:match.start()]))
+        parts.append(Markup('<span class="highlight">%s</span>') % match.group(1))
+        position = match.end()
+    parts.append(escape(message_text[position:]))
+    return Markup('').join(parts)
+
+
+def message_results(rows, query_text, user_id):
+    """Result dicts from SEARCH_SQL rows, flagging the messages `user_id` wrote"""
+    return [
+        {
+            'id': row.id_message,
+            'text': row.message_text,
+            'highlighted_text': highlight_terms(row.message_text, query_text),
+            'created_at': row.created_at,
+            'username': row.username,
+            'is_own': str(row.id_users) == user_id if user_id else False
+        }
+        for row in rows
+    ]
+
+
+def tweet_results(rows, query_text):
+    """Result dicts from tweet_search page rows"""
+    results = []
+    for row in rows:
+        tweet = tweet_search.format_tweet_result(row)
+        tweet['highlighted_text'] = highlight_terms(tweet['text'], query_text)
+        results.append(tweet)
+    return results
+
+
+def search_page_params(query_text, mode, filters, order):
+    """The search as a query string, for the pagination links"""
+    params = {'query': query_text, 'mode': mode}
+    if mode == 'tweets':
+        params.update({
+            'lang': filters.get('lang', ''),
+            'country': filters.get('country_code', ''),
+            'tag': filters.get('tag', ''),
+            'order': order
+        })
+    return urlencode({name: value for name, value in params.items() if value})
+
+
+def page_context(search, results, total_results, query_time_ms):
+    """search.html's context for a search that ran, or for no search at all"""
+    total_pages, has_prev, has_next = pagination(search.page, PER_PAGE, total_results)
+    return dict(
+        results=results,
+        query=search.query,
+        mode=search.mode,
+        filters=search.filters,
+        order=search.order,
+        page_params=search_page_params(search.query, search.mode, search.filters, search.order),
+        page=search.page,
+        total_pages=total_pages,
+        total_results=total_results,
+        has_prev=has_prev,
+        has_next=has_next,
+        query_time_ms=query_time_ms
+    )
+
+
+def error_context(search, error):
+    """search.html's context for a search that failed"""
+    # Make sure to define all template variables even when an exception occurs
+    return dict(
+        error=f"Search error: {error}",
+        query=search.query,
+        mode=search.mode,
+        filters=search.filters,
+        order=search.order,
+        page_params='',
+        results=[],
+        total_results=0,
+        page=search.page,
+        total_pages=0,
+        has_prev=False,
+        has_next=False,
+        query_time_ms=None
+    )
@@ -0,0 +1,156 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlalchemy import text
+
+# Longer input is cut off before parsing
+MAX_QUERY_LENGTH = 256
+
+# An optional leading "-", then a double-quoted phrase (the closing quote may
+# be missing) or a run of anything but whitespace
+TOKEN_PATTERN = re.compile(r'(-?)(?:"([^"]*)"?|(\S+))')
+
+# A search box query, parsed. `canonical` is the same for inputs that mean
+# the same thing and keys the caches; `function` and `argument` are what
+# turns it into a tsquery in Postgres.
+ParsedQuery = namedtuple('ParsedQuery', ['canonical', 'function', 'argument'])
+
+# One term of a query: the words of a word or phrase, whether it is
+# negated, and whether its last word is a prefix
+Term = namedtuple('Term', ['words', 'negated', 'prefix'])
+
+
+def tokenize(query):
+    """Split `query` into Terms, with the string 'or' between terms where the user wrote OR"""
+    items = []
+    for match in TOKEN_PATTERN.finditer(query[:MAX_QUERY_LENGTH].lower()):
+        negated, phrase, word = match.group(1) == '-', match.group(2), match.group(3)
+        if word == 'or' and not negated:
+            items.append('or')
+            continue
+        source = phrase if phrase is not None else word
+        words = re.findall(r'\w+', source)
+        if words:
+            items.append(Term(words, negated, phrase is None and source.endswith('*')))
+
+    # Drop ORs with no term on one side, and repeats
+    cleaned = []
+    for item in items:
+        if item == 'or' and (not cleaned or cleaned[-1] == 'or'):
+            continue
+        cleaned.append(item)
+    if cleaned and cleaned[-1] == 'or':
+        cleaned.pop()
+    return cleaned
+
+
+def canonical_form(items):
+    parts = []
+    for item in items:
+        if item == 'or':
+            parts.append('or')
+            continue
+        if len(item.words) > 1:
+            body = '"' + ' '.join(item.words) + '"'
+        else:
+            body = item.words[0] + ('*' if item.prefix else '')
+        parts.append(('-' if item.negated else '') + body)
+    return ' '.join(parts)
+
+
+def to_tsquery_syntax(items):
+    """The query in to_tsquery's own syntax, which websearch_to_tsquery can't express prefixes in"""
+    parts = []
+    for item in items:
+        if item == 'or':
+            parts.append('|')
+            continue
+        if parts and parts[-1] != '|':
+            parts.append('&')
+        lexemes = [f"'{word}'" for word in item.words]
+        if item.prefix:
+            lexemes[-1] += ':*'
+        body = lexemes[0] if len(lexemes) == 1 else '(' + ' <-> '.join(lexemes) + ')'
+        parts.append(('!' if item.negated else '') + body)
+    return ' '.join(parts)
+
+
+def parse(query):
+    """
+    Parse search box input into a ParsedQuery, or None if it has no words.
+
+    Understands what people type into search boxes: "quoted phrases", -word
+    to exclude, OR between alternatives, and word* for a prefix. Anything
+    else that isn't a letter or digit only separates words, so no input can
+    be a tsquery syntax error. Queries without a prefix go through
+    websearch_to_tsquery; prefixes need to_tsquery, so those are rewritten
+    into its syntax.
+    """
+    items = tokenize(query)
+    if not items:
+        return None
+    canonical = canonical_form(items)
+    if any(item != 'or' and item.prefix for item in items):
+        return ParsedQuery(canonical, 'to_tsquery', to_tsquery_syntax(items))
+    return ParsedQuery(canonical, 'websearch_to_tsquery', canonical)
+
+
+@lru_cache(maxsize=32)
+def tsquery_sql(function, config):
+    """Statement turning :argument into tsquery text with one text search configuration (an SQL expression)"""
+    return text(f"SELECT CAST({function}({config}, :argument) AS TEXT)")
+
+
+def term_groups(items):
+    """The Terms of tokenize() output in groups: terms in a group are AND-ed, the groups OR-ed"""
+    groups = [[]]
+    for item in items:
+        if item == 'or':
+            groups.append([])
+        else:
+            groups[-1].append(item)
+    return groups
+
+
+@lru_cache(maxsize=32)
+def any_config_tsquery_sql(shape, configs):
+    """
+    Statement turning :term_0, :term_1, ... into tsquery text, each term
+    parsed with every one of the configurations `configs` (a query with a
+    `config` column) and OR-ed on its own before the terms are combined.
+    `shape` has one tuple per group of term_groups, with a negated flag per
+    term. A negated term then excludes the word in every configuration's
+    form, where negating it inside each configuration's whole query and
+    OR-ing those would let the others' forms through.
+    """
+    index = 0
+    groups = []
+    for group in shape:
+        terms = []
+        for negated in group:
+            term = f"(SELECT tsquery_or_agg(to_tsquery(config, :term_{index})) FROM ({configs}) configs)"
+            terms.append('!!' + term if negated else term)
+            index += 1
+        groups.append('(' + ' && '.join(terms) + ')')
+    return text(f"SELECT CAST({' || '.join(groups)} AS TEXT)")
+
+
+def tsquery_lookup(parsed, config=None, configs=None, params=None):
+    """
+    (statement, params, cache key) that turn `parsed` into tsquery text, with
+    the one configuration `config` or OR-ed over `configs` term by term. The
+    cache key is the same for every input with the same canonical form.
+    """
+    params = params or {}
+    key = (config or configs, tuple(sorted(params.items())), parsed.canonical)
+    if config is not None:
+        statement = tsquery_sql(parsed.function, config)
+        return statement, dict(params, argument=parsed.argument), key
+
+    # The canonical form tokenizes back into the same terms
+    groups = term_groups(tokenize(parsed.canonical))
+    statement = any_config_tsquery_sql(tuple(tuple(term.negated for term in group) for group in groups), configs)
+    terms = [term for group in groups for term in group]
+    arguments = {f'term_{index}': to_tsquery_syntax([term._replace(negated=False)]) for index, term in enumerate(terms)}
+    return statement, dict(params, **arguments), key
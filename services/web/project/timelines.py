@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import text
+
+# The per-user timeline APIs page with keyset cursors: each page is the rows
+# older than the last one of the page before, found by walking the
+# (id_users, created_at DESC) index from there, however deep the page is.
+# Both apps build the statements and payloads here and only run them.
+
+ACCOUNT_ID_SQL = text("SELECT id_users FROM accounts WHERE username = :username LIMIT 1")
+
+# What one /api/messages/<username> request asks for. `params` are the
+# statement's parameters except id_users, and `cache_key` keys the page in
+# message_timeline_cache.
+TimelineQuery = namedtuple('TimelineQuery', ['statement', 'params', 'per_page', 'cache_key'])
+
+
+def encode_cursor(created_at, row_id):
+    """
+    Encode the last row of a page as an opaque keyset pagination cursor.
+    A tweet without a date (created_at None) is encoded as the '-infinity'
+    it is stored as.
+    """
+    raw = f"{created_at.isoformat() if created_at else '-infinity'}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor back into (created_at, row_id),
+    with created_at None for an undated tweet.
+    Raises ValueError if the cursor is malformed.
+    """
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    created_at, row_id = raw.split('|')
+    return (None if created_at == '-infinity' else datetime.fromisoformat(created_at)), int(row_id)
+
+
+@lru_cache(maxsize=4)
+def message_timeline_sql(since, cursor):
+    """One page of a user's messages, newest first, with or without the since and cursor bounds"""
+    where = ["id_users = :id_users"]
+    if since:
+        where.append("created_at > :since")
+    if cursor:
+        where.append("(created_at, id_message) < (:cursor_created_at, :cursor_id)")
+    return text(f"""
+    SELECT id_message, message_text, created_at
+    FROM messages
+    WHERE {' AND '.join(where)}
+    ORDER BY created_at DESC, id_message DESC
+    LIMIT :limit
+    """)
+
+
+def message_timeline_query(username, args):
+    """
+    The TimelineQuery for `username` from the request args `limit`, `cursor`
+    and `since`. Raises ValueError for a malformed one.
+    """
+    cursor = args.get('cursor')
+    since = args.get('since')
+    per_page = min(max(int(args.get('limit', 50)), 1), 200)
+
+    # One extra row tells whether there is another page
+    params = {'limit': per_page + 1}
+    if cursor:
+        params['cursor_created_at'], params['cursor_id'] = decode_cursor(cursor)
+    if since:
+        params['since'] = datetime.fromisoformat(since)
+
+    return TimelineQuery(
+        message_timeline_sql(bool(since), bool(cursor)), params, per_page, (username, cursor, since, per_page)
+    )
+
+
+def message_timeline_page(username, rows, per_page):
+    """
+    (etag, last_modified, payload) for the rows of a TimelineQuery, which
+    may hold one row more than `per_page`
+    """
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id_message)
+
+    messages = [
+        {
+            "id": row.id_message,
+            "text": row.message_text,
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        }
+        for row in rows
+    ]
+    payload = {
+        "status": "success",
+        "username": username,
+        "message_count": len(messages),
+        "messages": messages,
+        "next_cursor": next_cursor
+    }
+    etag = hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    last_modified = rows[0].created_at if rows else None
+    return etag, last_modified, payload
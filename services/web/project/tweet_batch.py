@@ -0,0 +1,33 @@
+# Request and response of /api/tweets/batch, which both apps serve from the
+# tweet batch lookups (project.get_tweets_by_id and its async version)
+
+
+def parse_batch(payload, max_ids):
+    """
+    The tweet ids a batch request body asks for, as ints in the requested
+    order with duplicates dropped. `payload` is the decoded JSON body, or
+    None if it wasn't JSON. Raises ValueError with the message for the 400
+    response.
+    """
+    tweet_ids = payload.get('id_tweets') if isinstance(payload, dict) else None
+
+    if not isinstance(tweet_ids, list) or not tweet_ids:
+        raise ValueError("Request body must be JSON with a non-empty 'id_tweets' list")
+
+    if len(tweet_ids) > max_ids:
+        raise ValueError(f"At most {max_ids} id_tweets can be requested at once")
+
+    try:
+        # dict.fromkeys drops duplicates but keeps the requested order
+        return list(dict.fromkeys(int(tweet_id) for tweet_id in tweet_ids))
+    except (TypeError, ValueError):
+        raise ValueError("id_tweets must all be integers")
+
+
+def batch_result(tweet_ids, tweets):
+    """The response body for `tweet_ids`, given the tweets found keyed by id"""
+    return {
+        "status": "success",
+        "tweets": [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets],
+        "missing": [tweet_id for tweet_id in tweet_ids if tweet_id not in tweets]
+    }
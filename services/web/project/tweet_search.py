@@ -0,0 +1,176 @@
+from functools import lru_cache
+from itertools import combinations
+
+from sqlalchemy import text
+
+from project.search_query import tsquery_lookup
+
+# The text search configuration for each tweets.lang code Postgres has a
+# stemmer for. Anything else, and tweets without a lang, use 'simple', which
+# only lowercases.
+TEXT_SEARCH_CONFIGS = {
+    'ar': 'arabic', 'da': 'danish', 'de': 'german', 'el': 'greek', 'en': 'english',
+    'es': 'spanish', 'fi': 'finnish', 'fr': 'french', 'ga': 'irish', 'hu': 'hungarian',
+    'id': 'indonesian', 'it': 'italian', 'lt': 'lithuanian', 'ne': 'nepali', 'nl': 'dutch',
+    'no': 'norwegian', 'pt': 'portuguese', 'ro': 'romanian', 'ru': 'russian', 'sv': 'swedish',
+    'ta': 'tamil', 'tr': 'turkish',
+}
+
+
+def ts_config_function_sql():
+    cases = '\n'.join(f"        WHEN '{lang}' THEN '{config}'" for lang, config in sorted(TEXT_SEARCH_CONFIGS.items()))
+    return f"""
+    CREATE OR REPLACE FUNCTION ts_config_for(lang TEXT) RETURNS regconfig
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT (CASE lang
+{cases}
+        ELSE 'simple' END)::regconfig
+    $$
+    """
+
+
+# Everything tweet search needs on top of the base schema, as in schema.sql.
+# Each statement can be run again safely.
+SETUP_SQL = [
+    ts_config_function_sql(),
+    # OR-combines the tsqueries of every language, for searches across all of them
+    """
+    CREATE OR REPLACE AGGREGATE tsquery_or_agg(tsquery) (SFUNC = tsquery_or, STYPE = tsquery)
+    """,
+    "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS text_tsv tsvector",
+    """
+    CREATE OR REPLACE FUNCTION tweets_text_tsv() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.text_tsv := to_tsvector(
+            ts_config_for((SELECT lang FROM langs WHERE id_lang = NEW.id_lang)),
+            COALESCE(NEW.text, '')
+        );
+        RETURN NEW;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS tweets_text_tsv ON tweets",
+    """
+    CREATE TRIGGER tweets_text_tsv BEFORE INSERT OR UPDATE OF text, id_lang ON tweets
+    FOR EACH ROW EXECUTE FUNCTION tweets_text_tsv()
+    """,
+]
+
+# How the search box query is parsed (see project.search_query). With a
+# lang filter it is parsed with that language's configuration; otherwise
+# each term is parsed with every configuration in use, OR-ed together, so a
+# tweet matches whichever language it was indexed in.
+LANG_CONFIG = "ts_config_for(:lang)"
+ALL_LANGS_CONFIGS = "SELECT ts_config_for(lang) AS config FROM langs UNION SELECT ts_config_for(NULL)"
+
+# The searches take the parsed query as a parameter, a constant to the
+# planner, so the RUM indexes can use it for matching and for ordering
+TSQUERY = "CAST(:tsquery AS tsquery)"
+
+# Optional filters, each one an indexed predicate: id_lang and country_code
+# are columns of idx_tweets_rum_text_rank, and tags are found through
+# idx_tweet_tags_id_tag
+FILTERS = {
+    'lang': "t.id_lang = (SELECT id_lang FROM langs WHERE lang = :lang)",
+    'country_code': "t.country_code = :country_code",
+    'tag': """EXISTS (
+        SELECT 1 FROM tweet_tags tt
+        WHERE tt.id_tweets = t.id_tweets
+          AND tt.id_tag = (SELECT id_tag FROM tags WHERE tag = :tag)
+    )""",
+}
+
+# Result orders, each served by one of the RUM indexes. <=> on a tsvector
+# is the inverse of its rank; on a timestamp, the distance from now.
+ORDERS = {
+    'rank': "t.text_tsv <=> {tsquery}",
+    'newest': "t.created_at <=> now()",
+}
+
+
+@lru_cache(maxsize=64)
+def search_sql(filters, order):
+    """
+    (count, page) statements for a tweet search with the given filter names,
+    which must be a sorted tuple of FILTERS keys, and order from ORDERS
+    """
+    where = ' AND '.join([f"t.text_tsv @@ {TSQUERY}"] + [FILTERS[name] for name in filters])
+
+    count_sql = text(f"""
+    SELECT COUNT(*)
+    FROM tweets t
+    WHERE {where}
+    """)
+    page_sql = text(f"""
+    SELECT t.id_tweets, t.text, NULLIF(t.created_at, '-infinity') AS created_at, t.country_code, t.id_users,
+           u.screen_name, u.name, l.lang
+    FROM tweets t
+    LEFT JOIN users u ON u.id_users = t.id_users
+    LEFT JOIN langs l ON l.id_lang = t.id_lang
+    WHERE {where}
+    ORDER BY {ORDERS[order].format(tsquery=TSQUERY)}
+    LIMIT :limit OFFSET :offset
+    """)
+    return count_sql, page_sql
+
+
+def filter_sets():
+    """Every sorted tuple of FILTERS keys that search_sql accepts"""
+    names = sorted(FILTERS)
+    for size in range(len(names) + 1):
+        yield from combinations(names, size)
+
+
+def statement_names(filters, order):
+    """Names of the search_sql statements for `filters` and `order` in the prepared statement registry"""
+    suffix = ''.join('_' + name for name in filters)
+    return f"tweet_search_count{suffix}", f"tweet_search_page{suffix}_{order}"
+
+
+def search_tsquery_lookup(parsed, filters):
+    """project.search_query.tsquery_lookup for a tweet search with `filters`"""
+    if 'lang' in filters:
+        return tsquery_lookup(parsed, config=LANG_CONFIG, params={'lang': filters['lang']})
+    return tsquery_lookup(parsed, configs=ALL_LANGS_CONFIGS)
+
+
+def parse_filters(args):
+    """
+    The tweet search filters and order in request args `args`, normalized the
+    way tweets store them. Returns (filter params, order).
+    """
+    params = {}
+    if args.get('lang'):
+        params['lang'] = args['lang'].strip().lower()
+    if args.get('country'):
+        params['country_code'] = args['country'].strip().lower()
+    if args.get('tag'):
+        tag = args['tag'].strip()
+        params['tag'] = tag if tag.startswith(('#', '$')) else '#' + tag
+    order = args.get('order') if args.get('order') in ORDERS else 'rank'
+    return params, order
+
+
+def format_tweet_result(row):
+    return {
+        'id': row.id_tweets,
+        'text': row.text or '',
+        'created_at': row.created_at,
+        'screen_name': row.screen_name,
+        'name': row.name,
+        'lang': row.lang,
+        'country_code': row.country_code,
+    }
+
+
+def backfill_text_tsv(connection, relation):
+    """Compute text_tsv for the rows of one tweets partition that don't have it yet"""
+    return connection.execute(text(f"""
+        UPDATE {relation} t
+        SET text_tsv = to_tsvector(
+            ts_config_for((SELECT lang FROM langs WHERE id_lang = t.id_lang)),
+            COALESCE(t.text, '')
+        )
+        WHERE t.text_tsv IS NULL
+    """)).rowcount